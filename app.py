@@ -4,112 +4,175 @@ TC Bridge Controller - A Python-based UI for managing network bridges with traff
 """
 
 import os
-import subprocess
 import json
 import time
+import re
 import threading
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
+import sqlite3
+from concurrent.futures import Future
+from flask import Flask, Response, render_template, request, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import psutil
-import netifaces
 from config import *
+import netns
+from exporter import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsExporter
+from history import HISTORY_METRICS, HistoryStore
+from io_pool import IOPool
+from metrics import EMIT_SECONDS, INTERFACE_STATS_SECONDS, MONITOR_SECONDS, perf_report
+from playback import PlaybackRunner, compile_trace, load_trace
+from prober import LatencyProbe
+from profiler import SamplingProfiler
+from push import FRAME_EVENT, StatsPublisher
+from store import StateStore
+from stats import COUNTER_FIELDS, StatsSampler, derived_stats
+from stats_stream import CONTENT_TYPES as STREAM_CONTENT_TYPES, StreamEncoder
+from backends import create_backend, format_qdisc
+from collector import CollectorClient, CollectorServer, forward_request
+from tc_batch import describe_failures
+from tc_queue import TCUpdateQueue
+from tc_stats import TCStatsCache
+from topology import TopologyCache
+from tc_model import (DIRECTIONS, IFB_PREFIX, INGRESS_HANDLE, INGRESS_PARENT, build_profile_tree,
+                      ROOT_HANDLE, build_tree as build_tc_tree, has_redirect, ifb_name,
+                      plan_changes as plan_tc_changes, plan_redirect, read_tree as read_tc_tree, tree_settings)
+
+# Sandbox mode: every kernel access (ip/tc, netlink, sysfs, /proc) happens
+# inside NETNS. Entered before any thread exists so all of them inherit it.
+if NETNS and ROLE != 'web':
+    netns.enter(NETNS)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'tc-bridge-secret-key'
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
 
 class NetworkBridge:
-    def __init__(self):
-        self.bridge_name = BRIDGE_NAME
+    def __init__(self, bridge_name=BRIDGE_NAME, bridge_ip=BRIDGE_IP, backend=None, topology=None, sampler=None,
+                 store=None):
+        self.bridge_name = bridge_name
         self.interfaces = []
-        self.bridge_ip = BRIDGE_IP
+        self.bridge_ip = bridge_ip
         self.is_active = False
+        self.backend = backend or create_backend(BACKEND)
+        # Links and addresses, kept current by netlink events
+        self.topology = topology or TopologyCache(self.backend)
+        # Desired qdisc tree per interface (see tc_model.py)
+        self.tc_state = {}
+        # Per-flow profile per interface, as submitted
+        self.tc_profiles = {}
+        self.playback = None
+        # Where applied bridge and TC configuration is persisted (see store.py)
+        self.store = store
+        self.sampler = sampler or StatsSampler()
+        self._sample_cache = {}
+        # Serializes operations on this bridge (see BridgeManager)
+        self.lock = threading.Lock()
         
     def get_available_interfaces(self):
         """Get list of available network interfaces"""
         interfaces = []
-        for interface in netifaces.interfaces():
-            if interface not in EXCLUDED_INTERFACES and not interface.startswith('br'):
+        for link in self.topology.links():
+            interface = link['name']
+            if interface not in EXCLUDED_INTERFACES and not interface.startswith(('br', IFB_PREFIX)):
                 try:
-                    addrs = netifaces.ifaddresses(interface)
-                    ip_addr = None
-                    if netifaces.AF_INET in addrs:
-                        ip_addr = addrs[netifaces.AF_INET][0]['addr']
+                    addresses = self.topology.get_addresses(interface)
+                    ip_addr = addresses[0].split('/')[0] if addresses else None
                     
                     interfaces.append({
                         'name': interface,
                         'ip': ip_addr or 'No IP',
-                        'status': 'up' if self._is_interface_up(interface) else 'down'
+                        'status': 'up' if link['operstate'] == 'up' else 'down'
                     })
                 except Exception as e:
                     # Still include interface even if we can't get IP
                     interfaces.append({
                         'name': interface,
                         'ip': 'Unknown',
-                        'status': 'up' if self._is_interface_up(interface) else 'down'
+                        'status': 'up' if link['operstate'] == 'up' else 'down'
                     })
         return interfaces
     
     def _is_interface_up(self, interface):
         """Check if interface is up"""
         try:
-            with open(f'/sys/class/net/{interface}/operstate', 'r') as f:
-                return f.read().strip() == 'up'
+            link = self.topology.get_link(interface)
+            return link is not None and link['operstate'] == 'up'
         except:
             return False
     
     def create_bridge(self, selected_interfaces):
         """Create network bridge with selected interfaces"""
-        try:
-            # Bring interfaces down
-            for interface in selected_interfaces:
-                subprocess.run(['ip', 'link', 'set', interface, 'down'], check=True)
-            
-            # Delete existing bridge if it exists
-            subprocess.run(['ip', 'link', 'delete', self.bridge_name, 'type', 'bridge'], 
-                         stderr=subprocess.DEVNULL)
-            
-            # Create bridge
-            subprocess.run(['ip', 'link', 'add', 'name', self.bridge_name, 'type', 'bridge'], check=True)
-            
-            # Attach interfaces
-            for interface in selected_interfaces:
-                subprocess.run(['ip', 'link', 'set', interface, 'master', self.bridge_name], check=True)
-            
-            # Bring interfaces up
-            for interface in selected_interfaces:
-                subprocess.run(['ip', 'link', 'set', interface, 'up'], check=True)
-            
-            # Assign IP to bridge
-            subprocess.run(['ip', 'addr', 'add', self.bridge_ip, 'dev', self.bridge_name], check=True)
-            
-            # Bring bridge up
-            subprocess.run(['ip', 'link', 'set', self.bridge_name, 'up'], check=True)
-            
-            self.interfaces = selected_interfaces
-            self.is_active = True
-            return True, "Bridge created successfully"
-            
-        except subprocess.CalledProcessError as e:
-            return False, f"Error creating bridge: {str(e)}"
+        batch = self.backend.batch()
+        
+        # Delete existing bridge if it exists
+        batch.link_delete(self.bridge_name, ignore_errors=True)
+        
+        # Bring interfaces down
+        for interface in selected_interfaces:
+            batch.link_set(interface, state='down')
+        
+        # Create bridge
+        batch.link_add(self.bridge_name, 'bridge')
+        
+        # Attach interfaces
+        for interface in selected_interfaces:
+            batch.link_set(interface, master=self.bridge_name)
+        
+        # Bring interfaces up
+        for interface in selected_interfaces:
+            batch.link_set(interface, state='up')
+        
+        # IFB devices for ingress shaping of the ports
+        for interface in selected_interfaces:
+            ifb = ifb_name(interface)
+            if self.topology.get_link(ifb) is None:
+                batch.link_add(ifb, 'ifb')
+            batch.link_set(ifb, state='up')
+        
+        # Assign IP to bridge
+        if self.bridge_ip:
+            batch.addr_add(self.bridge_name, self.bridge_ip)
+        
+        # Bring bridge up
+        batch.link_set(self.bridge_name, state='up')
+        
+        failures = batch.run()
+        self.topology.refresh()
+        if failures:
+            return False, f"Error creating bridge: {describe_failures(failures)}"
+        
+        self.interfaces = selected_interfaces
+        self.is_active = True
+        if self.store is not None:
+            self.store.save_bridge(self.bridge_name, self.bridge_ip, selected_interfaces)
+        return True, "Bridge created successfully"
     
     def destroy_bridge(self):
         """Destroy the network bridge"""
-        try:
-            # Bring bridge down
-            subprocess.run(['ip', 'link', 'set', self.bridge_name, 'down'], 
-                         stderr=subprocess.DEVNULL)
-            
-            # Delete bridge
-            subprocess.run(['ip', 'link', 'delete', self.bridge_name, 'type', 'bridge'], 
-                         stderr=subprocess.DEVNULL)
-            
-            self.interfaces = []
-            self.is_active = False
-            return True, "Bridge destroyed successfully"
-            
-        except subprocess.CalledProcessError as e:
-            return False, f"Error destroying bridge: {str(e)}"
+        batch = self.backend.batch()
+        
+        # Bring bridge down
+        batch.link_set(self.bridge_name, state='down', ignore_errors=True)
+        
+        # Delete bridge
+        batch.link_delete(self.bridge_name, ignore_errors=True)
+        
+        # Remove the ports' ingress redirects and IFB devices
+        ports = list(self.interfaces)
+        for interface in ports:
+            batch.qdisc('del', interface, INGRESS_PARENT, handle=INGRESS_HANDLE, ignore_errors=True)
+            batch.link_delete(ifb_name(interface), ignore_errors=True)
+        
+        batch.run()
+        self.topology.refresh()
+        
+        self.interfaces = []
+        self.is_active = False
+        for interface in ports:
+            self.tc_state.pop(ifb_name(interface), None)
+        self._save_tc(ports)
+        if self.store is not None:
+            self.store.delete_bridge(self.bridge_name)
+        return True, "Bridge destroyed successfully"
     
     def apply_tc_rules(self, rules):
         """Apply traffic control rules to selected interfaces"""
@@ -118,128 +181,352 @@ class NetworkBridge:
             target_interfaces = rules.get('interfaces', [])
             if not target_interfaces:
                 return False, "No interfaces selected for TC rules"
+            direction = rules.get('direction') or 'egress'
+            if direction not in DIRECTIONS:
+                return False, f"Invalid direction '{direction}', expected one of {', '.join(DIRECTIONS)}"
             
-            # Clear existing tc rules from target interfaces
-            for interface in target_interfaces:
-                subprocess.run(['tc', 'qdisc', 'del', 'dev', interface, 'root'], 
-                             stderr=subprocess.DEVNULL)
+            # Filter out None and empty values (excluding interfaces and direction)
+            filtered_rules = {k: v for k, v in rules.items()
+                              if k not in ('interfaces', 'direction') and v is not None and v != ''}
+            
+            # Desired qdisc tree, the same for every target interface
+            desired = build_tc_tree(filtered_rules)
+            
+            failures = self._apply_tree(target_interfaces, desired, direction)
+            if failures:
+                return False, f"Error applying TC rules to {describe_failures(failures)}"
             
-            if not rules or len([k for k, v in rules.items() if k != 'interfaces' and v is not None and v != '']) == 0:
+            if direction != 'ingress':
+                for interface in target_interfaces:
+                    self.tc_profiles.pop(interface, None)
+            self._save_tc(target_interfaces)
+            
+            if not desired:
                 return True, f"TC rules cleared from {len(target_interfaces)} interfaces"
+            return True, f"TC rules applied successfully to {len(target_interfaces)} interfaces"
+            
+        except (ValueError, TypeError) as e:
+            return False, f"Invalid TC rule values: {str(e)}"
+    
+    def apply_tc_profile(self, profile):
+        """Apply a per-flow profile (traffic classes with matches) to selected interfaces"""
+        try:
+            target_interfaces = profile.get('interfaces', [])
+            if not target_interfaces:
+                return False, "No interfaces selected for TC profile"
             
-            # Filter out None and empty values (excluding interfaces)
-            filtered_rules = {k: v for k, v in rules.items() if k != 'interfaces' and v is not None and v != ''}
+            desired = build_profile_tree(profile)
             
-            if not filtered_rules:
-                return True, "No valid TC rules to apply"
+            failures = self._apply_tree(target_interfaces, desired)
+            if failures:
+                return False, f"Error applying TC profile to {describe_failures(failures)}"
             
-            # Apply TC rules to each selected interface
+            stored = {k: v for k, v in profile.items() if k != 'interfaces'}
             for interface in target_interfaces:
-                try:
-                    # Check if we have bandwidth limiting
-                    has_bandwidth = filtered_rules.get('bandwidth') and int(filtered_rules['bandwidth']) > 0
-                    has_delay = filtered_rules.get('delay') and int(filtered_rules.get('delay', 0)) > 0
-                    has_jitter = filtered_rules.get('jitter') and int(filtered_rules.get('jitter', 0)) > 0
-                    has_loss = filtered_rules.get('packet_loss') and float(filtered_rules.get('packet_loss', 0)) > 0
-                    
-                    # If we only have delay/jitter/loss without bandwidth, use netem directly
-                    if not has_bandwidth and (has_delay or has_jitter or has_loss):
-                        cmd = ['tc', 'qdisc', 'add', 'dev', interface, 'root', 'handle', '1:', 'netem']
-                        
-                        if has_delay:
-                            delay = int(filtered_rules['delay'])
-                            cmd.extend(['delay', f'{delay}ms'])
-                            if has_jitter:
-                                jitter = int(filtered_rules['jitter'])
-                                cmd.append(f'{jitter}ms')
-                        
-                        if has_loss:
-                            loss = float(filtered_rules['packet_loss'])
-                            cmd.extend(['loss', f'{loss}%'])
-                        
-                        subprocess.run(cmd, check=True)
-                        
-                    elif has_bandwidth:
-                        # Use HTB for bandwidth limiting
-                        subprocess.run(['tc', 'qdisc', 'add', 'dev', interface, 'root', 'handle', '1:', 'htb'], check=True)
-                        
-                        # Apply bandwidth limiting
-                        bandwidth = int(filtered_rules['bandwidth'])
-                        subprocess.run([
-                            'tc', 'class', 'add', 'dev', interface, 'parent', '1:', 
-                            'classid', '1:1', 'htb', 'rate', f'{bandwidth}mbit'
-                        ], check=True)
-                        
-                        # Apply delay/jitter/loss to the HTB class
-                        if has_delay or has_jitter or has_loss:
-                            cmd = ['tc', 'qdisc', 'add', 'dev', interface, 'parent', '1:1',
-                                   'handle', '10:', 'netem']
-                            
-                            if has_delay:
-                                delay = int(filtered_rules['delay'])
-                                cmd.extend(['delay', f'{delay}ms'])
-                                if has_jitter:
-                                    jitter = int(filtered_rules['jitter'])
-                                    cmd.append(f'{jitter}ms')
-                            
-                            if has_loss:
-                                loss = float(filtered_rules['packet_loss'])
-                                cmd.extend(['loss', f'{loss}%'])
-                            
-                            subprocess.run(cmd, check=True)
-                            
-                except subprocess.CalledProcessError as e:
-                    return False, f"Error applying TC rules to {interface}: {str(e)}"
+                self.tc_profiles[interface] = stored
+            self._save_tc(target_interfaces)
             
-            return True, f"TC rules applied successfully to {len(self.interfaces)} interfaces"
+            classes = len(profile.get('classes') or [])
+            return True, f"TC profile with {classes} classes applied to {len(target_interfaces)} interfaces"
             
-        except subprocess.CalledProcessError as e:
-            return False, f"Error applying TC rules: {str(e)}"
         except (ValueError, TypeError) as e:
-            return False, f"Invalid TC rule values: {str(e)}"
+            return False, f"Invalid TC profile: {str(e)}"
+    
+    def apply_tc_bulk(self, rule_sets, pool):
+        """Apply a different rule set to each interface as one transaction
+
+        `rule_sets` maps interface names to rules. Every interface's current
+        tree is snapshotted and its changes applied concurrently on `pool`;
+        if any interface fails, all of them are restored to their snapshot.
+        Returns (success, message, {interface: result}).
+        """
+        if not isinstance(rule_sets, dict):
+            return False, "'interfaces' must map interface names to rules", {}
+        if not rule_sets:
+            return False, "No interfaces selected for TC rules", {}
+        desired = {}
+        for interface, rules in rule_sets.items():
+            if ((rules or {}).get('direction') or 'egress') != 'egress':
+                return False, f"Bulk apply supports egress rules only ({interface})", {}
+            try:
+                filtered_rules = {k: v for k, v in (rules or {}).items()
+                                  if k != 'direction' and v is not None and v != ''}
+                desired[interface] = build_tc_tree(filtered_rules)
+            except (ValueError, TypeError, AttributeError) as e:
+                return False, f"Invalid TC rule values for {interface}: {str(e)}", {}
+        
+        if self.playback and set(self.playback.interfaces) & set(desired):
+            self.playback.stop()
+        
+        futures = {interface: pool.submit(self._apply_interface, interface, tree)
+                   for interface, tree in desired.items()}
+        snapshots = {}
+        changed = {}
+        results = {}
+        timed_out = []
+        for interface, future in futures.items():
+            try:
+                snapshots[interface], failures, elapsed, changed[interface] = pool.wait(future)
+            except TimeoutError:
+                timed_out.append(interface)
+                snapshots[interface], failures, elapsed, changed[interface] = None, [
+                    {'interface': interface, 'error': f"timed out after {pool.timeout}s"}], pool.timeout, False
+            results[interface] = {
+                'success': not failures,
+                'message': describe_failures(failures) if failures else (
+                    "TC rules applied" if desired[interface] else "TC rules cleared"),
+                'elapsed_ms': round(elapsed * 1000, 3)
+            }
+        
+        failed = [interface for interface, result in results.items() if not result['success']]
+        if not failed:
+            for interface, tree in desired.items():
+                self.tc_profiles.pop(interface, None)
+                if tree:
+                    self.tc_state[interface] = tree
+                else:
+                    self.tc_state.pop(interface, None)
+            self._save_tc(desired)
+            return True, f"TC rules applied to {len(desired)} interfaces", results
+        
+        unrestored = []
+        for interface in timed_out:
+            # Its change is still running on a worker: let it finish, then undo it too
+            try:
+                snapshots[interface], _, _, changed[interface] = pool.wait(futures[interface])
+            except TimeoutError:
+                results[interface]['rolled_back'] = False
+                results[interface]['rollback_error'] = f"still applying after {2 * pool.timeout}s"
+                unrestored.append(interface)
+        
+        # Undo every interface that was changed, including partially failed ones
+        restores = {interface: pool.submit(self._restore_interface, interface, snapshot, desired[interface])
+                    for interface, snapshot in snapshots.items() if snapshot is not None and changed[interface]}
+        for interface in desired:
+            if interface not in unrestored:
+                results[interface]['changed'] = changed[interface]
+            if interface not in restores and interface not in unrestored:
+                # Unreadable, already as desired, or every operation failed: nothing to undo
+                results[interface]['rolled_back'] = False
+        for interface, future in restores.items():
+            try:
+                failures = pool.wait(future)
+            except TimeoutError:
+                failures = [{'interface': interface, 'error': f"timed out after {pool.timeout}s"}]
+            results[interface]['rolled_back'] = not failures
+            if failures:
+                results[interface]['rollback_error'] = describe_failures(failures)
+                unrestored.append(interface)
+        
+        message = f"Error applying TC rules to {', '.join(failed)}; "
+        if unrestored:
+            return False, message + f"rollback failed on {', '.join(unrestored)}", results
+        if len(restores) < len(desired):
+            return False, message + f"{len(restores)} changed interfaces rolled back", results
+        return False, message + f"all {len(desired)} interfaces rolled back", results
+    
+    def _apply_interface(self, interface, desired):
+        """Snapshot an interface's tree and move it to `desired`
+
+        Returns (snapshot, failures, seconds, changed); `changed` is False
+        when no operation was needed or every one failed.
+        """
+        started = time.perf_counter()
+        try:
+            snapshot = read_tc_tree(self.backend, interface)
+        except Exception as e:
+            return None, [{'interface': interface, 'error': f"Error reading qdiscs: {e}"}], \
+                time.perf_counter() - started, False
+        batch = self.backend.batch()
+        planned = plan_tc_changes(batch, interface, snapshot, desired, self.tc_state.get(interface))
+        failures = batch.run()
+        return snapshot, failures, time.perf_counter() - started, planned > len(failures)
+    
+    def _restore_interface(self, interface, snapshot, applied):
+        """Move an interface back to its snapshot, returns failures"""
+        # Filters aren't read back in full: only ones this controller applied can be restored
+        prior = self.tc_state.get(interface) or [node for node in snapshot if node['type'] != 'filter']
+        try:
+            current = read_tc_tree(self.backend, interface)
+        except Exception as e:
+            return [{'interface': interface, 'error': f"Error reading qdiscs: {e}"}]
+        batch = self.backend.batch()
+        plan_tc_changes(batch, interface, current, prior, applied)
+        return batch.run()
+    
+    def _save_tc(self, interfaces):
+        """Persist the applied trees and profiles of interfaces (and their IFB devices)"""
+        if self.store is not None:
+            devices = list(interfaces) + [ifb_name(iface) for iface in interfaces]
+            self.store.save_tc(self.bridge_name, {dev: self.tc_state.get(dev) for dev in devices},
+                               {iface: self.tc_profiles.get(iface) for iface in interfaces})
+    
+    def reconcile(self, stored, tc, qdiscs, dumped=None):
+        """Bring the kernel back to stored state after a restart, returns (success, message)
+
+        A stored bridge missing from the kernel is recreated; stored trees are
+        diffed against `qdiscs` and `dumped` (one list_qdiscs() and one
+        list_tc() dump) and only interfaces whose tree differs are changed,
+        in a single batch. A stored IFB tree
+        means its interface is shaped on ingress: missing IFB devices and
+        redirects are recreated.
+        """
+        done = []
+        if stored and stored['interfaces'] and self.topology.get_link(self.bridge_name) is None:
+            success, message = self.create_bridge(stored['interfaces'])
+            if not success:
+                return False, message
+            done.append("bridge recreated")
+        else:
+            self.detect_existing_bridge()
+        
+        batch = self.backend.batch()
+        ingress = {ifb_name(link['name']): link['name'] for link in self.topology.links()
+                   if ifb_name(link['name']) in tc}
+        created = [ifb for ifb in ingress if self.topology.get_link(ifb) is None]
+        for ifb in created:
+            batch.link_add(ifb, 'ifb')
+            batch.link_set(ifb, state='up')
+        
+        changed = set()
+        missing = []
+        for interface, entry in tc.items():
+            self.tc_state[interface] = entry['tree']
+            if entry['profile'] is not None:
+                self.tc_profiles[interface] = entry['profile']
+            if interface in created:
+                current = []
+            elif self.topology.get_link(interface) is None:
+                missing.append(interface)
+                continue
+            else:
+                current = read_tc_tree(self.backend, interface, qdiscs.get(interface, []),
+                                       (dumped or {}).get(interface))
+            # Filters this controller applied are assumed intact if any are present
+            if plan_tc_changes(batch, interface, current, entry['tree'], entry['tree']):
+                changed.add(interface)
+        
+        redirects = []
+        for ifb, interface in ingress.items():
+            if not has_redirect(self.backend, interface, qdiscs.get(interface, []), (dumped or {}).get(interface)):
+                plan_redirect(batch, interface, ifb)
+                redirects.append(interface)
+        
+        failures = batch.run() if changed or redirects else []
+        if failures:
+            return False, f"Error restoring TC rules on {describe_failures(failures)}"
+        done.append(f"TC rules re-applied on {len(changed)} of {len(tc)} interfaces")
+        if redirects:
+            done.append(f"ingress redirects restored on {', '.join(redirects)}")
+        if missing:
+            done.append(f"missing interfaces: {', '.join(missing)}")
+        return True, '; '.join(done)
+    
+    def _apply_tree(self, interfaces, desired, direction='egress'):
+        """Move each interface's qdisc tree to `desired`, returns failures
+
+        Ingress shaping puts the tree on the interface's IFB device and
+        redirects the interface's ingress traffic there. Clearing it removes
+        the redirect; the IFB devices of bridge ports stay until the bridge
+        is destroyed, others are deleted.
+        """
+        # Manual changes end a playback on the same interfaces
+        if self.playback and direction != 'ingress' and set(self.playback.interfaces) & set(interfaces):
+            self.playback.stop()
+        
+        batch = self.backend.batch()
+        devices = list(interfaces) if direction != 'ingress' else []
+        created = []
+        deleted = []
+        redirects = {}
+        if direction != 'egress':
+            for interface in interfaces:
+                ifb = ifb_name(interface)
+                exists = self.topology.get_link(ifb) is not None
+                if desired and not exists:
+                    batch.link_add(ifb, 'ifb')
+                    batch.link_set(ifb, state='up')
+                    created.append(ifb)
+                if desired or interface in self.interfaces:
+                    if exists or desired:
+                        devices.append(ifb)
+                elif exists:
+                    deleted.append(ifb)
+                redirects[interface] = ifb
+        
+        # Diff against the kernel and only queue what actually differs
+        for device in devices:
+            current = [] if device in created else read_tc_tree(self.backend, device)
+            plan_tc_changes(batch, device, current, desired, self.tc_state.get(device))
+        
+        for interface, ifb in redirects.items():
+            qdiscs = self.backend.get_qdiscs(interface)
+            if desired:
+                if not has_redirect(self.backend, interface, qdiscs):
+                    plan_redirect(batch, interface, ifb)
+            elif any(qdisc['parent'] == INGRESS_PARENT for qdisc in qdiscs):
+                batch.qdisc('del', interface, INGRESS_PARENT, handle=INGRESS_HANDLE)
+        for ifb in deleted:
+            batch.link_delete(ifb)
+        
+        # One backend round for the whole request
+        failures = batch.run()
+        if created or deleted:
+            self.topology.refresh()
+        if not failures:
+            for device in devices + deleted:
+                if desired:
+                    self.tc_state[device] = desired
+                else:
+                    self.tc_state.pop(device, None)
+        return failures
+    
+    def start_playback(self, interfaces, steps, loop=False):
+        """Play a trace back on interfaces, changing the tree built for its first step"""
+        if not interfaces:
+            return False, "No interfaces selected for playback"
+        try:
+            compiled = compile_trace(self.backend, interfaces, steps)
+        except (ValueError, TypeError) as e:
+            return False, f"Invalid trace: {str(e)}"
+        
+        self.stop_playback()
+        failures = self._apply_tree(interfaces, compiled[0][1])
+        if failures:
+            return False, f"Error starting playback on {describe_failures(failures)}"
+        for interface in interfaces:
+            self.tc_profiles.pop(interface, None)
+        
+        self.playback = PlaybackRunner(self.backend, interfaces, compiled, self.lock, loop,
+                                       on_step=lambda tree: self.tc_state.update(dict.fromkeys(interfaces, tree)))
+        self.playback.start()
+        return True, f"Playing {len(compiled)} steps on {len(interfaces)} interfaces"
+    
+    def stop_playback(self):
+        """Stop the running playback, leaving the last step's conditions in place"""
+        if self.playback is None or not self.playback.running:
+            return False, "No playback running"
+        self.playback.stop()
+        return True, "Playback stopped"
+    
+    def get_playback_status(self):
+        """Progress and timing of the current (or last) playback"""
+        if self.playback is None:
+            return {'running': False}
+        return self.playback.status()
     
     def detect_existing_bridge(self):
-        """Detect if bridge already exists and load its state"""
+        """Detect if bridge exists and load its state"""
         try:
             # Check if bridge exists
-            result = subprocess.run(['ip', 'link', 'show', self.bridge_name], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
+            if self.topology.get_link(self.bridge_name) is not None:
                 # Bridge exists, get its interfaces
-                brctl_result = subprocess.run(['brctl', 'show', self.bridge_name], 
-                                            capture_output=True, text=True)
-                if brctl_result.returncode == 0:
-                    interfaces = []
-                    lines = brctl_result.stdout.split('\n')
-                    
-                    # Find the line with our bridge name and parse interfaces
-                    for i, line in enumerate(lines):
-                        if line.strip().startswith(self.bridge_name):
-                            # Parse the bridge line itself for interfaces
-                            parts = line.split('\t')
-                            if len(parts) >= 4:
-                                # Last part might contain interface names
-                                last_part = parts[-1].strip()
-                                if last_part and last_part != 'interfaces':
-                                    interfaces.extend(last_part.split())
-                            
-                            # Look for additional interface names in subsequent indented lines
-                            for j in range(i + 1, len(lines)):
-                                next_line = lines[j].strip()
-                                if next_line and not next_line.startswith('bridge name'):
-                                    # Check if this line is indented (interface line)
-                                    if lines[j].startswith('\t') or lines[j].startswith(' '):
-                                        interface_name = next_line.split()[0]
-                                        if interface_name and interface_name != 'interfaces':
-                                            interfaces.append(interface_name)
-                                    else:
-                                        # No more indented lines, stop parsing
-                                        break
-                            break
-                    
-                    self.interfaces = interfaces
-                    self.is_active = True
-                    return True
+                self.interfaces = self.topology.bridge_ports(self.bridge_name)
+                self.is_active = True
+                return True
+            # Gone (or never created), possibly removed outside the controller
+            self.interfaces = []
+            self.is_active = False
             return False
         except Exception as e:
             print(f"Error detecting existing bridge: {e}")
@@ -247,9 +534,8 @@ class NetworkBridge:
 
     def get_bridge_status(self):
         """Get current bridge status"""
-        # First check if bridge exists but we haven't detected it yet
-        if not self.is_active:
-            self.detect_existing_bridge()
+        # Sync with the topology cache (no kernel access)
+        self.detect_existing_bridge()
         
         if not self.is_active:
             return {
@@ -261,14 +547,8 @@ class NetworkBridge:
         
         try:
             # Get bridge IP
-            result = subprocess.run(['ip', 'addr', 'show', self.bridge_name], 
-                                  capture_output=True, text=True)
-            ip_match = None
-            if result.stdout:
-                for line in result.stdout.split('\n'):
-                    if 'inet ' in line:
-                        ip_match = line.strip().split()[1]
-                        break
+            addresses = self.topology.get_addresses(self.bridge_name)
+            ip_match = addresses[0] if addresses else None
             
             return {
                 'active': True,
@@ -287,44 +567,58 @@ class NetworkBridge:
     def get_tc_status(self, interface):
         """Get TC status for a specific interface"""
         try:
-            result = subprocess.run(['tc', 'qdisc', 'show', 'dev', interface], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip():
-                return True, result.stdout.strip()
+            qdiscs = self.backend.get_qdiscs(interface)
+            if qdiscs:
+                return True, '\n'.join(format_qdisc(qdisc) for qdisc in qdiscs)
             else:
                 return False, "No TC rules"
         except:
             return False, "Error checking TC status"
 
+    def _cached(self, sample, key, build):
+        """Memoize a value derived from one stats sample"""
+        cache = self._sample_cache
+        if cache.get('sequence') != sample.sequence:
+            # Swap in a fresh dict so readers of an older sample never mix in
+            cache = {'sequence': sample.sequence}
+            self._sample_cache = cache
+        if key not in cache:
+            cache[key] = build(sample)
+        return cache[key]
+
     def get_network_stats(self):
         """Get network statistics for the bridge and its interfaces"""
+        sample = self.sampler.latest()
+        key = ('network', self.bridge_name, self.is_active, tuple(self.interfaces))
+        return self._cached(sample, key, self._build_network_stats)
+
+    def _build_network_stats(self, sample):
         stats = {
-            'bridge': {
-                'rx_bytes': 0,
-                'tx_bytes': 0,
-                'rx_packets': 0,
-                'tx_packets': 0,
-                'rx_errors': 0,
-                'tx_errors': 0,
-                'rx_dropped': 0,
-                'tx_dropped': 0
-            },
+            'bridge': dict.fromkeys(COUNTER_FIELDS, 0),
             'interfaces': {}
         }
         
         try:
             # Get bridge statistics
             if self.is_active:
-                bridge_stats = self._get_interface_stats(self.bridge_name)
+                bridge_stats = sample.get(self.bridge_name)
                 if bridge_stats:
                     stats['bridge'] = bridge_stats
             
             # Get interface statistics
             for interface in self.interfaces:
-                iface_stats = self._get_interface_stats(interface)
+                iface_stats = sample.get(interface)
                 if iface_stats:
                     stats['interfaces'][interface] = iface_stats
             
+            # Ingress traffic of ports shaped through their IFB device
+            for interface in self.interfaces:
+                ifb = ifb_name(interface)
+                if ifb in self.tc_state:
+                    ifb_stats = sample.get(ifb)
+                    if ifb_stats:
+                        stats.setdefault('ifb', {})[interface] = ifb_stats
+            
             return stats
         except Exception as e:
             print(f"Error getting network stats: {e}")
@@ -332,127 +626,307 @@ class NetworkBridge:
 
     def get_interface_stats(self, interface_name):
         """Get detailed statistics for a specific interface"""
+        started = time.perf_counter()
+        sample = self.sampler.latest()
+        stats = self._cached(sample, ('interface', interface_name),
+                             lambda sample: self._build_interface_stats(sample, interface_name))
+        INTERFACE_STATS_SECONDS.observe(time.perf_counter() - started)
+        return stats
+
+    def _build_interface_stats(self, sample, interface_name):
         try:
-            # Get raw stats
-            raw_stats = self._get_interface_stats(interface_name)
+            # Get raw stats and rates computed by the sampler
+            raw_stats = sample.get(interface_name)
             if not raw_stats:
                 return None
-            
-            # Calculate rates (we'll need to store previous values for rate calculation)
-            current_time = time.time()
-            
-            # Initialize previous stats if not exists
-            if not hasattr(self, '_prev_stats'):
-                self._prev_stats = {}
-            if not hasattr(self, '_prev_time'):
-                self._prev_time = {}
-            
-            # Calculate rates
-            rates = {}
-            if interface_name in self._prev_stats and interface_name in self._prev_time:
-                time_diff = current_time - self._prev_time[interface_name]
-                if time_diff > 0:
-                    prev = self._prev_stats[interface_name]
-                    rates = {
-                        'rx_bytes_per_sec': (raw_stats['rx_bytes'] - prev['rx_bytes']) / time_diff,
-                        'tx_bytes_per_sec': (raw_stats['tx_bytes'] - prev['tx_bytes']) / time_diff,
-                        'rx_packets_per_sec': (raw_stats['rx_packets'] - prev['rx_packets']) / time_diff,
-                        'tx_packets_per_sec': (raw_stats['tx_packets'] - prev['tx_packets']) / time_diff,
-                        'rx_errors_per_sec': (raw_stats['rx_errors'] - prev['rx_errors']) / time_diff,
-                        'tx_errors_per_sec': (raw_stats['tx_errors'] - prev['tx_errors']) / time_diff
-                    }
-            
-            # Store current stats for next calculation
-            self._prev_stats[interface_name] = raw_stats.copy()
-            self._prev_time[interface_name] = current_time
+            rates = sample.get_rates(interface_name)
             
             # Get interface status
             is_up = self._is_interface_up(interface_name)
             
-            # Calculate error rate
-            total_packets = raw_stats['rx_packets'] + raw_stats['tx_packets']
-            total_errors = raw_stats['rx_errors'] + raw_stats['tx_errors']
-            error_rate = (total_errors / total_packets * 100) if total_packets > 0 else 0
-            
             return {
                 'interface': interface_name,
                 'status': 'up' if is_up else 'down',
                 'raw_stats': raw_stats,
                 'rates': rates,
-                'error_rate': round(error_rate, 2),
-                'total_throughput': rates.get('rx_bytes_per_sec', 0) + rates.get('tx_bytes_per_sec', 0),
-                'total_packet_rate': rates.get('rx_packets_per_sec', 0) + rates.get('tx_packets_per_sec', 0)
+                **derived_stats(raw_stats, rates)
             }
         except Exception as e:
             print(f"Error getting interface stats for {interface_name}: {e}")
             return None
 
-    def _get_interface_stats(self, interface):
-        """Get statistics for a specific interface"""
-        try:
-            with open(f'/sys/class/net/{interface}/statistics/rx_bytes', 'r') as f:
-                rx_bytes = int(f.read().strip())
-        except:
-            rx_bytes = 0
-            
-        try:
-            with open(f'/sys/class/net/{interface}/statistics/tx_bytes', 'r') as f:
-                tx_bytes = int(f.read().strip())
-        except:
-            tx_bytes = 0
-            
-        try:
-            with open(f'/sys/class/net/{interface}/statistics/rx_packets', 'r') as f:
-                rx_packets = int(f.read().strip())
-        except:
-            rx_packets = 0
-            
+# Linux interface names: at most 15 characters, no '/' or whitespace
+_BRIDGE_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,15}$')
+
+class BridgeManager:
+    """Controllers of all managed bridges, sharing one backend, topology cache and sampler
+
+    Operations run in a bounded I/O pool under the bridge's own lock:
+    operations on the same bridge are serialized, different bridges proceed
+    concurrently, and request handlers wait for them without blocking the hub.
+    """
+
+    def __init__(self, backend=None, bridges=BRIDGES, workers=BRIDGE_WORKERS,
+                 topology=None, sampler=None, collect=True, store=None):
+        self.backend = backend or create_backend(BACKEND)
+        self.store = store
+        self.topology = topology or TopologyCache(self.backend)
+        self.sampler = sampler or StatsSampler()
+        self.history = HistoryStore()
+        self.sampler.add_listener(self.history.record)
+        self.pool = IOPool(workers, name='bridge-worker')
+        # Per-interface work of bulk applies, which wait for it from a bridge worker
+        self.tc_pool = IOPool(workers, name='tc-apply')
+        # Coalesces rapid apply/clear updates per interface (see tc_queue.py)
+        self.tc_queue = TCUpdateQueue(self.submit)
+        self.tc_stats = TCStatsCache(self.backend, self.pool)
+        self.exporter = MetricsExporter(self.tc_stats, self.pool, link_state=self._link_state)
+        # tc dumps and /metrics belong to the process that owns the kernel
+        if collect:
+            self.sampler.add_listener(self.tc_stats.update)
+            self.sampler.add_listener(self.exporter.update)
+        self.configured = set(bridges)
+        self.bridges = {}
+        # Interfaces requested by creates that haven't finished yet, per bridge
+        self._pending = {}
+        self._lock = threading.Lock()
+        for name, ip in bridges.items():
+            self.add(name, ip).detect_existing_bridge()
+
+    def _link_state(self, name):
+        link = self.topology.get_link(name)
+        return link['operstate'] if link else None
+
+    def add(self, name, ip=None):
+        """Get a bridge controller, registering it if it is new"""
+        if not _BRIDGE_NAME.match(name):
+            raise ValueError(f"Invalid bridge name '{name}'")
+        with self._lock:
+            bridge = self.bridges.get(name)
+            if bridge is None:
+                bridge = NetworkBridge(name, ip, self.backend, self.topology, self.sampler, self.store)
+                self.bridges[name] = bridge
+            elif ip:
+                bridge.bridge_ip = ip
+            return bridge
+
+    def get(self, name):
+        """Bridge controller by name, None if not managed"""
+        with self._lock:
+            return self.bridges.get(name)
+
+    def names(self):
+        with self._lock:
+            return sorted(self.bridges)
+
+    def submit(self, name, operation, *args):
+        """Run `operation(bridge, *args)` in the worker pool under the bridge's lock"""
+        bridge = self.get(name)
+        if bridge is None:
+            return _finished((False, f"Bridge {name} is not managed"))
+
+        def run():
+            with bridge.lock:
+                return operation(bridge, *args)
+        return self.pool.submit(run)
+
+    def wait(self, future):
+        """(success, message) of a submitted operation, a failure if it exceeds IO_TIMEOUT"""
         try:
-            with open(f'/sys/class/net/{interface}/statistics/tx_packets', 'r') as f:
-                tx_packets = int(f.read().strip())
-        except:
-            tx_packets = 0
-            
+            return self.pool.wait(future)
+        except TimeoutError:
+            return False, f"Operation timed out after {self.pool.timeout}s (it may still complete)"
+
+    def create(self, name, interfaces, ip=None):
+        """Create (or recreate) a bridge, returns a future of (success, message)
+
+        Interfaces that belong to another managed bridge, or are being added
+        to one, are refused.
+        """
+        if not _BRIDGE_NAME.match(name):
+            return _finished((False, f"Invalid bridge name '{name}'"))
+
+        with self._lock:
+            taken = {}
+            for other in self.bridges.values():
+                if other.bridge_name != name:
+                    taken.update(dict.fromkeys(other.interfaces, other.bridge_name))
+            for other, pending in self._pending.items():
+                if other != name:
+                    taken.update(dict.fromkeys(pending, other))
+            busy = [f"{iface} ({taken[iface]})" for iface in interfaces if iface in taken]
+            if busy:
+                return _finished((False, f"Interfaces already in use by another bridge: {', '.join(busy)}"))
+            self._pending[name] = list(interfaces)
+
+        self.add(name, ip)
+        future = self.submit(name, NetworkBridge.create_bridge, interfaces)
+        future.add_done_callback(lambda _: self._release(name))
+        return future
+
+    def _release(self, name):
+        with self._lock:
+            self._pending.pop(name, None)
+        # A failed create of a new bridge leaves nothing to manage
+        if name not in self.configured:
+            self._forget(name)
+
+    def destroy(self, name):
+        """Destroy a bridge, returns a future of (success, message)
+
+        Bridges created through the API are forgotten afterwards; the ones
+        from BRIDGES stay managed.
+        """
+        self.tc_queue.supersede(name, by='bridge destroy')
+        future = self.submit(name, NetworkBridge.destroy_bridge)
+        if name not in self.configured:
+            future.add_done_callback(lambda _: self._forget(name))
+        return future
+
+    def _forget(self, name):
+        with self._lock:
+            bridge = self.bridges.get(name)
+            if bridge is None or bridge.is_active:
+                return
+            del self.bridges[name]
+        if self.store is not None:
+            self.store.delete_tc(name)
+
+    def restore(self):
+        """Reconcile the kernel with the stored state, returns {name: (success, message)}
+
+        Run once at startup, after the topology is loaded. Bridges created
+        through the API are managed again.
+        """
+        if self.store is None:
+            return {}
+        bridges, tc = self.store.load()
+        for name, spec in bridges.items():
+            self.add(name, spec['ip'])
         try:
-            with open(f'/sys/class/net/{interface}/statistics/rx_errors', 'r') as f:
-                rx_errors = int(f.read().strip())
-        except:
-            rx_errors = 0
-            
+            qdiscs = self.pool.run(self.backend.list_qdiscs)
+        except Exception as e:
+            print(f"Error dumping qdiscs: {e}")
+            qdiscs = {}
+        # Classes and filters of every stored interface the qdisc dump shows shaped or redirected
+        stored = {interface for entries in tc.values() for interface in entries}
+        queries = {}
+        for interface in stored:
+            if any(qdisc['kind'] == 'htb' for qdisc in qdiscs.get(interface, [])):
+                queries.setdefault(interface, []).append(ROOT_HANDLE)
+        for link in self.topology.links():
+            if ifb_name(link['name']) in stored and any(
+                    qdisc['parent'] == INGRESS_PARENT for qdisc in qdiscs.get(link['name'], [])):
+                queries.setdefault(link['name'], []).append(INGRESS_HANDLE)
         try:
-            with open(f'/sys/class/net/{interface}/statistics/tx_errors', 'r') as f:
-                tx_errors = int(f.read().strip())
-        except:
-            tx_errors = 0
-            
+            dumped = self.pool.run(self.backend.list_tc, queries) if queries else {}
+        except Exception as e:
+            print(f"Error dumping classes and filters: {e}")
+            dumped = {}
+        futures = {name: self.submit(name, NetworkBridge.reconcile, bridges.get(name), tc.get(name, {}), qdiscs,
+                                     dumped)
+                   for name in self.names()}
+        return {name: self.wait(future) for name, future in futures.items()}
+
+    def create_many(self, specs):
+        """Create several bridges concurrently, returns {name: (success, message)}"""
+        futures = {spec['name']: self.create(spec['name'], spec.get('interfaces', []), spec.get('ip'))
+                   for spec in specs}
+        return {name: self.wait(future) for name, future in futures.items()}
+
+def _finished(result):
+    """An already completed future, for requests refused up front"""
+    future = Future()
+    future.set_result(result)
+    return future
+
+# Global bridge manager; `bridge` is the default bridge (BRIDGE_NAME).
+# A web worker mirrors the collector's samples and topology instead of
+# reading the kernel itself.
+remote = None
+collector = None
+
+def _copy_tc_state(managed):
+    """Shallow copy of a bridge's desired trees, without waiting for its lock
+
+    Operations on worker threads replace entries while it is read; a copy
+    that raced with one is retried.
+    """
+    while True:
         try:
-            with open(f'/sys/class/net/{interface}/statistics/rx_dropped', 'r') as f:
-                rx_dropped = int(f.read().strip())
-        except:
-            rx_dropped = 0
-            
+            return dict(managed.tc_state)
+        except RuntimeError:
+            continue
+
+def _tc_state_snapshot():
+    """Desired qdisc trees of every managed bridge, streamed by the collector to web workers"""
+    state = {}
+    for name in manager.names():
+        managed = manager.get(name)
+        if managed is not None:
+            state[name] = _copy_tc_state(managed)
+    return state
+
+def _mirror_tc_state(state):
+    """Web worker: take over the collector's trees (IFB stats, configured settings)"""
+    for name, trees in state.items():
+        managed = manager.get(name)
+        if managed is not None:
+            managed.tc_state = trees
+
+if ROLE == 'web':
+    remote = CollectorClient(COLLECTOR_SOCKET, on_tc_state=_mirror_tc_state)
+    manager = BridgeManager(bridges={BRIDGE_NAME: BRIDGE_IP, **BRIDGES},
+                            topology=remote.topology, sampler=remote.sampler, collect=False)
+else:
+    store = None
+    if STATE_DB:
         try:
-            with open(f'/sys/class/net/{interface}/statistics/tx_dropped', 'r') as f:
-                tx_dropped = int(f.read().strip())
-        except:
-            tx_dropped = 0
-
-        return {
-            'rx_bytes': rx_bytes,
-            'tx_bytes': tx_bytes,
-            'rx_packets': rx_packets,
-            'tx_packets': tx_packets,
-            'rx_errors': rx_errors,
-            'tx_errors': tx_errors,
-            'rx_dropped': rx_dropped,
-            'tx_dropped': tx_dropped
-        }
+            store = StateStore(STATE_DB)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error opening state store {STATE_DB}: {e}")
+    manager = BridgeManager(bridges={BRIDGE_NAME: BRIDGE_IP, **BRIDGES}, store=store)
+    if ROLE == 'collector':
+        collector = CollectorServer(COLLECTOR_SOCKET, manager.sampler, manager.topology,
+                                    tc_state=_tc_state_snapshot)
+bridge = manager.get(BRIDGE_NAME)
+
+# With a shared message queue the collector builds the broadcasts once for
+# every worker; without one each process pushes to its own clients
+BROADCAST_FROM_COLLECTOR = ROLE == 'web' and SOCKETIO_MESSAGE_QUEUE is not None
+
+# Endpoints a web worker serves from its mirrors; everything else (bridge
+# and tc control, tc stats, metrics, profiling) is forwarded to the collector
+WEB_LOCAL_ENDPOINTS = {'index', 'static', 'get_interfaces', 'get_bridge_status', 'get_network_stats',
+                       'get_interface_stats', 'get_interface_history', 'get_perf', 'stream_network_stats'}
+
+def _tc_rules(data):
+    """TC rule fields of a request body"""
+    return {
+        'bandwidth': data.get('bandwidth'),
+        'delay': data.get('delay'),
+        'jitter': data.get('jitter'),
+        'packet_loss': data.get('packet_loss'),
+        'direction': data.get('direction'),
+        'interfaces': data.get('interfaces', [])
+    }
 
-# Global bridge instance
-bridge = NetworkBridge()
+def _bridge_not_found(name):
+    return jsonify({'success': False, 'message': f"Bridge {name} is not managed"}), 404
 
-# Detect existing bridge on startup
-bridge.detect_existing_bridge()
+@app.before_request
+def forward_to_collector():
+    """In a web worker, replay control requests against the collector's API"""
+    if remote is None or request.endpoint in WEB_LOCAL_ENDPOINTS:
+        return None
+    path = request.full_path if request.query_string else request.path
+    try:
+        status, content_type, body = manager.pool.run(
+            forward_request, COLLECTOR_API, request.method, path, request.get_data(),
+            request.content_type, IO_TIMEOUT)
+    except (OSError, TimeoutError) as e:
+        return jsonify({'success': False, 'message': f"Collector unavailable: {e}"}), 502
+    return Response(body, status=status, content_type=content_type)
 
 @app.route('/')
 def index():
@@ -478,29 +952,56 @@ def create_bridge():
     if not interfaces:
         return jsonify({'success': False, 'message': 'No interfaces selected'})
     
-    success, message = bridge.create_bridge(interfaces)
+    success, message = manager.wait(manager.create(BRIDGE_NAME, interfaces))
     return jsonify({'success': success, 'message': message})
 
 @app.route('/api/bridge/destroy', methods=['POST'])
 def destroy_bridge():
     """Destroy network bridge"""
-    success, message = bridge.destroy_bridge()
+    success, message = manager.wait(manager.destroy(BRIDGE_NAME))
     return jsonify({'success': success, 'message': message})
 
 @app.route('/api/tc/apply', methods=['POST'])
 def apply_tc_rules():
     """Apply traffic control rules"""
-    data = request.get_json()
-    rules = {
-        'bandwidth': data.get('bandwidth'),
-        'delay': data.get('delay'),
-        'jitter': data.get('jitter'),
-        'packet_loss': data.get('packet_loss'),
-        'interfaces': data.get('interfaces', [])
-    }
-    
-    success, message = bridge.apply_tc_rules(rules)
-    return jsonify({'success': success, 'message': message})
+    data = request.get_json() or {}
+    return _queue_tc(BRIDGE_NAME, _tc_rules(data), data)
+
+def _queue_tc(name, rules, data):
+    """Queue a TC update and wait for it, unless the request body has "wait": false"""
+    job = manager.tc_queue.submit(name, rules)
+    if data.get('wait') is False and not job.future.done():
+        return jsonify({'success': True, 'message': f"Queued as job {job.id}", 'job': job.id}), 202
+    success, message = manager.wait(job.future)
+    return jsonify({'success': success, 'message': message, 'job': job.id})
+
+@app.route('/api/tc/jobs')
+def get_tc_jobs():
+    """Get the most recent TC update jobs and the queue's counters"""
+    return jsonify({'jobs': manager.tc_queue.recent(), 'queue': manager.tc_queue.stats()})
+
+@app.route('/api/tc/jobs/<int:job_id>')
+def get_tc_job(job_id):
+    """Get the state of a TC update job"""
+    job = manager.tc_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.status())
+
+def _apply_bulk(name, rule_sets):
+    """Run a bulk apply on a bridge and report its results and total latency"""
+    manager.tc_queue.supersede(name, set(rule_sets), by='a bulk apply')
+    started = time.perf_counter()
+    success, message, *results = manager.wait(manager.submit(name, NetworkBridge.apply_tc_bulk,
+                                                             rule_sets, manager.tc_pool))
+    return jsonify({'success': success, 'message': message, 'results': results[0] if results else {},
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)})
+
+@app.route('/api/tc/bulk', methods=['POST'])
+def apply_tc_bulk():
+    """Apply per-interface TC rules in one transaction (all or none)"""
+    data = request.get_json() or {}
+    return _apply_bulk(BRIDGE_NAME, data.get('interfaces') or {})
 
 @app.route('/api/tc/clear', methods=['POST'])
 def clear_tc_rules():
@@ -508,23 +1009,209 @@ def clear_tc_rules():
     data = request.get_json() or {}
     interfaces = data.get('interfaces', [])
     
-    # Create empty rules with interfaces to clear
-    rules = {'interfaces': interfaces}
-    success, message = bridge.apply_tc_rules(rules)
+    # Create empty rules with interfaces to clear (both directions unless given)
+    rules = {'interfaces': interfaces, 'direction': data.get('direction') or 'both'}
+    return _queue_tc(BRIDGE_NAME, rules, data)
+
+@app.route('/api/tc/profile', methods=['POST'])
+def apply_tc_profile():
+    """Apply a per-flow TC profile (classes with their own shaping and matches)"""
+    profile = request.get_json() or {}
+    manager.tc_queue.supersede(BRIDGE_NAME, set(profile.get('interfaces') or []), by='a TC profile')
+    success, message = manager.wait(manager.submit(BRIDGE_NAME, NetworkBridge.apply_tc_profile, profile))
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/tc/profile/<interface>')
+def get_tc_profile(interface):
+    """Get the per-flow TC profile applied to an interface"""
+    profile = bridge.tc_profiles.get(interface)
+    if profile is None:
+        return jsonify({'error': 'No TC profile applied to this interface'}), 404
+    return jsonify(profile)
+
+def _start_playback(name, ports_only=False):
+    """Load the trace of a playback request and start it on a bridge"""
+    data = request.get_json() or {}
+    if ports_only:
+        ports = set(manager.get(name).get_bridge_status()['interfaces'])
+        data['interfaces'] = data.get('interfaces') or sorted(ports)
+        foreign = [iface for iface in data['interfaces'] if iface not in ports]
+        if foreign:
+            return jsonify({'success': False, 'message': f"Not ports of {name}: {', '.join(foreign)}"})
+    try:
+        steps = load_trace(data.get('trace'), data.get('format', 'json'), data.get('interval'))
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': f"Invalid trace: {str(e)}"})
+    
+    manager.tc_queue.supersede(name, set(data.get('interfaces') or []), by='a playback')
+    success, message = manager.wait(manager.submit(name, NetworkBridge.start_playback,
+                                                   data.get('interfaces', []), steps, bool(data.get('loop'))))
     return jsonify({'success': success, 'message': message})
 
+@app.route('/api/playback/start', methods=['POST'])
+def start_playback():
+    """Play a delay/bandwidth/loss trace back"""
+    return _start_playback(BRIDGE_NAME)
+
+@app.route('/api/playback/stop', methods=['POST'])
+def stop_playback():
+    """Stop the running playback"""
+    success, message = bridge.stop_playback()
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/playback/status')
+def get_playback_status():
+    """Get playback progress and timing jitter"""
+    return jsonify(bridge.get_playback_status())
+
 @app.route('/api/tc/status/<interface>')
 def get_tc_status(interface):
     """Get TC status for a specific interface"""
-    has_tc, status = bridge.get_tc_status(interface)
+    has_tc, status = manager.wait(manager.pool.submit(bridge.get_tc_status, interface))
     return jsonify({'has_tc': has_tc, 'status': status})
 
+@app.route('/api/tc/stats')
+def get_all_tc_stats():
+    """Get the qdisc/class trees of every interface with counters and rates"""
+    return jsonify(manager.tc_stats.all())
+
+@app.route('/api/tc/stats/<interface>')
+def get_tc_stats(interface):
+    """Get the qdisc/class tree of an interface with counters and rates"""
+    stats = manager.tc_stats.get(interface)
+    if stats is None:
+        return jsonify({'error': 'Interface not found'}), 404
+    return jsonify(stats)
+
+@app.route('/api/io/status')
+def get_io_status():
+    """Get concurrency and latency of the kernel I/O pool"""
+    return jsonify({**manager.pool.stats(), 'tc_apply': manager.tc_pool.stats(),
+                    'tc_queue': manager.tc_queue.stats()})
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics: interface counters, qdisc stats and controller metrics"""
+    return Response(manager.exporter.page(manager.sampler), mimetype=METRICS_CONTENT_TYPE)
+
+# Opt-in, started and stopped through /api/debug/profiler
+profiler = SamplingProfiler()
+
+@app.route('/api/debug/perf')
+def get_perf():
+    """Get latency histograms of the hot paths, the I/O pool and the profiler state"""
+    return jsonify({
+        'histograms': perf_report(),
+        'io_pool': manager.pool.stats(),
+        'profiler': profiler.status()
+    })
+
+@app.route('/api/debug/profiler/start', methods=['POST'])
+def start_profiler():
+    """Start sampling the stacks of every thread"""
+    success, message = profiler.start()
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/debug/profiler/stop', methods=['POST'])
+def stop_profiler():
+    """Stop the profiler and write a collapsed-stack file"""
+    success, message, path = profiler.stop()
+    return jsonify({'success': success, 'message': message, 'path': path})
+
+# Active latency probe, one at a time, started through /api/probe/start
+latency_probe = None
+probe_interfaces = []
+
+def configured_settings(interfaces):
+    """Configured egress and ingress settings of interfaces across every managed bridge"""
+    settings = {}
+    for name in manager.names():
+        managed = manager.get(name)
+        if managed is None:
+            continue
+        # Iterated as a copy: an apply or queue flush may change tc_state meanwhile
+        tc_state = _copy_tc_state(managed)
+        for interface in interfaces or tc_state:
+            if interface.startswith(IFB_PREFIX) or interface in settings:
+                continue
+            egress = tc_state.get(interface)
+            ingress = tc_state.get(ifb_name(interface))
+            if egress or ingress or interfaces:
+                settings[interface] = {'egress': tree_settings(egress), 'ingress': tree_settings(ingress)}
+    return settings
+
+@app.route('/api/probe/start', methods=['POST'])
+def start_probe():
+    """Start sending latency probes to a reflector across the bridge"""
+    global latency_probe, probe_interfaces
+    data = request.get_json() or {}
+    if latency_probe is not None and latency_probe.running:
+        return jsonify({'success': False, 'message': 'Probe already running'})
+    if not data.get('target'):
+        return jsonify({'success': False, 'message': 'No target specified'}), 400
+    try:
+        # Resolving the target may block on DNS
+        probe = manager.pool.run(LatencyProbe, data['target'], data.get('rate', PROBE_RATE),
+                                 data.get('size', PROBE_SIZE), data.get('duration'))
+    except (ValueError, TypeError, OSError) as e:
+        return jsonify({'success': False, 'message': f"Invalid probe: {e}"}), 400
+    latency_probe = probe
+    probe_interfaces = list(data.get('interfaces') or [])
+    success, message = probe.start()
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/probe/stop', methods=['POST'])
+def stop_probe():
+    """Stop the latency probe (its results stay available)"""
+    if latency_probe is None or not latency_probe.running:
+        return jsonify({'success': False, 'message': 'Probe not running'})
+    latency_probe.stop()
+    return jsonify({'success': True, 'message': 'Probe stopped'})
+
+@app.route('/api/probe/status')
+def get_probe_status():
+    """Get measured latency, jitter and loss next to the configured TC values"""
+    return jsonify({
+        'probe': latency_probe.status() if latency_probe is not None else None,
+        'configured': configured_settings(probe_interfaces)
+    })
+
 @app.route('/api/network/stats')
 def get_network_stats():
     """Get network statistics"""
     stats = bridge.get_network_stats()
     return jsonify(stats)
 
+@app.route('/api/network/stats/stream')
+def stream_network_stats():
+    """Stream every stats sample (?format=ndjson|binary&interfaces=a,b&count=N, see stats_stream.py)"""
+    interfaces = [name for name in request.args.get('interfaces', '').split(',') if name]
+    try:
+        encoder = StreamEncoder(request.args.get('format', 'ndjson'), interfaces)
+        count = int(request.args.get('count', 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sampler = manager.sampler
+    
+    def generate():
+        sample = sampler.latest()
+        sent = 0
+        while True:
+            yield encoder.encode(sample)
+            sent += 1
+            if count and sent >= count:
+                return
+            # Waits on the hub without holding a worker thread
+            future = sampler.next_sample(sample.sequence)
+            while True:
+                try:
+                    sample = manager.pool.wait(future)
+                    break
+                except TimeoutError:
+                    continue
+
+    return Response(generate(), mimetype=STREAM_CONTENT_TYPES[encoder.format])
+
 @app.route('/api/network/stats/<interface>')
 def get_interface_stats(interface):
     """Get detailed statistics for a specific interface"""
@@ -533,31 +1220,291 @@ def get_interface_stats(interface):
         return jsonify({'error': 'Interface not found or error getting stats'}), 404
     return jsonify(stats)
 
+@app.route('/api/network/history/<interface>')
+def get_interface_history(interface):
+    """Get downsampled throughput history for a specific interface"""
+    metrics = request.args.get('metrics')
+    try:
+        history = manager.history.query(
+            interface,
+            start=request.args.get('from', type=float),
+            end=request.args.get('to', type=float),
+            step=request.args.get('step', type=float),
+            metrics=metrics.split(',') if metrics else HISTORY_METRICS
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if history is None:
+        return jsonify({'error': 'No history for interface'}), 404
+    return jsonify(history)
+
+@app.route('/api/bridges')
+def list_bridges():
+    """Get the status of every managed bridge"""
+    return jsonify({name: manager.get(name).get_bridge_status() for name in manager.names()})
+
+@app.route('/api/bridges', methods=['POST'])
+def create_bridges():
+    """Create several bridges concurrently"""
+    data = request.get_json() or {}
+    specs = data.get('bridges', [])
+    if not specs or not all(isinstance(spec, dict) and spec.get('name') and spec.get('interfaces')
+                            for spec in specs):
+        return jsonify({'success': False, 'message': 'Each bridge needs a name and interfaces'})
+    
+    results = manager.create_many(specs)
+    return jsonify({
+        'success': all(success for success, _ in results.values()),
+        'results': {name: {'success': success, 'message': message}
+                    for name, (success, message) in results.items()}
+    })
+
+@app.route('/api/bridges/<name>/status')
+def get_named_bridge_status(name):
+    """Get status of a managed bridge"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    return jsonify(named_bridge.get_bridge_status())
+
+@app.route('/api/bridges/<name>/create', methods=['POST'])
+def create_named_bridge(name):
+    """Create a bridge (registering it if it is new)"""
+    data = request.get_json() or {}
+    interfaces = data.get('interfaces', [])
+    
+    if not interfaces:
+        return jsonify({'success': False, 'message': 'No interfaces selected'})
+    
+    success, message = manager.wait(manager.create(name, interfaces, data.get('ip')))
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/bridges/<name>/destroy', methods=['POST'])
+def destroy_named_bridge(name):
+    """Destroy a managed bridge"""
+    if manager.get(name) is None:
+        return _bridge_not_found(name)
+    success, message = manager.wait(manager.destroy(name))
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/bridges/<name>/tc/apply', methods=['POST'])
+@app.route('/api/bridges/<name>/tc/clear', methods=['POST'])
+def apply_named_bridge_tc_rules(name):
+    """Apply (or clear) traffic control rules on a bridge's ports"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    
+    data = request.get_json() or {}
+    if request.path.endswith('/apply'):
+        rules = _tc_rules(data)
+    else:
+        rules = {'interfaces': data.get('interfaces', []), 'direction': data.get('direction') or 'both'}
+    
+    # Only the bridge's own ports, so operations on different bridges never overlap
+    ports = set(named_bridge.get_bridge_status()['interfaces'])
+    if not rules['interfaces']:
+        rules['interfaces'] = sorted(ports)
+    foreign = [iface for iface in rules['interfaces'] if iface not in ports]
+    if foreign:
+        return jsonify({'success': False, 'message': f"Not ports of {name}: {', '.join(foreign)}"})
+    
+    return _queue_tc(name, rules, data)
+
+@app.route('/api/bridges/<name>/tc/bulk', methods=['POST'])
+def apply_named_bridge_tc_bulk(name):
+    """Apply per-interface TC rules on a bridge's ports in one transaction"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    
+    rule_sets = (request.get_json() or {}).get('interfaces') or {}
+    ports = set(named_bridge.get_bridge_status()['interfaces'])
+    foreign = [iface for iface in rule_sets if iface not in ports]
+    if foreign:
+        return jsonify({'success': False, 'message': f"Not ports of {name}: {', '.join(foreign)}"})
+    return _apply_bulk(name, rule_sets)
+
+@app.route('/api/bridges/<name>/tc/profile', methods=['POST'])
+def apply_named_bridge_tc_profile(name):
+    """Apply a per-flow TC profile on a bridge's ports"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    
+    profile = request.get_json() or {}
+    ports = set(named_bridge.get_bridge_status()['interfaces'])
+    profile['interfaces'] = profile.get('interfaces') or sorted(ports)
+    foreign = [iface for iface in profile['interfaces'] if iface not in ports]
+    if foreign:
+        return jsonify({'success': False, 'message': f"Not ports of {name}: {', '.join(foreign)}"})
+    
+    manager.tc_queue.supersede(name, set(profile['interfaces']), by='a TC profile')
+    success, message = manager.wait(manager.submit(name, NetworkBridge.apply_tc_profile, profile))
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/bridges/<name>/playback/start', methods=['POST'])
+def start_named_bridge_playback(name):
+    """Play a trace back on a bridge's ports"""
+    if manager.get(name) is None:
+        return _bridge_not_found(name)
+    return _start_playback(name, ports_only=True)
+
+@app.route('/api/bridges/<name>/playback/stop', methods=['POST'])
+def stop_named_bridge_playback(name):
+    """Stop a bridge's playback"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    success, message = named_bridge.stop_playback()
+    return jsonify({'success': success, 'message': message})
+
+@app.route('/api/bridges/<name>/playback/status')
+def get_named_bridge_playback_status(name):
+    """Get a bridge's playback progress and timing jitter"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    return jsonify(named_bridge.get_playback_status())
+
+@app.route('/api/bridges/<name>/stats')
+def get_named_bridge_stats(name):
+    """Get network statistics of a managed bridge and its ports"""
+    named_bridge = manager.get(name)
+    if named_bridge is None:
+        return _bridge_not_found(name)
+    return jsonify(named_bridge.get_network_stats())
+
+# Clients that haven't subscribed yet get the full legacy stats push
+LEGACY_STATS_ROOM = 'network_stats'
+
+def _emit(event, payload, to=None, local=False):
+    """Broadcast with socketio.emit, timing serialization and queueing per event
+
+    `local` emits skip the message queue: only this process' clients get them.
+    """
+    started = time.perf_counter()
+    socketio.emit(event, payload, to=to, ignore_queue=local)
+    EMIT_SECONDS.observe(time.perf_counter() - started, event)
+
+# Frames depend on each process' own subscriptions, so they never go through the queue
+publisher = StatsPublisher(lambda event, payload, room: _emit(event, payload, to=room, local=True),
+                           link_state=lambda name: 'up' if bridge._is_interface_up(name) else 'down')
+
+# Last bridge status sent to clients
+last_bridge_status = None
+
+def push_bridge_status():
+    """Send the bridge status to all clients if it changed"""
+    global last_bridge_status
+    status = bridge.get_bridge_status()
+    if status != last_bridge_status and not BROADCAST_FROM_COLLECTOR:
+        last_bridge_status = status
+        _emit('bridge_status_update', status)
+
+# Pushed as soon as a link/address event changes the topology
+manager.topology.add_listener(push_bridge_status)
+
 def background_monitor():
-    """Background thread to monitor network status and statistics"""
+    """Background thread to push network statistics"""
+    sequence = 0
     while True:
-        # Always get network stats, regardless of bridge status
-        stats = bridge.get_network_stats()
-        socketio.emit('network_stats_update', stats)
+        # Push once per sampler tick
+        sample = manager.sampler.wait_for_sample(sequence, timeout=STATS_SAMPLE_INTERVAL * 2)
+        if sample is None or sample.sequence == sequence:
+            continue
+        sequence = sample.sequence
+        started = time.perf_counter()
         
-        # Only get bridge status if bridge is active
-        if bridge.is_active:
-            status = bridge.get_bridge_status()
-            socketio.emit('bridge_status_update', status)
+        # Delta frames for subscribed clients, one per distinct subscription
+        publisher.publish(sample)
         
-        time.sleep(1)  # Update every second
+        # Full stats for clients that haven't subscribed
+        if not BROADCAST_FROM_COLLECTOR:
+            stats = bridge.get_network_stats()
+            _emit('network_stats_update', stats, to=LEGACY_STATS_ROOM)
+        MONITOR_SECONDS.observe(time.perf_counter() - started)
 
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
+    join_room(LEGACY_STATS_ROOM)
     emit('bridge_status_update', bridge.get_bridge_status())
     emit('network_stats_update', bridge.get_network_stats())
 
+@socketio.on('disconnect')
+def handle_disconnect():
+    """Handle client disconnection"""
+    publisher.unsubscribe(request.sid)
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Subscribe to delta-encoded stats frames for interfaces/metrics"""
+    data = data or {}
+    try:
+        previous, room = publisher.subscribe(request.sid, data.get('interfaces', []),
+                                             data.get('metrics'), data.get('format', 'json'))
+    except ValueError as e:
+        return {'success': False, 'message': str(e)}
+    
+    if previous and previous != room:
+        leave_room(previous)
+    leave_room(LEGACY_STATS_ROOM)
+    join_room(room)
+    
+    # Start the client off with a keyframe
+    emit(FRAME_EVENT, publisher.keyframe_for(request.sid, manager.sampler.latest()))
+    return {'success': True, 'message': f"Subscribed to {len(data.get('interfaces', []))} interfaces"}
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe():
+    """Stop receiving stats frames"""
+    room = publisher.unsubscribe(request.sid)
+    if room:
+        leave_room(room)
+    leave_room(LEGACY_STATS_ROOM)
+    return {'success': True, 'message': 'Unsubscribed'}
+
+@socketio.on('resync')
+def handle_resync():
+    """Resend a keyframe (e.g. after the client noticed a sequence gap)"""
+    frame = publisher.keyframe_for(request.sid, manager.sampler.latest())
+    if frame is not None:
+        emit(FRAME_EVENT, frame)
+
 if __name__ == '__main__':
-    # Start background monitoring thread
-    monitor_thread = threading.Thread(target=background_monitor, daemon=True)
-    monitor_thread.start()
+    host, port = HOST, PORT
+    if ROLE == 'web':
+        # Samples and topology arrive from the collector
+        remote.start()
+    else:
+        # Start the topology event listener, restore the stored state and start the stats sampler
+        manager.topology.start()
+        started = time.perf_counter()
+        for name, (success, message) in manager.restore().items():
+            print(f"Restored {name}: {message}" if success else f"Error restoring {name}: {message}")
+        print(f"State reconciled in {(time.perf_counter() - started) * 1000:.1f} ms")
+        manager.sampler.start()
+    if ROLE == 'collector':
+        collector.start()
+        host, _, port = COLLECTOR_API.rpartition(':')
+        port = int(port)
+    
+    # Web workers push to their clients; a collector only does when it
+    # builds the broadcasts for all of them through the message queue
+    if ROLE != 'collector' or SOCKETIO_MESSAGE_QUEUE is not None:
+        monitor_thread = threading.Thread(target=background_monitor, daemon=True)
+        monitor_thread.start()
     
-    print("TC Bridge Controller starting...")
-    print(f"Access the UI at: http://localhost:{PORT}")
-    socketio.run(app, host=HOST, port=PORT, debug=DEBUG) 
\ No newline at end of file
+    print(f"TC Bridge Controller starting ({ROLE})...")
+    print(f"Access the UI at: http://localhost:{port}")
+    if NETNS and ROLE != 'web':
+        # Listen on the host, where the clients are
+        import eventlet
+        import eventlet.wsgi
+        with netns.host():
+            listener = eventlet.listen((host, port))
+        eventlet.wsgi.server(listener, app, log_output=DEBUG, minimum_chunk_size=0)
+    else:
+        # minimum_chunk_size=0: streamed responses go out per chunk, not in 4 KiB writes
+        socketio.run(app, host=host, port=port, debug=DEBUG, minimum_chunk_size=0)
\ No newline at end of file
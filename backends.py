@@ -0,0 +1,1033 @@
+"""
+Kernel backends for NetworkBridge - every link, address, qdisc and class
+operation goes through one of these:
+
+- SubprocessBackend: ip/tc batches (see tc_batch.py), sysfs and `tc -j`
+- NetlinkBackend: rtnetlink messages over one long-lived AF_NETLINK socket
+- FakeBackend: in-memory kernel model for running the controller without root
+"""
+
+import copy
+import errno
+import ipaddress
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+
+import netifaces
+
+import netlink
+from config import BATCH_FORCE, COMMAND_TIMEOUT, FAKE_INTERFACES
+from metrics import COMMAND_FAILURES, COMMAND_SECONDS
+from tc_batch import CommandBatch, format_batch_line
+
+
+class OperationBatch:
+    """Collects link/address/qdisc/class/filter operations and runs them on a backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.ops = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def _add(self, op, interface, ignore_errors, **params):
+        self.ops.append(dict(op=op, interface=interface, ignore_errors=ignore_errors, **params))
+
+    def link_add(self, name, kind, ignore_errors=False):
+        """Create a link of the given kind (bridge, ifb, ...)"""
+        self._add('link_add', name, ignore_errors, name=name, kind=kind)
+
+    def link_delete(self, name, ignore_errors=False):
+        """Delete a link"""
+        self._add('link_delete', name, ignore_errors, name=name)
+
+    def link_set(self, name, state=None, master=None, ignore_errors=False):
+        """Set link state ('up'/'down') and/or master ('' detaches)"""
+        self._add('link_set', name, ignore_errors, name=name, state=state, master=master)
+
+    def addr_add(self, name, address, ignore_errors=False):
+        """Add an address in CIDR notation to a link"""
+        self._add('addr_add', name, ignore_errors, name=name, address=address)
+
+    def qdisc(self, action, dev, parent, kind=None, handle=None, options=None, ignore_errors=False):
+        """Queue a qdisc add/change/replace/del"""
+        self._add('qdisc', dev, ignore_errors, action=action, dev=dev, parent=parent,
+                  kind=kind, handle=handle, options=options or {})
+
+    def tclass(self, action, dev, parent, classid, kind=None, options=None, ignore_errors=False):
+        """Queue a class add/change/replace/del"""
+        self._add('class', dev, ignore_errors, action=action, dev=dev, parent=parent,
+                  classid=classid, kind=kind, options=options or {})
+
+    def tfilter(self, action, dev, parent, kind=None, prio=None, handle=None, options=None,
+                protocol='ip', ignore_errors=False):
+        """Queue a filter add/del (del without prio removes every filter of the parent)"""
+        self._add('filter', dev, ignore_errors, action=action, dev=dev, parent=parent,
+                  kind=kind, prio=prio, handle=handle, options=options or {}, protocol=protocol)
+
+    def run(self):
+        """Execute all queued operations, returns a list of failures"""
+        return self.backend.execute(self.ops)
+
+
+def tc_option_args(kind, options, is_class=False):
+    """Render normalized qdisc/class options as tc arguments"""
+    args = []
+    if kind == 'netem':
+        if options.get('delay') or options.get('jitter'):
+            args.extend(['delay', f"{float(options.get('delay') or 0):g}ms"])
+            if options.get('jitter'):
+                args.append(f"{float(options['jitter']):g}ms")
+        if options.get('loss'):
+            args.extend(['loss', f"{float(options['loss']):g}%"])
+        if options.get('limit'):
+            args.extend(['limit', str(options['limit'])])
+    elif kind == 'htb' and is_class:
+        args.extend(['rate', f"{int(options['rate'])}bit"])
+        if options.get('ceil'):
+            args.extend(['ceil', f"{int(options['ceil'])}bit"])
+        if options.get('prio'):
+            args.extend(['prio', str(options['prio'])])
+    elif kind == 'htb':
+        if options.get('default'):
+            args.extend(['default', f"{int(options['default']):x}"])
+    return args
+
+
+def _u32_match_args(keys):
+    args = []
+    for field, value in keys:
+        if field in ('dst', 'src'):
+            args.extend(['match', 'ip', field, value])
+        elif field == 'protocol':
+            args.extend(['match', 'ip', 'protocol', str(value), '0xff'])
+        elif field in ('dport', 'sport'):
+            args.extend(['match', 'ip', field, str(value), '0xffff'])
+        elif field == 'dscp':
+            args.extend(['match', 'ip', 'tos', f"{value << 2:#x}", '0xfc'])
+    return args
+
+
+# flower reads a numeric ip_proto as hex; these it also accepts by name
+_FLOWER_PROTOCOLS = {1: 'icmp', 6: 'tcp', 17: 'udp', 58: 'icmpv6', 132: 'sctp'}
+
+
+def filter_option_args(kind, options):
+    """Render normalized u32/flower/matchall filter options as tc arguments"""
+    args = []
+    if kind == 'matchall':
+        if options.get('redirect'):
+            args.extend(['action', 'mirred', 'egress', 'redirect', 'dev', options['redirect']])
+        return args
+    if kind == 'flower':
+        if 'protocol' in options:
+            protocol = int(options['protocol'])
+            args.extend(['ip_proto', _FLOWER_PROTOCOLS.get(protocol, f"{protocol:#x}")])
+        if 'src' in options:
+            args.extend(['src_ip', options['src']])
+        if 'dst' in options:
+            args.extend(['dst_ip', options['dst']])
+        if 'sport' in options:
+            args.extend(['src_port', str(options['sport'])])
+        if 'dport' in options:
+            args.extend(['dst_port', str(options['dport'])])
+        if 'dscp' in options:
+            args.extend(['ip_tos', f"{options['dscp'] << 2:#x}/0xfc"])
+    elif kind == 'u32':
+        if options.get('divisor'):
+            args.extend(['divisor', str(options['divisor'])])
+        if options.get('ht'):
+            args.extend(['ht', options['ht']])
+        args.extend(_u32_match_args(options.get('match', [])))
+        if options.get('hashkey'):
+            args.extend(['hashkey', 'mask', f"{options['hashkey']['mask']:#010x}",
+                         'at', str(options['hashkey']['at'])])
+        if options.get('link'):
+            args.extend(['link', options['link']])
+    if options.get('classid'):
+        args.extend(['classid', options['classid']])
+    return args
+
+
+def op_to_cli(op):
+    """Translate an operation into (tool, arguments) for ip/tc"""
+    kind = op['op']
+    if kind == 'link_add':
+        return 'ip', ['link', 'add', 'name', op['name'], 'type', op['kind']]
+    if kind == 'link_delete':
+        return 'ip', ['link', 'delete', op['name']]
+    if kind == 'link_set':
+        args = ['link', 'set', op['name']]
+        if op['master'] == '':
+            args.append('nomaster')
+        elif op['master']:
+            args.extend(['master', op['master']])
+        if op['state']:
+            args.append(op['state'])
+        return 'ip', args
+    if kind == 'addr_add':
+        return 'ip', ['addr', 'add', op['address'], 'dev', op['name']]
+    if kind == 'filter':
+        args = ['filter', op['action'], 'dev', op['dev'], 'parent', op['parent']]
+        if op['prio'] is not None:
+            args.extend(['protocol', op['protocol'], 'prio', str(op['prio'])])
+        if op['handle']:
+            args.extend(['handle', op['handle']])
+        if op['kind']:
+            args.append(op['kind'])
+            args.extend(filter_option_args(op['kind'], op['options']))
+        return 'tc', args
+
+    is_class = kind == 'class'
+    if not is_class and op['parent'] == 'ffff:fff1':
+        # The `ingress` keyword stands for the ingress qdisc's parent, handle and kind
+        return 'tc', ['qdisc', op['action'], 'dev', op['dev'], 'ingress']
+    args = ['class' if is_class else 'qdisc', op['action'], 'dev', op['dev']]
+    args.extend(['root'] if op['parent'] == 'root' else ['parent', op['parent']])
+    if is_class:
+        args.extend(['classid', op['classid']])
+    elif op['handle']:
+        args.extend(['handle', op['handle']])
+    if op['kind']:
+        args.append(op['kind'])
+        args.extend(tc_option_args(op['kind'], op['options'], is_class))
+    return 'tc', args
+
+
+def describe_op(op):
+    """Human readable command line for an operation"""
+    tool, args = op_to_cli(op)
+    return f"{tool} {format_batch_line(args)}"
+
+
+def format_qdisc(qdisc):
+    """Render a normalized qdisc the way `tc qdisc show` does"""
+    parent = 'root' if qdisc['parent'] == 'root' else f"parent {qdisc['parent']}"
+    args = tc_option_args(qdisc['kind'], qdisc.get('options', {}))
+    return ' '.join([f"qdisc {qdisc['kind']} {qdisc['handle']} {parent}"] + args)
+
+
+class Backend:
+    """Interface shared by all kernel backends"""
+
+    name = None
+    # Operates on the running kernel, so rtnetlink events describe its state
+    live = True
+
+    def __init__(self, force=BATCH_FORCE):
+        self.force = force
+
+    def batch(self):
+        """Start a new operation batch"""
+        return OperationBatch(self)
+
+    def execute(self, ops):
+        """Run best-effort ops, then the rest; returns failures of the latter"""
+        started = time.monotonic()
+        cleanup = [op for op in ops if op['ignore_errors']]
+        main = [op for op in ops if not op['ignore_errors']]
+        if cleanup:
+            self._run(cleanup, force=True)
+        failures = self._run(main, force=self.force) if main else []
+        COMMAND_SECONDS.observe(time.monotonic() - started, self.name)
+        if failures:
+            COMMAND_FAILURES.inc(self.name, amount=len(failures))
+        return failures
+
+    def _run(self, ops, force):
+        raise NotImplementedError
+
+    def list_links(self):
+        """All links as [{'name', 'index', 'operstate', 'master', 'kind'}]"""
+        raise NotImplementedError
+
+    def get_link(self, name):
+        """A single link dict, or None if it does not exist"""
+        raise NotImplementedError
+
+    def get_addresses(self, name):
+        """IPv4 addresses of a link in CIDR notation"""
+        raise NotImplementedError
+
+    def list_addresses(self):
+        """IPv4 addresses of every link as {name: [cidr, ...]}"""
+        return {link['name']: self.get_addresses(link['name']) for link in self.list_links()}
+
+    def get_bridge_ports(self, bridge):
+        """Names of the links enslaved to a bridge"""
+        return [link['name'] for link in self.list_links() if link['master'] == bridge]
+
+    def get_qdiscs(self, dev):
+        """Qdiscs of a link as [{'kind', 'handle', 'parent', 'options', 'stats'}]"""
+        raise NotImplementedError
+
+    def get_classes(self, dev):
+        """Classes of a link as [{'kind', 'handle', 'parent', 'options', 'stats'}]"""
+        raise NotImplementedError
+
+    def list_qdiscs(self):
+        """Qdiscs of every link as {name: [qdisc, ...]}"""
+        return {link['name']: self.get_qdiscs(link['name']) for link in self.list_links()}
+
+    def get_filters(self, dev, parent):
+        """Filters attached to a qdisc as [{'kind', 'prio', 'handle'}] (options aren't decoded)"""
+        raise NotImplementedError
+
+    def list_tc(self, queries):
+        """Classes and filters of several links at once
+
+        `queries` maps link names to the qdisc handles whose filters are
+        wanted; returns {name: {'classes': [...], 'filters': {handle: [...]}}}.
+        """
+        return {dev: {'classes': self.get_classes(dev),
+                      'filters': {parent: self.get_filters(dev, parent) for parent in parents}}
+                for dev, parents in queries.items()}
+
+
+def _run_tc(cmd, script=None):
+    """Run a tc query (fed `script` on stdin), None if it hung for COMMAND_TIMEOUT seconds"""
+    try:
+        return subprocess.run(cmd, input=script, capture_output=True, text=True, timeout=COMMAND_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        print(f"Error running {' '.join(cmd)}: timed out after {COMMAND_TIMEOUT}s")
+        return None
+
+
+class SubprocessBackend(Backend):
+    """Runs ip/tc in batches, reads state from sysfs, netifaces and `tc -j`"""
+
+    name = 'subprocess'
+
+    def _run(self, ops, force):
+        failures = []
+        batch = None
+        for op in ops:
+            tool, args = op_to_cli(op)
+            # Keep ordering across tools: start a new batch whenever the tool changes
+            if batch is None or batch.tool != tool:
+                if batch is not None:
+                    failures.extend(batch.run())
+                    if failures and not force:
+                        return failures
+                batch = CommandBatch(tool, force=force)
+            batch.add(args, interface=op['interface'])
+        if batch is not None:
+            failures.extend(batch.run())
+        return failures
+
+    def list_links(self):
+        try:
+            names = sorted(os.listdir('/sys/class/net'))
+        except OSError:
+            return []
+        return [link for link in map(self.get_link, names) if link]
+
+    def get_link(self, name):
+        path = f'/sys/class/net/{name}'
+        if not os.path.exists(path):
+            return None
+
+        link = {'name': name, 'index': 0, 'operstate': 'unknown', 'master': None, 'kind': None}
+        try:
+            with open(f'{path}/ifindex', 'r') as f:
+                link['index'] = int(f.read().strip())
+            with open(f'{path}/operstate', 'r') as f:
+                link['operstate'] = f.read().strip()
+            with open(f'{path}/uevent', 'r') as f:
+                for line in f:
+                    if line.startswith('DEVTYPE='):
+                        link['kind'] = line.strip().split('=', 1)[1]
+        except (OSError, ValueError):
+            pass
+        if os.path.islink(f'{path}/master'):
+            link['master'] = os.path.basename(os.readlink(f'{path}/master'))
+        return link
+
+    def get_addresses(self, name):
+        try:
+            addrs = netifaces.ifaddresses(name).get(netifaces.AF_INET, [])
+        except ValueError:
+            return []
+        addresses = []
+        for addr in addrs:
+            try:
+                network = ipaddress.ip_network(f"{addr['addr']}/{addr.get('netmask', '255.255.255.255')}",
+                                               strict=False)
+                addresses.append(f"{addr['addr']}/{network.prefixlen}")
+            except (KeyError, ValueError):
+                continue
+        return addresses
+
+    def get_bridge_ports(self, bridge):
+        try:
+            return sorted(os.listdir(f'/sys/class/net/{bridge}/brif'))
+        except OSError:
+            return []
+
+    def get_qdiscs(self, dev):
+        result = _run_tc(['tc', '-s', '-j', 'qdisc', 'show', 'dev', dev])
+        if result is None or result.returncode != 0:
+            return []
+        try:
+            return [_normalize_tc_json(entry) for entry in json.loads(result.stdout or '[]')]
+        except ValueError:
+            return []
+
+    def list_qdiscs(self):
+        result = _run_tc(['tc', '-s', '-j', 'qdisc', 'show'])
+        if result is None or result.returncode != 0:
+            return {}
+        qdiscs = {}
+        try:
+            for entry in json.loads(result.stdout or '[]'):
+                qdiscs.setdefault(entry.get('dev'), []).append(_normalize_tc_json(entry))
+        except ValueError:
+            return {}
+        return qdiscs
+
+    def get_classes(self, dev):
+        result = _run_tc(['tc', '-s', '-j', 'class', 'show', 'dev', dev])
+        if result is None or result.returncode != 0:
+            return []
+        try:
+            return [_normalize_tc_json(entry) for entry in json.loads(result.stdout or '[]')]
+        except ValueError:
+            # Older iproute2 releases ignore -j for classes
+            return _parse_class_text(result.stdout)
+
+    def get_filters(self, dev, parent):
+        result = _run_tc(['tc', '-j', 'filter', 'show', 'dev', dev, 'parent', parent])
+        if result is None or result.returncode != 0:
+            return []
+        try:
+            entries = json.loads(result.stdout or '[]')
+        except ValueError:
+            # No JSON support for this classifier: one filter per "filter" line
+            return [{'kind': None, 'prio': None, 'handle': None}
+                    for line in result.stdout.splitlines() if line.startswith('filter ')]
+        return [_filter_entry(entry) for entry in entries]
+
+    def list_tc(self, queries):
+        # Neither tc nor the kernel dump classes or filters of every link,
+        # but one `tc -batch` process answers all the per-link queries
+        if not queries or not all(queries.values()):
+            return super().list_tc(queries)
+        script = ''.join(f'class show dev {dev}\n' + ''.join(f'filter show dev {dev} parent {parent}\n'
+                                                              for parent in parents)
+                         for dev, parents in queries.items())
+        result = _run_tc(['tc', '-s', '-j', '-force', '-batch', '-'], script)
+        dumped = _split_tc_batch(result.stdout, queries) if result is not None else None
+        if dumped is None:
+            # A link went away mid-batch (its lines print nothing): query one by one
+            return super().list_tc(queries)
+        return dumped
+
+
+def _filter_entry(entry):
+    """Convert one `tc -j filter show` entry into the backend format"""
+    return {'kind': entry.get('kind'), 'prio': entry.get('pref'), 'handle': entry.get('options', {}).get('fh')}
+
+
+def _split_tc_batch(output, queries):
+    """Attribute the output of list_tc's batch to its links, None if it doesn't add up
+
+    Every filter query prints one JSON array line; a class query prints
+    text (iproute2 ignores -j for classes in batches) or, in releases that
+    support it, a JSON array too. Each link has at least one filter query,
+    so its class text is whatever precedes its first filter array.
+    """
+    tokens = []
+    for line in output.splitlines():
+        if line.startswith('['):
+            try:
+                tokens.append(json.loads(line))
+            except ValueError:
+                return None
+        elif line.strip():
+            if tokens and isinstance(tokens[-1], str):
+                tokens[-1] += line + '\n'
+            else:
+                tokens.append(line + '\n')
+    filter_count = sum(len(parents) for parents in queries.values())
+    arrays = sum(1 for token in tokens if isinstance(token, list))
+    if arrays == filter_count + len(queries) and arrays == len(tokens):
+        json_classes = True
+    elif arrays == filter_count:
+        json_classes = False
+    else:
+        return None
+
+    dumped = {}
+    tokens = iter(tokens)
+    pending = next(tokens, None)
+    for dev, parents in queries.items():
+        if json_classes:
+            classes = [_normalize_tc_json(entry) for entry in pending]
+            pending = next(tokens, None)
+        elif isinstance(pending, str):
+            classes = _parse_class_text(pending)
+            pending = next(tokens, None)
+        else:
+            classes = []
+        filters = {}
+        for parent in parents:
+            if not isinstance(pending, list):
+                return None
+            filters[parent] = [_filter_entry(entry) for entry in pending]
+            pending = next(tokens, None)
+        dumped[dev] = {'classes': classes, 'filters': filters}
+    return dumped if pending is None else None
+
+
+def _class_parent(handle, parent, is_class):
+    """Top level classes report 'root' as parent; use their qdisc handle instead"""
+    if is_class and parent == 'root' and handle:
+        return handle.split(':')[0] + ':'
+    return parent
+
+
+_RATE_UNITS = {'bit': 1, 'kbit': 10**3, 'mbit': 10**6, 'gbit': 10**9, 'tbit': 10**12,
+               'bps': 8, 'kbps': 8 * 10**3, 'mbps': 8 * 10**6, 'gbps': 8 * 10**9}
+
+
+def _parse_rate(text):
+    """Parse a tc rate ('10Mbit', '500Kbit', '12bit') into bit/s"""
+    match = re.match(r'^([\d.]+)([a-zA-Z]*)$', text)
+    if not match:
+        return 0
+    return int(float(match.group(1)) * _RATE_UNITS.get(match.group(2).lower() or 'bit', 1))
+
+
+def _normalize_options(kind, options, is_class=False):
+    """Convert `tc -j` options into the units used by the backends"""
+    if kind == 'netem':
+        delay = options.get('delay', {})
+        return {
+            'delay': delay.get('delay', 0) * 1000,
+            'jitter': delay.get('jitter', 0) * 1000,
+            'loss': round(options.get('loss-random', {}).get('loss', 0) * 100, 4),
+            'limit': options.get('limit', 1000)
+        }
+    if kind == 'htb' and is_class:
+        return {'rate': options.get('rate', 0) * 8, 'ceil': options.get('ceil', 0) * 8,
+                'prio': options.get('prio', 0)}
+    if kind == 'htb':
+        return {'default': int(str(options.get('default', '0')), 16)}
+    return {}
+
+
+def _normalize_tc_json(entry):
+    """Convert one `tc -s -j` qdisc/class entry into the backend format"""
+    is_class = 'class' in entry
+    kind = entry.get('class') if is_class else entry.get('kind')
+    options = entry.get('options', entry if is_class else {})
+    parent = 'root' if entry.get('root') else entry.get('parent')
+    return {
+        'kind': kind,
+        'handle': entry.get('handle'),
+        'parent': _class_parent(entry.get('handle'), parent, is_class),
+        'options': _normalize_options(kind, options, is_class),
+        'stats': {key: entry.get(key, 0) for key in
+                  ('bytes', 'packets', 'drops', 'overlimits', 'requeues', 'backlog', 'qlen')}
+    }
+
+
+_SENT = re.compile(r'Sent (\d+) bytes (\d+) pkt \(dropped (\d+), overlimits (\d+) requeues (\d+)\)')
+_BACKLOG = re.compile(r'backlog (\d+)b (\d+)p')
+
+
+def _parse_class_text(output):
+    """Parse `tc -s class show` text output (fallback when -j is unsupported)"""
+    classes = []
+    for line in output.splitlines():
+        if line.startswith('class '):
+            tokens = line.split()
+            options = {}
+            for key in ('rate', 'ceil', 'prio'):
+                if key in tokens and tokens.index(key) + 1 < len(tokens):
+                    value = tokens[tokens.index(key) + 1]
+                    options[key] = int(value) if key == 'prio' else _parse_rate(value)
+            classes.append({
+                'kind': tokens[1],
+                'handle': tokens[2],
+                'parent': _class_parent(tokens[2], 'root' if tokens[3] == 'root' else tokens[4], True),
+                'options': options,
+                'stats': {'bytes': 0, 'packets': 0, 'drops': 0, 'overlimits': 0,
+                          'requeues': 0, 'backlog': 0, 'qlen': 0}
+            })
+        elif classes and _SENT.search(line):
+            stats = classes[-1]['stats']
+            (stats['bytes'], stats['packets'], stats['drops'],
+             stats['overlimits'], stats['requeues']) = map(int, _SENT.search(line).groups())
+        elif classes and _BACKLOG.search(line):
+            stats = classes[-1]['stats']
+            stats['backlog'], stats['qlen'] = map(int, _BACKLOG.search(line).groups())
+    return classes
+
+
+class NetlinkBackend(Backend):
+    """Talks rtnetlink directly over a socket kept open for the process lifetime"""
+
+    name = 'netlink'
+
+    _QDISC_FLAGS = {
+        'add': netlink.NLM_F_CREATE | netlink.NLM_F_EXCL,
+        'change': 0,
+        'replace': netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE,
+    }
+    _CLASS_FLAGS = {
+        'add': netlink.NLM_F_CREATE | netlink.NLM_F_EXCL,
+        'change': 0,
+        'replace': netlink.NLM_F_CREATE,
+    }
+
+    def __init__(self, force=BATCH_FORCE):
+        super().__init__(force)
+        self.nl = netlink.NetlinkSocket()
+        # A request the kernel never answers fails instead of blocking its worker
+        self.nl.sock.settimeout(COMMAND_TIMEOUT)
+
+    def _run(self, ops, force):
+        failures = []
+        for op in ops:
+            try:
+                self._send(op)
+            except (netlink.NetlinkError, OSError, ValueError) as e:
+                failures.append({'interface': op['interface'], 'command': describe_op(op), 'error': str(e)})
+                if not force:
+                    break
+        return failures
+
+    def _ifindex(self, name):
+        try:
+            return socket.if_nametoindex(name)
+        except OSError:
+            raise netlink.NetlinkError(errno.ENODEV, f'Cannot find device "{name}"')
+
+    def _send(self, op):
+        kind = op['op']
+        if kind == 'link_add':
+            body = (netlink.IFINFOMSG.pack(0, 0, 0, 0, 0)
+                    + netlink.nla_str(netlink.IFLA_IFNAME, op['name'])
+                    + netlink.nla(netlink.IFLA_LINKINFO, netlink.nla_str(netlink.IFLA_INFO_KIND, op['kind'])))
+            self.nl.request(netlink.RTM_NEWLINK, body, netlink.NLM_F_CREATE | netlink.NLM_F_EXCL)
+
+        elif kind == 'link_delete':
+            body = netlink.IFINFOMSG.pack(0, 0, self._ifindex(op['name']), 0, 0)
+            self.nl.request(netlink.RTM_DELLINK, body)
+
+        elif kind == 'link_set':
+            flags = netlink.IFF_UP if op['state'] == 'up' else 0
+            change = netlink.IFF_UP if op['state'] else 0
+            body = netlink.IFINFOMSG.pack(0, 0, self._ifindex(op['name']), flags, change)
+            if op['master'] is not None:
+                master = self._ifindex(op['master']) if op['master'] else 0
+                body += netlink.nla_u32(netlink.IFLA_MASTER, master)
+            self.nl.request(netlink.RTM_NEWLINK, body)
+
+        elif kind == 'addr_add':
+            iface = ipaddress.ip_interface(op['address'])
+            family = socket.AF_INET if iface.version == 4 else socket.AF_INET6
+            body = (netlink.IFADDRMSG.pack(family, iface.network.prefixlen, 0, 0, self._ifindex(op['name']))
+                    + netlink.nla(netlink.IFA_LOCAL, iface.ip.packed)
+                    + netlink.nla(netlink.IFA_ADDRESS, iface.ip.packed))
+            self.nl.request(netlink.RTM_NEWADDR, body, netlink.NLM_F_CREATE | netlink.NLM_F_EXCL)
+
+        elif kind == 'filter':
+            self._send_filter(op)
+
+        else:
+            is_class = kind == 'class'
+            handle = netlink.parse_handle(op['classid'] if is_class else op['handle'])
+            body = netlink.TCMSG.pack(0, self._ifindex(op['dev']), handle,
+                                      netlink.parse_handle(op['parent']), 0)
+            if op['kind']:
+                body += netlink.nla_str(netlink.TCA_KIND, op['kind'])
+                options = _encode_tc_options(op['kind'], op['options'], is_class)
+                if options is not None:
+                    body += netlink.nla(netlink.TCA_OPTIONS, options)
+
+            if op['action'] == 'del':
+                msg_type = netlink.RTM_DELTCLASS if is_class else netlink.RTM_DELQDISC
+                self.nl.request(msg_type, body)
+            else:
+                flags = (self._CLASS_FLAGS if is_class else self._QDISC_FLAGS)[op['action']]
+                msg_type = netlink.RTM_NEWTCLASS if is_class else netlink.RTM_NEWQDISC
+                self.nl.request(msg_type, body, flags)
+
+    def _send_filter(self, op):
+        info = 0
+        if op['prio'] is not None:
+            protocol = netlink.ETH_P_ALL if op['protocol'] == 'all' else netlink.ETH_P_IP
+            info = (op['prio'] << 16) | socket.htons(protocol)
+        handle = 0
+        if op['handle']:
+            handle = netlink.parse_u32_handle(op['handle']) if op['kind'] == 'u32' else int(op['handle'], 0)
+        body = netlink.TCMSG.pack(0, self._ifindex(op['dev']), handle, netlink.parse_handle(op['parent']), info)
+        if op['kind']:
+            body += netlink.nla_str(netlink.TCA_KIND, op['kind'])
+            if op['kind'] == 'matchall':
+                options = netlink.encode_matchall_redirect(self._ifindex(op['options']['redirect']))
+            elif op['kind'] == 'u32':
+                options = netlink.encode_u32(op['options'])
+            else:
+                options = netlink.encode_flower(op['options'])
+            body += netlink.nla(netlink.TCA_OPTIONS, options)
+
+        if op['action'] == 'del':
+            self.nl.request(netlink.RTM_DELTFILTER, body)
+        else:
+            self.nl.request(netlink.RTM_NEWTFILTER, body, netlink.NLM_F_CREATE | netlink.NLM_F_EXCL)
+
+    def list_links(self):
+        links = [netlink.decode_link(payload)
+                 for _, payload in self.nl.dump(netlink.RTM_GETLINK, netlink.IFINFOMSG.pack(0, 0, 0, 0, 0))]
+        names = {link['index']: link['name'] for link in links}
+        for link in links:
+            link['master'] = names.get(link['master'])
+        return links
+
+    def get_link(self, name):
+        body = netlink.IFINFOMSG.pack(0, 0, 0, 0, 0) + netlink.nla_str(netlink.IFLA_IFNAME, name)
+        try:
+            replies = self.nl.request(netlink.RTM_GETLINK, body)
+        except netlink.NetlinkError:
+            return None
+        if not replies:
+            return None
+        link = netlink.decode_link(replies[0][1])
+        if link['master']:
+            try:
+                link['master'] = socket.if_indextoname(link['master'])
+            except OSError:
+                link['master'] = None
+        return link
+
+    def get_addresses(self, name):
+        try:
+            index = self._ifindex(name)
+        except netlink.NetlinkError:
+            return []
+        return self._dump_addresses().get(index, [])
+
+    def list_addresses(self):
+        names = {link['index']: link['name'] for link in self.list_links()}
+        return {names[index]: addresses for index, addresses in self._dump_addresses().items()
+                if index in names}
+
+    def _dump_addresses(self):
+        addresses = {}
+        body = netlink.IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        for _, payload in self.nl.dump(netlink.RTM_GETADDR, body):
+            index, address = netlink.decode_address(payload)
+            if address:
+                addresses.setdefault(index, []).append(address)
+        return addresses
+
+    def _dump_tc(self, msg_type, dev, is_class):
+        try:
+            index = self._ifindex(dev)
+        except netlink.NetlinkError:
+            return []
+        return [entry for entry_index, entry in self._dump_tc_entries(msg_type, index, is_class)
+                if entry_index == index]
+
+    def _dump_tc_entries(self, msg_type, index, is_class):
+        """[(ifindex, entry), ...] of a qdisc/class dump, index 0 for every link"""
+        entries = []
+        for _, payload in self.nl.dump(msg_type, netlink.TCMSG.pack(0, index, 0, 0, 0)):
+            _, entry_index, handle, parent, _ = netlink.TCMSG.unpack_from(payload)
+            attrs = netlink.parse_attrs(payload, netlink.TCMSG.size)
+            kind = netlink.attr_str(attrs, netlink.TCA_KIND)
+            options = {}
+            if netlink.TCA_OPTIONS in attrs:
+                options = _decode_tc_options(kind, attrs[netlink.TCA_OPTIONS], is_class)
+            entries.append((entry_index, {
+                'kind': kind,
+                'handle': netlink.format_handle(handle),
+                'parent': _class_parent(netlink.format_handle(handle), netlink.format_handle(parent), is_class),
+                'options': options,
+                'stats': netlink.decode_tc_stats(attrs)
+            }))
+        return entries
+
+    def get_qdiscs(self, dev):
+        return self._dump_tc(netlink.RTM_GETQDISC, dev, is_class=False)
+
+    def list_qdiscs(self):
+        names = {link['index']: link['name'] for link in self.list_links()}
+        qdiscs = {}
+        for index, entry in self._dump_tc_entries(netlink.RTM_GETQDISC, 0, is_class=False):
+            if index in names:
+                qdiscs.setdefault(names[index], []).append(entry)
+        return qdiscs
+
+    def get_classes(self, dev):
+        return self._dump_tc(netlink.RTM_GETTCLASS, dev, is_class=True)
+
+    def get_filters(self, dev, parent):
+        try:
+            body = netlink.TCMSG.pack(0, self._ifindex(dev), 0, netlink.parse_handle(parent), 0)
+            replies = self.nl.dump(netlink.RTM_GETTFILTER, body)
+        except netlink.NetlinkError:
+            return []
+        filters = []
+        for _, payload in replies:
+            _, _, handle, _, info = netlink.TCMSG.unpack_from(payload)
+            attrs = netlink.parse_attrs(payload, netlink.TCMSG.size)
+            filters.append({'kind': netlink.attr_str(attrs, netlink.TCA_KIND), 'prio': info >> 16,
+                            'handle': f'{handle:x}' if handle else None})
+        return filters
+
+
+def _encode_tc_options(kind, options, is_class):
+    """Encode TCA_OPTIONS for the qdisc/class kinds we manage"""
+    if kind == 'netem':
+        return netlink.encode_netem(options)
+    if kind == 'htb':
+        return netlink.encode_htb_class(options) if is_class else netlink.encode_htb_qdisc(options)
+    return None
+
+
+def _decode_tc_options(kind, payload, is_class):
+    """Decode TCA_OPTIONS for the qdisc/class kinds we manage"""
+    try:
+        if kind == 'netem':
+            return netlink.decode_netem(payload)
+        if kind == 'htb':
+            return netlink.decode_htb_class(payload) if is_class else netlink.decode_htb_qdisc(payload)
+    except Exception:
+        pass
+    return {}
+
+
+class FakeBackendError(Exception):
+    """Simulated kernel error raised by FakeBackend"""
+
+
+class FakeBackend(Backend):
+    """In-memory model of links, addresses, qdiscs and classes
+
+    Lets the whole controller run (and be tested or benchmarked) without
+    root. Every successfully executed operation is recorded in `executed`
+    as its equivalent ip/tc command line.
+    """
+
+    name = 'fake'
+    live = False
+
+    def __init__(self, interfaces=FAKE_INTERFACES, force=BATCH_FORCE):
+        super().__init__(force)
+        self.links = {}
+        self.addresses = {}
+        self.qdiscs = {}
+        self.classes = {}
+        self.filters = {}
+        self.executed = []
+        self._lock = threading.Lock()
+        for name in interfaces:
+            self._create_link(name, None)
+            self.links[name]['operstate'] = 'up'
+
+    def _create_link(self, name, kind):
+        self.links[name] = {'name': name, 'index': len(self.links) + 1, 'operstate': 'down',
+                            'master': None, 'kind': kind}
+        self.addresses[name] = []
+        self.qdiscs[name] = []
+        self.classes[name] = []
+        self.filters[name] = []
+
+    def _run(self, ops, force):
+        failures = []
+        with self._lock:
+            for op in ops:
+                try:
+                    self._apply(op)
+                    self.executed.append(describe_op(op))
+                except FakeBackendError as e:
+                    failures.append({'interface': op['interface'], 'command': describe_op(op), 'error': str(e)})
+                    if not force:
+                        break
+        return failures
+
+    def _require_link(self, name):
+        if name not in self.links:
+            raise FakeBackendError(f'Cannot find device "{name}"')
+        return self.links[name]
+
+    def _apply(self, op):
+        kind = op['op']
+        if kind == 'link_add':
+            if op['name'] in self.links:
+                raise FakeBackendError('RTNETLINK answers: File exists')
+            self._create_link(op['name'], op['kind'])
+
+        elif kind == 'link_delete':
+            self._require_link(op['name'])
+            for name in (self.links, self.addresses, self.qdiscs, self.classes, self.filters):
+                del name[op['name']]
+            for link in self.links.values():
+                if link['master'] == op['name']:
+                    link['master'] = None
+
+        elif kind == 'link_set':
+            link = self._require_link(op['name'])
+            if op['master']:
+                if self._require_link(op['master'])['kind'] != 'bridge':
+                    raise FakeBackendError('RTNETLINK answers: Operation not supported')
+            if op['master'] is not None:
+                link['master'] = op['master'] or None
+            if op['state']:
+                link['operstate'] = op['state']
+
+        elif kind == 'addr_add':
+            self._require_link(op['name'])
+            if op['address'] in self.addresses[op['name']]:
+                raise FakeBackendError('RTNETLINK answers: File exists')
+            self.addresses[op['name']].append(op['address'])
+
+        elif kind == 'qdisc':
+            self._require_link(op['dev'])
+            self._apply_qdisc(op)
+
+        elif kind == 'filter':
+            self._require_link(op['dev'])
+            self._apply_filter(op)
+
+        else:
+            self._require_link(op['dev'])
+            self._apply_class(op)
+
+    def _find(self, entries, **match):
+        for entry in entries:
+            if all(entry[key] == value for key, value in match.items()):
+                return entry
+        return None
+
+    def _remove_qdisc(self, dev, qdisc):
+        """Remove a qdisc together with its classes and child qdiscs"""
+        major = qdisc['handle'].split(':')[0]
+        self.qdiscs[dev].remove(qdisc)
+        self.filters[dev] = [f for f in self.filters[dev] if f['parent'] != qdisc['handle']]
+        for cls in [c for c in self.classes[dev] if c['handle'].split(':')[0] == major]:
+            self.classes[dev].remove(cls)
+        for child in [q for q in self.qdiscs[dev] if q['parent'].split(':')[0] == major]:
+            self._remove_qdisc(dev, child)
+
+    def _apply_qdisc(self, op):
+        dev, action = op['dev'], op['action']
+        existing = self._find(self.qdiscs[dev], parent=op['parent'])
+        entry = {'kind': op['kind'], 'handle': op['handle'] or '0:', 'parent': op['parent'],
+                 'options': dict(op['options']), 'stats': _zero_stats()}
+
+        if action == 'del':
+            if existing is None:
+                raise FakeBackendError('Error: Cannot delete qdisc with handle of zero.')
+            self._remove_qdisc(dev, existing)
+        elif action == 'change':
+            if existing is None or (op['handle'] and existing['handle'] != op['handle']):
+                raise FakeBackendError('Error: Specified qdisc not found.')
+            if existing['kind'] != op['kind']:
+                raise FakeBackendError('Error: Specified qdisc kind is different.')
+            existing['options'] = dict(op['options'])
+        else:
+            if existing is not None:
+                if action == 'add':
+                    raise FakeBackendError('Error: Exclusivity flag on, cannot modify.')
+                self._remove_qdisc(dev, existing)
+            # Root and ingress (ffff:fff1) qdiscs hang off the device itself
+            if op['parent'] not in ('root', 'ffff:fff1') and self._find(self.classes[dev], handle=op['parent']) is None:
+                raise FakeBackendError('Error: Failed to find specified qdisc.')
+            self.qdiscs[dev].append(entry)
+
+    def _apply_class(self, op):
+        dev, action = op['dev'], op['action']
+        existing = self._find(self.classes[dev], handle=op['classid'])
+        if action == 'del':
+            if existing is None:
+                raise FakeBackendError('Error: Specified class not found.')
+            self.classes[dev].remove(existing)
+            child = self._find(self.qdiscs[dev], parent=op['classid'])
+            if child is not None:
+                self._remove_qdisc(dev, child)
+        elif existing is not None:
+            if action == 'add':
+                raise FakeBackendError('RTNETLINK answers: File exists')
+            existing['options'] = dict(op['options'])
+        elif action == 'change':
+            raise FakeBackendError('Error: Specified class not found.')
+        else:
+            major = op['parent'].split(':')[0]
+            if not any(q['handle'].split(':')[0] == major for q in self.qdiscs[dev]):
+                raise FakeBackendError('Error: Failed to find qdisc with specified handle.')
+            self.classes[dev].append({'kind': op['kind'], 'handle': op['classid'], 'parent': op['parent'],
+                                      'options': dict(op['options']), 'stats': _zero_stats()})
+
+    def _apply_filter(self, op):
+        dev = op['dev']
+        if self._find(self.qdiscs[dev], handle=op['parent']) is None:
+            raise FakeBackendError("Error: Parent Qdisc doesn't exists.")
+        if op['action'] == 'del':
+            # Without a priority every filter of the parent goes
+            self.filters[dev] = [f for f in self.filters[dev]
+                                 if f['parent'] != op['parent'] or (op['prio'] is not None and f['prio'] != op['prio'])]
+            return
+        if op['options'].get('redirect'):
+            self._require_link(op['options']['redirect'])
+        classid = op['options'].get('classid')
+        if classid and self._find(self.classes[dev], handle=classid) is None:
+            raise FakeBackendError('Error: Specified class not found.')
+        self.filters[dev].append({'kind': op['kind'], 'prio': op['prio'], 'handle': op['handle'],
+                                  'parent': op['parent'], 'options': copy.deepcopy(op['options'])})
+
+    def list_links(self):
+        with self._lock:
+            return [dict(link) for link in self.links.values()]
+
+    def get_link(self, name):
+        with self._lock:
+            link = self.links.get(name)
+            return dict(link) if link else None
+
+    def get_addresses(self, name):
+        with self._lock:
+            return list(self.addresses.get(name, []))
+
+    def get_qdiscs(self, dev):
+        with self._lock:
+            return copy.deepcopy(self.qdiscs.get(dev, []))
+
+    def get_classes(self, dev):
+        with self._lock:
+            return copy.deepcopy(self.classes.get(dev, []))
+
+    def get_filters(self, dev, parent):
+        with self._lock:
+            return [{'kind': f['kind'], 'prio': f['prio'], 'handle': f['handle']}
+                    for f in self.filters.get(dev, []) if f['parent'] == parent]
+
+
+def _zero_stats():
+    return {'bytes': 0, 'packets': 0, 'drops': 0, 'overlimits': 0, 'requeues': 0, 'backlog': 0, 'qlen': 0}
+
+
+BACKENDS = {
+    'subprocess': SubprocessBackend,
+    'netlink': NetlinkBackend,
+    'fake': FakeBackend,
+}
+
+
+def create_backend(name, **kwargs):
+    """Instantiate a backend by its config name"""
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend '{name}', expected one of: {', '.join(BACKENDS)}")
+    return backend_class(**kwargs)
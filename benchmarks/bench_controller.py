@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the controller hot paths - runs without root against
+synthetic /proc/net/dev files and the in-memory fake backend
+
+Usage: python3 benchmarks/bench_controller.py [--quick] [--filter TEXT]
+                                              [--save NAME] [--compare NAME] [--threshold 0.25]
+
+Results are saved to benchmarks/results/<NAME>.json; --compare prints the
+change against a saved run and exits with 1 if any case got slower by more
+than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+import config
+
+# Everything below must run without root: never touch the real kernel
+config.BACKEND = 'fake'
+config.STATE_DB = None
+
+from backends import FakeBackend
+from push import StatsPublisher
+from stats import StatsSampler, compute_sample, read_proc_net_dev
+from stats_stream import StreamEncoder
+
+SIZES = (1, 64, 1024)
+FANOUT_CLIENTS = (1, 64, 256)
+
+
+def write_proc_net_dev(path, count, tick=0):
+    """Synthetic /proc/net/dev with `count` interfaces (eth0...), counters advanced by `tick`"""
+    lines = ['Inter-|   Receive                                                |  Transmit',
+             ' face |bytes    packets errs drop fifo frame compressed multicast|'
+             'bytes    packets errs drop fifo colls carrier compressed']
+    for i in range(count):
+        base = (i + 1) * 1000 + tick * (i + 7) * 1500
+        rx = [base * 1500, base, i % 3, i % 5, 0, 0, 0, 0]
+        tx = [base * 1200, base - i, i % 2, i % 7, 0, 0, 0, 0]
+        lines.append(f"eth{i}: " + ' '.join(str(value) for value in rx + tx))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return [f'eth{i}' for i in range(count)]
+
+
+def make_bridge(interfaces, proc_path):
+    """NetworkBridge over a fake backend with `interfaces` as its ports"""
+    import app
+    backend = FakeBackend(interfaces=interfaces)
+    sampler = StatsSampler(path=proc_path)
+    bridge = app.NetworkBridge('br0', None, backend=backend, sampler=sampler)
+    bridge.interfaces = list(interfaces)
+    bridge.is_active = True
+    return bridge
+
+
+def case_stats_sample(workdir, count):
+    """One sampler tick: read /proc/net/dev and compute every rate"""
+    path = os.path.join(workdir, f'dev-{count}')
+    write_proc_net_dev(path, count)
+    sampler = StatsSampler(path=path)
+    sampler.sample_once()
+    return sampler.sample_once
+
+
+def case_apply_tc_rules(workdir, count):
+    """apply_tc_rules on `count` interfaces, alternating two delays so every call changes netem"""
+    path = os.path.join(workdir, f'dev-{count}')
+    interfaces = write_proc_net_dev(path, count)
+    bridge = make_bridge(interfaces, path)
+    delays = iter(range(10 ** 9))
+
+    def run():
+        success, message = bridge.apply_tc_rules({'interfaces': interfaces, 'bandwidth': 100,
+                                                  'delay': 10 + next(delays) % 2})
+        assert success, message
+    return run
+
+
+def case_network_stats_json(workdir, count):
+    """get_network_stats after a new tick (cache miss) serialized to JSON"""
+    path = os.path.join(workdir, f'dev-{count}')
+    interfaces = write_proc_net_dev(path, count)
+    bridge = make_bridge(interfaces, path)
+    sample = bridge.sampler.sample_once()
+    return lambda: json.dumps(bridge._build_network_stats(sample))
+
+
+def _fanout_app(workdir, clients):
+    """The controller's Socket.IO server with `clients` test clients connected"""
+    import app
+    path = os.path.join(workdir, 'dev-64')
+    write_proc_net_dev(path, 64)
+    app.manager.sampler.path = path
+    return app, [app.socketio.test_client(app.app) for _ in range(clients)]
+
+
+def case_emit_fanout(workdir, clients):
+    """Legacy network_stats_update broadcast (64 interfaces) to `clients` clients"""
+    app, test_clients = _fanout_app(workdir, clients)
+    path = os.path.join(workdir, 'dev-64')
+    bridge = make_bridge(write_proc_net_dev(path, 64), path)
+    stats = bridge.get_network_stats()
+
+    def run():
+        app._emit('network_stats_update', stats, to=app.LEGACY_STATS_ROOM)
+        for client in test_clients:
+            client.get_received()
+    return run, lambda: [client.disconnect() for client in test_clients]
+
+
+def case_publish_fanout(workdir, clients):
+    """Delta frames for `clients` subscribers spread over 16 distinct subscriptions"""
+    app, test_clients = _fanout_app(workdir, clients)
+    for index, client in enumerate(test_clients):
+        client.emit('subscribe', {'interfaces': [f'eth{index % 16}', f'eth{16 + index % 16}']})
+        client.get_received()
+
+    # Alternate two ticks so every frame carries changed values
+    paths = [os.path.join(workdir, f'tick-{tick}') for tick in (1, 2)]
+    for tick, path in enumerate(paths, 1):
+        write_proc_net_dev(path, 64, tick)
+    first, second = (read_proc_net_dev(path) for path in paths)
+    samples = [compute_sample(1, second, first), compute_sample(2, first, second)]
+    ticks = iter(range(10 ** 9))
+
+    def run():
+        app.publisher.publish(samples[next(ticks) % 2])
+        for client in test_clients:
+            client.get_received()
+    return run, lambda: [client.disconnect() for client in test_clients]
+
+
+def case_publish_encode(workdir, clients):
+    """StatsPublisher frame building alone (no Socket.IO), `clients` distinct subscriptions"""
+    path = os.path.join(workdir, 'dev-1024')
+    write_proc_net_dev(path, 1024)
+    publisher = StatsPublisher(lambda event, payload, room: None)
+    for index in range(clients):
+        publisher.subscribe(index, [f'eth{index}', f'eth{index + 1}'])
+    paths = [os.path.join(workdir, f'tick-1024-{tick}') for tick in (1, 2)]
+    for tick, path in enumerate(paths, 1):
+        write_proc_net_dev(path, 1024, tick)
+    first, second = (read_proc_net_dev(path) for path in paths)
+    samples = [compute_sample(1, second, first), compute_sample(2, first, second)]
+    ticks = iter(range(10 ** 9))
+    return lambda: publisher.publish(samples[next(ticks) % 2])
+
+
+def case_stream_encode(workdir, fmt):
+    """One /api/network/stats/stream sample of 1024 interfaces, `fmt` encoding"""
+    path = os.path.join(workdir, 'dev-1024')
+    write_proc_net_dev(path, 1024)
+    sampler = StatsSampler(path=path)
+    sampler.sample_once()
+    sample = sampler.sample_once()
+    encoder = StreamEncoder(fmt)
+    # Steady state: the row names went out with the first sample
+    encoder.encode(sample)
+    return lambda: encoder.encode(sample)
+
+
+CASES = (
+    [(f'stats_sample[{n}]', case_stats_sample, n) for n in SIZES]
+    + [(f'apply_tc_rules[{n}]', case_apply_tc_rules, n) for n in (64, 1024)]
+    + [(f'network_stats_json[{n}]', case_network_stats_json, n) for n in SIZES]
+    + [(f'emit_fanout[{n}]', case_emit_fanout, n) for n in FANOUT_CLIENTS]
+    + [(f'publish_fanout[{n}]', case_publish_fanout, n) for n in FANOUT_CLIENTS]
+    + [(f'publish_encode[{n}]', case_publish_encode, n) for n in FANOUT_CLIENTS]
+    + [(f'stream_encode_{fmt}[1024]', case_stream_encode, fmt) for fmt in ('binary', 'ndjson')]
+)
+
+
+def measure(func, quick):
+    """Best of 5 (3 with --quick) repeats, in microseconds per call"""
+    # Size the inner loop so one repeat takes roughly 0.2 s (0.05 s quick)
+    number = 1
+    target = 0.05 if quick else 0.2
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= target / 4 or number >= 10 ** 6:
+            break
+        number *= 4
+    number = max(1, int(number * target / max(elapsed, 1e-9)))
+    best = min(timeit.repeat(func, number=number, repeat=3 if quick else 5))
+    return best / number * 1e6
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the change per case, returns the names of regressed cases"""
+    regressions = []
+    print(f"\n{'case':<26}{'baseline us':>14}{'now us':>12}{'change':>10}")
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<26}{'-':>14}{value:>12.1f}{'new':>10}")
+            continue
+        change = value / old - 1
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{name:<26}{old:>14.1f}{value:>12.1f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='shorter runs, noisier numbers')
+    parser.add_argument('--filter', default='', help='only cases whose name contains this text')
+    parser.add_argument('--save', metavar='NAME', help='save results to benchmarks/results/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with benchmarks/results/NAME.json')
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown reported as a regression')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':<26}{'us/call':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup, size in CASES:
+            if args.filter not in name:
+                continue
+            func = setup(workdir, size)
+            teardown = None
+            if isinstance(func, tuple):
+                func, teardown = func
+            results[name] = round(measure(func, args.quick), 2)
+            if teardown:
+                teardown()
+            print(f"{name:<26}{results[name]:>12.1f}")
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{args.save}.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+                'results': results
+            }, f, indent=2)
+            f.write('\n')
+        print(f"\nSaved {path}")
+
+    if args.compare:
+        with open(os.path.join(RESULTS_DIR, f'{args.compare}.json'), 'r') as f:
+            baseline = json.load(f)
+        print(f"Baseline: {args.compare} (revision {baseline.get('revision')}, {baseline.get('date')})")
+        if compare(results, baseline['results'], args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Sandbox benchmark - controller latency and shaping throughput at 100+ ports,
+with the controller inside a veth sandbox (needs root; no host link is touched)
+
+Usage: sudo python3 benchmarks/bench_sandbox.py [--ports 128] [--backend subprocess|netlink]
+                                                [--bandwidth 2] [--rate 250] [--size 1200]
+                                                [--duration 5] [--repeat 5] [--save NAME]
+
+The sandbox is built, the controller runs against it in a child process
+(which enters the sandbox namespace), and the sandbox is deleted afterwards.
+Results are saved to benchmarks/results/<NAME>.json.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+import config
+
+config.STATE_DB = None
+
+from sandbox import Sandbox
+
+
+def timed(results, name, func, repeat=1):
+    """Run func `repeat` times, record median/max milliseconds; fails on an unsuccessful result"""
+    times = []
+    for attempt in range(repeat):
+        started = time.perf_counter()
+        result = func(attempt)
+        times.append((time.perf_counter() - started) * 1000)
+        if isinstance(result, tuple) and not result[0]:
+            raise RuntimeError(f"{name}: {result[1]}")
+    results[name] = {'median_ms': round(statistics.median(times), 2), 'max_ms': round(max(times), 2)}
+    print(f"{name:<34}{results[name]['median_ms']:>12.1f}{results[name]['max_ms']:>12.1f}")
+
+
+def run_inside(args):
+    """Controller cases, run in the child process that entered the sandbox"""
+    config.BACKEND = args.backend
+    config.NETNS = args.name
+    import app
+
+    sandbox = Sandbox(args.name, args.ports)
+    ports = sandbox.ports
+    bridge = app.bridge
+    pool = app.manager.tc_pool
+    results = {}
+    print(f"{'case':<34}{'median ms':>12}{'max ms':>12}")
+
+    timed(results, f'create_bridge[{args.ports}]', lambda _: bridge.create_bridge(ports))
+    timed(results, f'apply_tc_rules_add[{args.ports}]',
+          lambda _: bridge.apply_tc_rules({'interfaces': ports, 'bandwidth': args.bandwidth}))
+    # Alternate two rates so every call changes every class
+    rates = (args.bandwidth * 2, args.bandwidth)
+    timed(results, f'apply_tc_rules_change[{args.ports}]',
+          lambda attempt: bridge.apply_tc_rules({'interfaces': ports, 'bandwidth': rates[attempt % 2]}),
+          args.repeat * 2)
+    timed(results, f'apply_tc_bulk[{args.ports}]',
+          lambda attempt: bridge.apply_tc_bulk({port: {'bandwidth': args.bandwidth + (index + attempt) % 2}
+                                                for index, port in enumerate(ports)}, pool), args.repeat * 2)
+    timed(results, f'apply_tc_rules_one[{args.ports}]',
+          lambda attempt: bridge.apply_tc_rules({'interfaces': [ports[0]], 'bandwidth': rates[attempt % 2]}),
+          args.repeat * 2)
+    bridge.apply_tc_rules({'interfaces': ports, 'bandwidth': args.bandwidth})
+    bridge.sampler.sample_once()
+    timed(results, f'network_stats[{args.ports}]', lambda _: bridge.get_network_stats(), args.repeat)
+
+    # Traffic comes from its own process so it doesn't compete with the controller for the GIL
+    generator = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'sandbox.py'), '--name', args.name, '--ports', str(args.ports),
+         'traffic', '--rate', str(args.rate), '--size', str(args.size), '--duration', str(args.duration), '--json'],
+        stdout=subprocess.PIPE, text=True)
+    time.sleep(min(1, args.duration / 4))
+    # Nudge the rate by 1 kbit/s so every call changes every class but the shaping stays at --bandwidth
+    nudged = (args.bandwidth + 0.001, args.bandwidth)
+    timed(results, f'apply_tc_rules_under_load[{args.ports}]',
+          lambda attempt: bridge.apply_tc_rules({'interfaces': ports, 'bandwidth': nudged[attempt % 2]}),
+          args.repeat * 2)
+    output, _ = generator.communicate()
+    traffic = json.loads(output.strip().splitlines()[-1])
+
+    timed(results, f'clear_tc[{args.ports}]', lambda _: bridge.apply_tc_rules({'interfaces': ports}))
+    timed(results, f'destroy_bridge[{args.ports}]', lambda _: bridge.destroy_bridge())
+
+    offered = args.rate * args.size * 8 / 1e6
+    expected = min(offered, args.bandwidth)
+    delivered = [flow['throughput_mbps'] or 0 for flow in traffic['flows']]
+    rtt = traffic['rtt_ms'] or {}
+    results['shaping'] = {
+        'flows': len(delivered),
+        'offered_mbps': round(offered, 3),
+        'bandwidth_mbps': args.bandwidth,
+        'delivered_mbps': {'mean': round(statistics.mean(delivered), 3), 'min': min(delivered),
+                           'max': max(delivered)},
+        'accuracy': round(statistics.mean(delivered) / expected, 3) if expected else None,
+        'loss_percent': traffic['loss_percent'],
+        'rtt_ms': {key: rtt.get(key) for key in ('p50', 'p99', 'max')}
+    }
+    print(f"\nShaping: {len(delivered)} flows offering {offered:.2f} Mbit/s through {args.bandwidth} Mbit/s ports")
+    print(f"  delivered mean {statistics.mean(delivered):.3f} (min {min(delivered):.3f}, max {max(delivered):.3f}) "
+          f"Mbit/s, loss {traffic['loss_percent']}%, rtt p50 {rtt.get('p50')} p99 {rtt.get('p99')} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--name', default='tcb-bench', help='sandbox namespace (must not exist)')
+    parser.add_argument('--ports', type=int, default=128)
+    parser.add_argument('--backend', default='subprocess', choices=('subprocess', 'netlink'))
+    parser.add_argument('--bandwidth', type=float, default=2, help='Mbit/s shaping per port')
+    parser.add_argument('--rate', type=float, default=250, help='packets per second per flow')
+    parser.add_argument('--size', type=int, default=1200, help='UDP payload bytes')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of traffic')
+    parser.add_argument('--repeat', type=int, default=5, help='calls per latency case')
+    parser.add_argument('--save', metavar='NAME', help='save results to benchmarks/results/NAME.json')
+    parser.add_argument('--inside', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.inside:
+        print(json.dumps(run_inside(args)))
+        return 0
+
+    sandbox = Sandbox(args.name, args.ports)
+    success, message = sandbox.create()
+    print(message)
+    if not success:
+        return 1
+    try:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--inside'] + sys.argv[1:],
+                               stdout=subprocess.PIPE, text=True)
+    finally:
+        print(sandbox.destroy()[1])
+    lines = child.stdout.strip().splitlines()
+    print('\n'.join(lines[:-1]))
+    if child.returncode != 0 or not lines:
+        return 1
+    results = json.loads(lines[-1])
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{args.save}.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+                'backend': args.backend,
+                'ports': args.ports,
+                'results': results
+            }, f, indent=2)
+            f.write('\n')
+        print(f"\nSaved {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-file sysfs counter reads vs one /proc/net/dev read
+
+Usage: python3 benchmarks/bench_stats_collector.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stats import COUNTER_FIELDS, read_proc_net_dev
+
+
+def read_sysfs_counters(interfaces):
+    """Previous approach: open one sysfs file per counter per interface"""
+    stats = {}
+    for interface in interfaces:
+        counters = {}
+        for field in COUNTER_FIELDS:
+            try:
+                with open(f'/sys/class/net/{interface}/statistics/{field}', 'r') as f:
+                    counters[field] = int(f.read().strip())
+            except (OSError, ValueError):
+                counters[field] = 0
+        stats[interface] = counters
+    return stats
+
+
+def read_snapshot_counters(interfaces):
+    """New approach: one read, then lookups into the snapshot"""
+    snapshot = read_proc_net_dev()
+    return {interface: snapshot.get(interface) for interface in interfaces}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    interfaces = list(read_proc_net_dev().names)
+
+    print(f"Interfaces: {len(interfaces)}, iterations: {iterations}")
+    print(f"{'approach':<22}{'us/collection':>15}{'file opens':>12}")
+
+    results = {}
+    for name, func, opens in (
+        ('sysfs per-file', read_sysfs_counters, len(interfaces) * len(COUNTER_FIELDS)),
+        ('/proc/net/dev', read_snapshot_counters, 1),
+    ):
+        best = min(timeit.repeat(lambda: func(interfaces), number=iterations, repeat=5))
+        results[name] = best / iterations * 1e6
+        print(f"{name:<22}{results[name]:>15.1f}{opens:>12}")
+
+    print(f"Speedup: {results['sysfs per-file'] / results['/proc/net/dev']:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
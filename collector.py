@@ -0,0 +1,305 @@
+"""
+Scale-out mode - a collector process owns the kernel (sampler, topology,
+bridge operations) and streams stats samples, topology and TC state over a
+Unix socket; web worker processes mirror them and forward control requests
+"""
+
+import errno
+import http.client
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from array import array
+
+from stats import NUM_COUNTERS, NUM_RATES, CounterSnapshot, StatsSample, StatsSampler
+from topology import TopologyCache
+
+# Every frame: type, payload length
+_FRAME = struct.Struct('!BI')
+# Sample payload: JSON header length, header, then the raw arrays
+_HEADER = struct.Struct('!I')
+
+SAMPLE_FRAME = 1
+TOPOLOGY_FRAME = 2
+TC_STATE_FRAME = 3
+
+SEND_TIMEOUT = 1.0     # seconds before a stalled web worker is dropped
+SEND_QUEUE = 16        # frames waiting for a web worker before it counts as stalled
+RECONNECT_DELAY = 1.0  # seconds between connection attempts to the collector
+
+
+def encode_sample(sample):
+    """One sample as a frame: names in a JSON header, counters and rates as raw arrays"""
+    snapshot = sample.snapshot
+    header = json.dumps({'timestamp': snapshot.timestamp, 'names': snapshot.names}).encode()
+    payload = b''.join((_HEADER.pack(len(header)), header, snapshot.counters.tobytes(),
+                        sample.rates.tobytes(), sample.has_rates.tobytes()))
+    return _FRAME.pack(SAMPLE_FRAME, len(payload)) + payload
+
+
+def decode_sample(payload, sequence):
+    """StatsSample from a sample frame payload, numbered with the receiver's own sequence"""
+    (length,) = _HEADER.unpack_from(payload)
+    header = json.loads(payload[_HEADER.size:_HEADER.size + length])
+    count = len(header['names'])
+    offset = _HEADER.size + length
+    arrays = []
+    for typecode, width in (('Q', NUM_COUNTERS), ('d', NUM_RATES), ('b', 1)):
+        values = array(typecode)
+        size = values.itemsize * width * count
+        values.frombytes(payload[offset:offset + size])
+        offset += size
+        arrays.append(values)
+    counters, rates, has_rates = arrays
+    return StatsSample(sequence, CounterSnapshot(header['timestamp'], header['names'], counters), rates, has_rates)
+
+
+def encode_topology(topology):
+    """Links and addresses of a topology cache as a frame"""
+    links = topology.links()
+    payload = json.dumps({
+        'links': links,
+        'addresses': {link['name']: topology.get_addresses(link['name']) for link in links}
+    }).encode()
+    return _FRAME.pack(TOPOLOGY_FRAME, len(payload)) + payload
+
+
+def encode_tc_state(state):
+    """Desired qdisc trees ({bridge: {interface: tree}}) as a frame"""
+    payload = json.dumps(state, sort_keys=True).encode()
+    return _FRAME.pack(TC_STATE_FRAME, len(payload)) + payload
+
+
+class _WorkerConnection:
+    """A connected web worker; frames are queued and written by its own thread"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.frames = queue.Queue(SEND_QUEUE)
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self._run, name='collector-send', daemon=True).start()
+
+    def send(self, frame):
+        """Queue a frame without blocking, False once the worker is gone or stalled"""
+        if self.closed:
+            return False
+        try:
+            self.frames.put_nowait(frame)
+            return True
+        except queue.Full:
+            print("Dropping web worker: send queue full")
+            self.close()
+            return False
+
+    def close(self):
+        self.closed = True
+        try:
+            # Wakes the writer if it is blocked sending
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.frames.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while not self.closed:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            try:
+                self.sock.sendall(frame)
+            except OSError as e:
+                if not self.closed:
+                    print(f"Dropping web worker: {e}")
+                self.closed = True
+        self.sock.close()
+
+
+class CollectorServer:
+    """Streams every sample, topology and TC state change to the connected web workers
+
+    A new worker first gets the current topology, TC state and latest
+    sample. Frames are encoded once and queued for each worker, whose own
+    thread writes them, so a slow worker never delays the sampler; a worker
+    with SEND_QUEUE frames waiting, or that can't take one within
+    SEND_TIMEOUT, is disconnected (it reconnects and resyncs).
+
+    `tc_state` returns {bridge: {interface: tree}}; it is checked every
+    tick and sent when it changed.
+    """
+
+    def __init__(self, path, sampler, topology, tc_state=None):
+        self.path = path
+        self.sampler = sampler
+        self.topology = topology
+        self.tc_state = tc_state or dict
+        self._tc_frame = encode_tc_state(self.tc_state())
+        self._clients = []
+        self._lock = threading.Lock()
+        self._socket = None
+        sampler.add_listener(self._on_sample)
+        topology.add_listener(lambda: self._broadcast(encode_topology(self.topology)))
+
+    def _on_sample(self, sample):
+        try:
+            frame = encode_tc_state(self.tc_state())
+        except RuntimeError as e:
+            # Changed while being read: sent on the next tick instead
+            print(f"Error reading TC state: {e}")
+            frame = self._tc_frame
+        if frame != self._tc_frame:
+            self._tc_frame = frame
+            self._broadcast(frame)
+        self._broadcast(encode_sample(sample))
+
+    def start(self):
+        """Listen on the Unix socket and accept web workers"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        self._socket.listen()
+        threading.Thread(target=self._accept, name='collector-accept', daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError as e:
+                print(f"Error accepting web worker: {e}")
+                return
+            client.settimeout(SEND_TIMEOUT)
+            connection = _WorkerConnection(client)
+            with self._lock:
+                # Queued under the lock so no broadcast can slip in before it
+                connection.send(encode_topology(self.topology) + self._tc_frame +
+                                encode_sample(self.sampler.latest()))
+                self._clients.append(connection)
+            connection.start()
+
+    def _broadcast(self, frame):
+        with self._lock:
+            self._clients = [client for client in self._clients if client.send(frame)]
+
+    def stats(self):
+        with self._lock:
+            return {'workers': len(self._clients)}
+
+
+class RemoteSampler(StatsSampler):
+    """StatsSampler fed with the collector's samples instead of reading the kernel"""
+
+    def __init__(self):
+        super().__init__(path=None)
+        self._running = True
+
+    def start(self):
+        pass
+
+    def sample_once(self):
+        """Latest received sample (an empty one before the first arrives)"""
+        with self._condition:
+            if self._latest is None:
+                return StatsSample(0, CounterSnapshot(time.monotonic(), [], array('Q')), array('d'), array('b'))
+            return self._latest
+
+    def feed(self, payload):
+        with self._condition:
+            self._sequence += 1
+            self._publish(decode_sample(payload, self._sequence))
+            sample = self._latest
+        for callback in self._listeners:
+            try:
+                callback(sample)
+            except Exception as e:
+                print(f"Error in stats listener: {e}")
+
+
+class RemoteTopology(TopologyCache):
+    """TopologyCache loaded from the collector's topology frames"""
+
+    def __init__(self):
+        super().__init__(backend=None)
+        self._loaded = True
+
+    def start(self):
+        pass
+
+    def refresh(self):
+        # The collector pushes every change; nothing to reload locally
+        pass
+
+    def feed(self, payload):
+        data = json.loads(payload)
+        with self._lock:
+            self._links = {link['name']: link for link in data['links']}
+            self._addresses = data['addresses']
+            self._names = {link['index']: link['name'] for link in data['links']}
+        self._notify()
+
+
+class CollectorClient:
+    """Web worker side: keeps a connection to the collector and feeds the mirrors
+
+    TC state frames are passed to `on_tc_state({bridge: {interface: tree}})`.
+    """
+
+    def __init__(self, path, on_tc_state=None):
+        self.path = path
+        self.sampler = RemoteSampler()
+        self.topology = RemoteTopology()
+        self.on_tc_state = on_tc_state
+        self.connected = False
+
+    def start(self):
+        threading.Thread(target=self._run, name='collector-client', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+                    self.connected = True
+                    self._receive(sock.makefile('rb'))
+            except OSError as e:
+                if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                    print(f"Error reading from collector: {e}")
+            self.connected = False
+            time.sleep(RECONNECT_DELAY)
+
+    def _receive(self, stream):
+        while True:
+            header = stream.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                raise ConnectionResetError(errno.ECONNRESET, "collector closed the connection")
+            frame_type, length = _FRAME.unpack(header)
+            payload = stream.read(length)
+            if frame_type == SAMPLE_FRAME:
+                self.sampler.feed(payload)
+            elif frame_type == TOPOLOGY_FRAME:
+                self.topology.feed(payload)
+            elif frame_type == TC_STATE_FRAME and self.on_tc_state is not None:
+                self.on_tc_state(json.loads(payload))
+
+
+def forward_request(address, method, path, body, content_type, timeout):
+    """Replay an HTTP request against the collector's API, returns (status, content type, body)"""
+    host, _, port = address.rpartition(':')
+    connection = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    try:
+        headers = {'Content-Type': content_type} if content_type else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.getheader('Content-Type'), response.read()
+    finally:
+        connection.close()
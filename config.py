@@ -1,12 +1,19 @@
 # TC Bridge Controller Configuration
 
+import os
+
 # Bridge Configuration
 BRIDGE_NAME = "br0"
 BRIDGE_IP = "192.168.1.10/24"
 
+# Additional bridges managed from startup (name -> IP, or None for no IP);
+# more can be created at runtime through /api/bridges
+BRIDGES = {}
+BRIDGE_WORKERS = 8  # worker threads for kernel operations; each bridge's operations are serialized
+
 # Web Server Configuration
 HOST = "0.0.0.0"
-PORT = 5000
+PORT = int(os.environ.get('TC_BRIDGE_PORT', 5000))
 DEBUG = True
 
 # Traffic Control Defaults
@@ -15,10 +22,113 @@ DEFAULT_DELAY = 50       # ms
 DEFAULT_JITTER = 10      # ms
 DEFAULT_PACKET_LOSS = 1  # %
 
+# Kernel Backend
+# 'subprocess' runs ip/tc, 'netlink' talks rtnetlink directly over a
+# long-lived socket, 'fake' keeps everything in memory (no root needed)
+BACKEND = "subprocess"
+FAKE_INTERFACES = ['eth0', 'eth1']
+
+# Command Batching
+# Keep running a tc/ip batch after a failing line (tc -force -batch) so every
+# failing interface is reported, instead of stopping at the first error
+BATCH_FORCE = True
+
+# Blocking I/O
+# ip/tc/netlink work runs on BRIDGE_WORKERS native threads; requests wait for
+# it without blocking the eventlet hub that serves HTTP and Socket.IO
+IO_TIMEOUT = 30       # seconds a request waits for its operation before giving up
+COMMAND_TIMEOUT = 10  # seconds before a hung ip/tc process or netlink request is abandoned
+
+# TC Update Coalescing
+# /api/tc/apply and /api/tc/clear updates wait this long in a per-interface
+# queue; a newer update to the same interface replaces a waiting one, so a
+# burst of updates costs one reconfiguration
+TC_COALESCE_WINDOW = 0.1  # seconds
+TC_JOB_HISTORY = 1000     # finished jobs kept for /api/tc/jobs
+
+# Per-flow Classification
+TC_CLASSIFIER = "u32"     # 'u32' or 'flower' (needs the cls_flower module)
+TC_MAX_RATE = 10000       # Mbps, HTB rate of classes without a bandwidth limit
+U32_HASH_THRESHOLD = 8    # destination matches needed before u32 uses a hash table
+
+# Trace Playback
+PLAYBACK_MIN_INTERVAL = 0.01  # seconds, shortest allowed gap between trace steps
+PLAYBACK_SPIN = 0.001         # seconds busy-waited before each step for timing accuracy
+
 # Network Interface Filters
 # Interfaces to exclude from the interface list
 EXCLUDED_INTERFACES = ['lo', 'docker0', 'veth']
 
+# Statistics Collection
+# A single sampler thread reads all counters at this interval; every API
+# and Socket.IO consumer is served from its latest sample
+STATS_SAMPLE_INTERVAL = 1.0  # seconds
+
+# Throughput History
+# Fixed-size ring buffers per interface: raw samples and 1 minute rollups
+HISTORY_FINE_STEP = 1             # seconds
+HISTORY_FINE_RETENTION = 3600     # seconds (1 hour)
+HISTORY_COARSE_STEP = 60          # seconds
+HISTORY_COARSE_RETENTION = 86400  # seconds (1 day)
+HISTORY_MAX_INTERFACES = 256      # least recently seen interfaces are evicted
+HISTORY_MAX_POINTS = 1000         # per series returned by the history API
+
+# Socket.IO Stats Push
+# Subscribers get delta frames, with a full keyframe every N frames
+PUSH_KEYFRAME_INTERVAL = 30
+PUSH_RATE_PRECISION = 1  # decimals kept for rates (small changes don't trigger deltas)
+
+# TC Statistics
+# Qdisc/class trees of all links, with rates, are dumped at this interval
+# for /api/tc/stats and /metrics (which is rendered once per sampler tick)
+TC_STATS_INTERVAL = 2  # seconds
+
+# Profiling
+# /api/debug/profiler samples every thread's stack at this interval and
+# writes collapsed stacks (flamegraph.pl/speedscope input) to PROFILER_DIR
+PROFILER_INTERVAL = 0.005  # seconds
+PROFILER_DIR = "/tmp"
+
+# Scale-out Mode
+# 'standalone' runs everything in one process. 'collector' owns the kernel
+# (sampling, topology, bridge and tc operations) and serves the control API
+# on COLLECTOR_API; 'web' workers (any number, each on its own PORT) serve
+# the UI, stats and Socket.IO from the collector's stream and forward
+# control requests to it
+ROLE = os.environ.get('TC_BRIDGE_ROLE', 'standalone')
+COLLECTOR_SOCKET = "/run/tc-bridge-collector.sock"  # sample/topology stream to web workers
+COLLECTOR_API = "127.0.0.1:5001"                     # collector's HTTP API (host:port)
+# Socket.IO message queue shared by all processes (e.g. "redis://localhost:6379",
+# needs the redis package); broadcasts are then built once, by the collector
+SOCKETIO_MESSAGE_QUEUE = None
+
+# State Persistence
+# Bridges and TC configuration applied through the API are stored here and
+# restored on startup (only what differs from the kernel is re-applied).
+# None disables persistence.
+STATE_DB = "/var/lib/tc-bridge/state.db"
+
+# Latency Probe
+# /api/probe sends timestamped UDP probes to a reflector across the bridge
+# (python3 prober.py reflect on the far side) and reports round-trip
+# percentiles, jitter and loss next to the configured TC values
+PROBE_PORT = 9000      # UDP port of the reflector
+PROBE_RATE = 1000      # probes per second
+PROBE_SIZE = 64        # UDP payload bytes per probe
+PROBE_TIMEOUT = 1.0    # seconds before an unanswered probe counts as lost
+PROBE_MAX_RATE = 20000  # highest accepted probe rate
+
+# Sandbox Mode
+# `python3 sandbox.py up` builds SANDBOX_PORTS veth pairs with one end in
+# namespace SANDBOX_NETNS (the ports to bridge) and the other in a namespace
+# per port with an address from SANDBOX_SUBNET. Set NETNS to run the
+# controller (ip/tc, netlink, sysfs, /proc) inside that namespace instead
+# of against the host's links; the web server still listens on the host.
+NETNS = None                     # e.g. "tcb-sandbox"; None uses the host's links
+SANDBOX_NETNS = "tcb-sandbox"
+SANDBOX_PORTS = 128
+SANDBOX_SUBNET = "10.200.0.0/16"
+
 # Logging Configuration
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -0,0 +1,87 @@
+"""
+Prometheus exporter - interface counters, qdisc statistics and controller
+self-metrics, rendered once per sampler tick so a scrape only copies bytes
+"""
+
+from metrics import CONTROLLER_METRICS, format_labels, format_value
+from stats import COUNTER_FIELDS, NUM_COUNTERS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+QDISC_COUNTERS = (
+    ('bytes', 'tcbridge_qdisc_bytes_total', 'Bytes sent by the qdisc'),
+    ('packets', 'tcbridge_qdisc_packets_total', 'Packets sent by the qdisc'),
+    ('drops', 'tcbridge_qdisc_drops_total', 'Packets dropped by the qdisc'),
+    ('overlimits', 'tcbridge_qdisc_overlimits_total', 'Times the qdisc was over its limit'),
+    ('requeues', 'tcbridge_qdisc_requeues_total', 'Packets requeued by the qdisc'),
+)
+QDISC_GAUGES = (
+    ('backlog', 'tcbridge_qdisc_backlog_bytes', 'Bytes queued in the qdisc'),
+    ('qlen', 'tcbridge_qdisc_queue_length', 'Packets queued in the qdisc'),
+)
+QDISC_LABELS = ('interface', 'kind', 'handle', 'parent')
+
+
+def _family(lines, name, kind, help_text, samples):
+    """Append one metric family: samples are (label names, label values, value)"""
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for label_names, label_values, value in samples:
+        lines.append(f'{name}{format_labels(label_names, label_values)} {format_value(value)}')
+
+
+class MetricsExporter:
+    """Keeps the rendered /metrics page, rebuilt from each stats sample
+
+    Qdisc statistics are the last dump of the TCStatsCache, which
+    refreshes on its own interval.
+    """
+
+    def __init__(self, tc_stats, pool=None, link_state=None):
+        self.tc_stats = tc_stats
+        self.pool = pool
+        self.link_state = link_state
+        self._page = None
+
+    def update(self, sample):
+        """Sampler listener: re-render the page"""
+        self._page = self.render(sample).encode()
+
+    def page(self, sampler):
+        """The rendered page, built on the spot if the sampler hasn't ticked yet"""
+        if self._page is None:
+            self.update(sampler.latest())
+        return self._page
+
+    def render(self, sample):
+        lines = []
+        names = sample.snapshot.names
+        counters = sample.snapshot.counters
+        for i, field in enumerate(COUNTER_FIELDS):
+            _family(lines, f'tcbridge_interface_{field}_total', 'counter',
+                    f"Interface {field.replace('_', ' ')} counter from /proc/net/dev",
+                    ((('interface',), (name,), counters[row * NUM_COUNTERS + i]) for row, name in enumerate(names)))
+        if self.link_state:
+            _family(lines, 'tcbridge_interface_up', 'gauge', 'Whether the interface is operationally up',
+                    ((('interface',), (name,), 1 if self.link_state(name) == 'up' else 0) for name in names))
+
+        qdiscs = [(dev, qdisc) for dev, entries in sorted(self.tc_stats.qdiscs().items()) for qdisc in entries]
+        for families, kind in ((QDISC_COUNTERS, 'counter'), (QDISC_GAUGES, 'gauge')):
+            for key, name, help_text in families:
+                _family(lines, name, kind, help_text,
+                        ((QDISC_LABELS, (dev, qdisc['kind'], qdisc['handle'], qdisc['parent']),
+                          qdisc['stats'].get(key, 0)) for dev, qdisc in qdiscs))
+
+        for metric in CONTROLLER_METRICS:
+            lines.extend(metric.render())
+
+        if self.pool is not None:
+            stats = self.pool.stats()
+            for key, name, kind, help_text in (
+                    ('active', 'tcbridge_io_pool_active', 'gauge', 'Kernel I/O operations running'),
+                    ('queued', 'tcbridge_io_pool_queued', 'gauge', 'Kernel I/O operations waiting for a worker'),
+                    ('completed', 'tcbridge_io_pool_operations_total', 'counter', 'Kernel I/O operations completed'),
+                    ('timed_out', 'tcbridge_io_pool_timeouts_total', 'counter',
+                     'Requests that gave up waiting for an operation')):
+                _family(lines, name, kind, help_text, [((), (), stats[key])])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,168 @@
+"""
+Fixed-memory throughput history - preallocated ring buffers per interface
+at two resolutions (raw samples and rollups), queried with downsampling
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from config import (HISTORY_COARSE_RETENTION, HISTORY_COARSE_STEP, HISTORY_FINE_RETENTION,
+                    HISTORY_FINE_STEP, HISTORY_MAX_INTERFACES, HISTORY_MAX_POINTS)
+
+HISTORY_METRICS = ('rx_bytes_per_sec', 'tx_bytes_per_sec', 'rx_packets_per_sec', 'tx_packets_per_sec')
+NUM_METRICS = len(HISTORY_METRICS)
+
+
+class RingTier:
+    """One resolution of history: `capacity` slots of `step` seconds each
+
+    Values live in one preallocated array('d') (NUM_METRICS per slot) and
+    `slots` records which absolute slot number (time // step) each position
+    holds, so stale positions are recognised without clearing them.
+    """
+
+    __slots__ = ('step', 'capacity', 'values', 'slots')
+
+    def __init__(self, step, retention):
+        self.step = step
+        self.capacity = max(1, int(retention // step))
+        self.values = array('d', bytes(8 * NUM_METRICS * self.capacity))
+        self.slots = array('q', [-1]) * self.capacity
+
+    def put(self, slot, values):
+        position = slot % self.capacity
+        self.slots[position] = slot
+        base = position * NUM_METRICS
+        for i in range(NUM_METRICS):
+            self.values[base + i] = values[i]
+
+    def get(self, slot, metric):
+        """Value stored for an absolute slot, None if missing or overwritten"""
+        position = slot % self.capacity
+        if self.slots[position] != slot:
+            return None
+        return self.values[position * NUM_METRICS + metric]
+
+    def oldest_time(self, now):
+        return (int(now // self.step) - self.capacity + 1) * self.step
+
+
+class InterfaceHistory:
+    """Fine and coarse rings of one interface plus the pending rollup"""
+
+    __slots__ = ('fine', 'coarse', 'rollup_slot', 'rollup_sums', 'rollup_count')
+
+    def __init__(self):
+        self.fine = RingTier(HISTORY_FINE_STEP, HISTORY_FINE_RETENTION)
+        self.coarse = RingTier(HISTORY_COARSE_STEP, HISTORY_COARSE_RETENTION)
+        self.rollup_slot = -1
+        self.rollup_sums = array('d', bytes(8 * NUM_METRICS))
+        self.rollup_count = 0
+
+    def record(self, timestamp, values):
+        self.fine.put(int(timestamp // self.fine.step), values)
+
+        slot = int(timestamp // self.coarse.step)
+        if slot != self.rollup_slot:
+            self.flush()
+            self.rollup_slot = slot
+        for i in range(NUM_METRICS):
+            self.rollup_sums[i] += values[i]
+        self.rollup_count += 1
+
+    def flush(self):
+        """Write the pending rollup (mean of its samples) to the coarse ring"""
+        if self.rollup_count:
+            self.coarse.put(self.rollup_slot, [total / self.rollup_count for total in self.rollup_sums])
+        for i in range(NUM_METRICS):
+            self.rollup_sums[i] = 0.0
+        self.rollup_count = 0
+
+
+class HistoryStore:
+    """Bounded per-interface history fed from the stats sampler"""
+
+    def __init__(self, max_interfaces=HISTORY_MAX_INTERFACES):
+        self.max_interfaces = max_interfaces
+        self._interfaces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, sample, timestamp=None):
+        """Append the rates of every interface in a StatsSample"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for name in sample.snapshot.names:
+                rates = sample.get_rates(name)
+                if not rates:
+                    continue
+                history = self._interfaces.get(name)
+                if history is None:
+                    history = self._interfaces[name] = InterfaceHistory()
+                    # Evict the interface that has been silent the longest
+                    if len(self._interfaces) > self.max_interfaces:
+                        self._interfaces.popitem(last=False)
+                else:
+                    self._interfaces.move_to_end(name)
+                history.record(timestamp, [rates[metric] for metric in HISTORY_METRICS])
+
+    def interfaces(self):
+        with self._lock:
+            return list(self._interfaces)
+
+    def query(self, interface, start=None, end=None, step=None, metrics=HISTORY_METRICS):
+        """Downsampled series for [start, end] (unix seconds), None if unknown
+
+        Reads only the slots inside the requested range. Each returned point
+        is the mean of the stored values in its `step` wide bucket.
+        """
+        now = time.time()
+        end = now if end is None else min(float(end), now)
+        start = end - 300 if start is None else float(start)
+        if start > end:
+            raise ValueError("'from' must not be later than 'to'")
+        unknown = [metric for metric in metrics if metric not in HISTORY_METRICS]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+
+        with self._lock:
+            history = self._interfaces.get(interface)
+            if history is None:
+                return None
+
+            # Fine resolution while it covers the range and step, rollups otherwise
+            tier = history.fine
+            if (step and float(step) >= history.coarse.step) or start < history.fine.oldest_time(now):
+                tier = history.coarse
+            start = max(start, tier.oldest_time(now))
+
+            step = max(float(step or tier.step), tier.step)
+            if (end - start) / step > HISTORY_MAX_POINTS:
+                step = (end - start) / HISTORY_MAX_POINTS
+            per_bucket = max(1, int(math.ceil(step / tier.step)))
+            step = per_bucket * tier.step
+
+            indices = [HISTORY_METRICS.index(metric) for metric in metrics]
+            first_slot = int(start // tier.step)
+            last_slot = int(end // tier.step)
+            timestamps = []
+            series = {metric: [] for metric in metrics}
+            for bucket_start in range(first_slot, last_slot + 1, per_bucket):
+                bucket_end = min(bucket_start + per_bucket, last_slot + 1)
+                timestamps.append(bucket_start * tier.step)
+                for metric, index in zip(metrics, indices):
+                    values = [value for value in (tier.get(slot, index) for slot in range(bucket_start, bucket_end))
+                              if value is not None]
+                    series[metric].append(round(sum(values) / len(values), 3) if values else None)
+
+        return {
+            'interface': interface,
+            'from': start,
+            'to': end,
+            'step': step,
+            'resolution': tier.step,
+            'timestamps': timestamps,
+            'series': series
+        }
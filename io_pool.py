@@ -0,0 +1,134 @@
+"""
+Bounded pool of native threads for blocking kernel work (ip/tc processes,
+netlink requests, sysfs reads), waited on without blocking the eventlet hub
+that serves HTTP and Socket.IO
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import IO_TIMEOUT
+
+try:
+    import greenlet
+    from eventlet import hubs
+except ImportError:
+    greenlet = None
+
+
+def _in_greenthread():
+    """True when called from a green thread (a handler served by the eventlet hub)"""
+    return greenlet is not None and greenlet.getcurrent().parent is not None
+
+
+class IOPool:
+    """Fixed number of worker threads with timeouts and concurrency metrics
+
+    Operations always run on native threads. A green thread waiting for one
+    sleeps on a pipe the worker writes to when done, so the hub keeps
+    serving other clients meanwhile; native threads simply block.
+    """
+
+    def __init__(self, workers, timeout=IO_TIMEOUT, name='io-worker'):
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.active = 0
+        self.peak_active = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.run_time = 0.0
+        self.max_run_time = 0.0
+
+    def submit(self, fn, *args):
+        """Queue `fn(*args)` on a worker, returns a Future"""
+        queued = time.monotonic()
+
+        def run():
+            started = time.monotonic()
+            with self._lock:
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                self.queue_time += started - queued
+                self.max_queue_time = max(self.max_queue_time, started - queued)
+            ok = False
+            try:
+                result = fn(*args)
+                ok = True
+                return result
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.failed += not ok
+                    self.run_time += elapsed
+                    self.max_run_time = max(self.max_run_time, elapsed)
+
+        with self._lock:
+            self.submitted += 1
+        return self.executor.submit(run)
+
+    def wait(self, future, timeout=None):
+        """Result of a future, raises TimeoutError after `timeout` (IO_TIMEOUT) seconds
+
+        The operation itself keeps running; only the wait is abandoned.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            if _in_greenthread() and not future.done():
+                self._green_wait(future, timeout)
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise
+
+    def run(self, fn, *args, timeout=None):
+        """Run `fn(*args)` on a worker and wait for its result"""
+        return self.wait(self.submit(fn, *args), timeout)
+
+    def _green_wait(self, future, timeout):
+        read_fd, write_fd = os.pipe()
+
+        def wake(_):
+            # The worker owns the write end; the waiter may be gone already
+            try:
+                os.write(write_fd, b'\0')
+            except OSError:
+                pass
+            os.close(write_fd)
+
+        future.add_done_callback(wake)
+        try:
+            hubs.trampoline(read_fd, read=True, timeout=timeout, timeout_exc=TimeoutError)
+        finally:
+            hubs.notify_close(read_fd)
+            os.close(read_fd)
+
+    def stats(self):
+        """Concurrency and latency counters of the pool"""
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'peak_active': self.peak_active,
+                'queued': self.submitted - started,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+                'timeout': self.timeout,
+                'queue_ms': {'mean': round(self.queue_time / started * 1000, 3) if started else None,
+                             'max': round(self.max_queue_time * 1000, 3)},
+                'run_ms': {'mean': round(self.run_time / self.completed * 1000, 3) if self.completed else None,
+                           'max': round(self.max_run_time * 1000, 3)}
+            }
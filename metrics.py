@@ -0,0 +1,164 @@
+"""
+Controller self-metrics - counters and fixed-bucket histograms updated on
+the hot paths and rendered in the Prometheus text exposition format
+"""
+
+import bisect
+import threading
+from array import array
+
+# Seconds, from a cached stats read up to a hung command's timeout
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    """`{a="1",b="2"}` for a label set, empty without labels"""
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{format_labels(self.labels, key)} {format_value(value)}'
+                     for key, value in values)
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set
+
+    Observing is a bisect and two additions under a lock into storage
+    allocated on the first observation of a label set; counts are kept per
+    bucket and only accumulated when read.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (+Inf last), then sum
+                series = self._series[label_values] = [array('Q', bytes(8 * (len(self.buckets) + 1))), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self, *label_values):
+        """(cumulative bucket counts, sum, count) of one label set, None if never observed"""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                return None
+            counts, total = list(series[0]), series[1]
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, running
+
+    def summary(self, *label_values):
+        """Count, mean and bucket-estimated percentiles in milliseconds, None if never observed"""
+        snapshot = self.snapshot(*label_values)
+        if snapshot is None:
+            return None
+        cumulative, total, count = snapshot
+
+        def percentile(fraction):
+            # Upper bound of the bucket holding the percentile (the last bound if above it)
+            index = bisect.bisect_left(cumulative, fraction * count)
+            return round(self.buckets[min(index, len(self.buckets) - 1)] * 1000, 3)
+        return {'count': count, 'mean_ms': round(total / count * 1000, 3) if count else None,
+                'p50_ms': percentile(0.5), 'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99)}
+
+    def label_sets(self):
+        with self._lock:
+            return list(self._series)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key in self.label_sets():
+            cumulative, total, count = self.snapshot(*key)
+            for bound, value in zip(self.buckets + ('+Inf',), cumulative):
+                labels = format_labels(self.labels + ('le',), key + (format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {value}')
+            labels = format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+# Process-wide controller metrics
+COMMAND_SECONDS = Histogram('tcbridge_command_duration_seconds',
+                            'Time to execute one batch of link/address/tc operations', ('backend',))
+COMMAND_FAILURES = Counter('tcbridge_command_failures_total',
+                           'Link/address/tc operations that failed', ('backend',))
+SAMPLE_SECONDS = Histogram('tcbridge_sample_duration_seconds',
+                           'Time of one stats sampling tick, including its listeners')
+INTERFACE_STATS_SECONDS = Histogram('tcbridge_interface_stats_duration_seconds',
+                                    'Time to serve the detailed stats of one interface')
+MONITOR_SECONDS = Histogram('tcbridge_monitor_iteration_duration_seconds',
+                            'Time of one background monitor push, after its sample arrived')
+EMIT_SECONDS = Histogram('tcbridge_emit_duration_seconds',
+                         'Time to serialize and queue one Socket.IO emit', ('event',))
+
+CONTROLLER_METRICS = (COMMAND_SECONDS, COMMAND_FAILURES, SAMPLE_SECONDS, INTERFACE_STATS_SECONDS,
+                      MONITOR_SECONDS, EMIT_SECONDS)
+
+
+def perf_report():
+    """Summaries of every controller histogram, per label set"""
+    report = {}
+    for metric in CONTROLLER_METRICS:
+        if not isinstance(metric, Histogram):
+            continue
+        series = {}
+        for key in metric.label_sets():
+            series[','.join(map(str, key)) or 'all'] = metric.summary(*key)
+        report[metric.name] = series
+    return report
@@ -0,0 +1,502 @@
+"""
+Minimal rtnetlink client - link, address, qdisc and class messages over a
+single AF_NETLINK socket, plus encoders/decoders for the tc options we use
+"""
+
+import errno
+import ipaddress
+import os
+import socket
+import struct
+import threading
+
+NETLINK_ROUTE = 0
+SOL_NETLINK = 270
+NETLINK_CAP_ACK = 10
+NETLINK_EXT_ACK = 11
+
+# Message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWQDISC = 36
+RTM_DELQDISC = 37
+RTM_GETQDISC = 38
+RTM_NEWTCLASS = 40
+RTM_DELTCLASS = 41
+RTM_GETTCLASS = 42
+RTM_NEWTFILTER = 44
+RTM_DELTFILTER = 45
+RTM_GETTFILTER = 46
+
+# Multicast groups (bind() bitmask form of RTNLGRP_LINK and RTNLGRP_IPV4_IFADDR)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+# Message flags
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLM_F_CAPPED = 0x100
+NLM_F_ACK_TLVS = 0x200
+NLMSGERR_ATTR_MSG = 1
+
+NLA_TYPE_MASK = 0x3FFF
+NLA_F_NESTED = 0x8000
+
+# Link attributes
+IFF_UP = 0x1
+IFLA_IFNAME = 3
+IFLA_MASTER = 10
+IFLA_OPERSTATE = 16
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+OPERSTATES = ['unknown', 'notpresent', 'down', 'lowerlayerdown', 'testing', 'dormant', 'up']
+
+# Address attributes
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+# Traffic control attributes
+TC_H_ROOT = 0xFFFFFFFF
+TCA_KIND = 1
+TCA_OPTIONS = 2
+TCA_STATS = 3
+TCA_STATS2 = 7
+TCA_STATS_BASIC = 1
+TCA_STATS_QUEUE = 3
+
+TCA_HTB_PARMS = 1
+TCA_HTB_INIT = 2
+TCA_HTB_RATE64 = 6
+TCA_HTB_CEIL64 = 7
+TC_LINKLAYER_ETHERNET = 1
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+
+TCA_U32_CLASSID = 1
+TCA_U32_HASH = 2
+TCA_U32_LINK = 3
+TCA_U32_DIVISOR = 4
+TCA_U32_SEL = 5
+TC_U32_TERMINAL = 1
+
+TCA_FLOWER_CLASSID = 1
+TCA_FLOWER_KEY_ETH_TYPE = 8
+TCA_FLOWER_KEY_IP_PROTO = 9
+TCA_FLOWER_KEY_IPV4_SRC = 10
+TCA_FLOWER_KEY_IPV4_SRC_MASK = 11
+TCA_FLOWER_KEY_IPV4_DST = 12
+TCA_FLOWER_KEY_IPV4_DST_MASK = 13
+TCA_FLOWER_KEY_TCP_SRC = 18
+TCA_FLOWER_KEY_TCP_DST = 19
+TCA_FLOWER_KEY_UDP_SRC = 20
+TCA_FLOWER_KEY_UDP_DST = 21
+TCA_FLOWER_KEY_TCP_SRC_MASK = 35
+TCA_FLOWER_KEY_TCP_DST_MASK = 36
+TCA_FLOWER_KEY_UDP_SRC_MASK = 37
+TCA_FLOWER_KEY_UDP_DST_MASK = 38
+TCA_FLOWER_KEY_IP_TOS = 73
+TCA_FLOWER_KEY_IP_TOS_MASK = 74
+
+TCA_MATCHALL_ACT = 2
+TCA_ACT_KIND = 1
+TCA_ACT_OPTIONS = 2
+TCA_MIRRED_PARMS = 2
+TC_ACT_STOLEN = 4
+TCA_EGRESS_REDIR = 1
+
+TCA_NETEM_LATENCY64 = 10
+TCA_NETEM_JITTER64 = 11
+
+PSCHED_SHIFT = 6
+HTB_MTU = 1600
+
+_NLMSGHDR = struct.Struct('=LHHLL')
+_NLATTR = struct.Struct('=HH')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+TCMSG = struct.Struct('=BxxxiIII')
+_NETEM_QOPT = struct.Struct('=IIIIII')
+_HTB_GLOB = struct.Struct('=IIIII')
+# struct tc_mirred: tc_gen (index, capab, action, refcnt, bindcnt), eaction, ifindex
+_MIRRED_PARMS = struct.Struct('=IIiiiiI')
+_HTB_OPT = struct.Struct('=BBHhHIBBHhHIIIIII')
+# tc_u32_sel without its big endian hmask, which is packed separately
+_U32_SEL = struct.Struct('=BBBxHHhh')
+
+
+class NetlinkError(Exception):
+    """Kernel rejected a netlink request"""
+
+    def __init__(self, code, message=None):
+        self.code = code
+        super().__init__(message or os.strerror(code))
+
+
+def nla(attr_type, payload):
+    """Encode a single netlink attribute"""
+    length = _NLATTR.size + len(payload)
+    return _NLATTR.pack(length, attr_type) + payload + b'\0' * (-length % 4)
+
+
+def nla_str(attr_type, value):
+    """Encode a NUL terminated string attribute"""
+    return nla(attr_type, value.encode() + b'\0')
+
+
+def nla_u32(attr_type, value):
+    """Encode an unsigned 32-bit attribute"""
+    return nla(attr_type, struct.pack('=I', value))
+
+
+def parse_attrs(data, offset=0):
+    """Decode a run of netlink attributes into {type: payload}"""
+    attrs = {}
+    while offset + _NLATTR.size <= len(data):
+        length, attr_type = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = data[offset + _NLATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def attr_str(attrs, attr_type):
+    """Read a string attribute, None if missing"""
+    value = attrs.get(attr_type)
+    return value.rstrip(b'\0').decode() if value is not None else None
+
+
+def attr_u32(attrs, attr_type):
+    """Read an unsigned 32-bit attribute, None if missing"""
+    value = attrs.get(attr_type)
+    return struct.unpack_from('=I', value)[0] if value is not None else None
+
+
+def decode_link(payload):
+    """Decode an RTM_NEWLINK/RTM_DELLINK message (master as an ifindex)"""
+    _, _, index, flags, _ = IFINFOMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, IFINFOMSG.size)
+    operstate = attrs.get(IFLA_OPERSTATE, b'\0')[0]
+    linkinfo = parse_attrs(attrs.get(IFLA_LINKINFO, b''))
+    return {
+        'name': attr_str(attrs, IFLA_IFNAME),
+        'index': index,
+        'operstate': OPERSTATES[operstate] if operstate < len(OPERSTATES) else 'unknown',
+        'master': attr_u32(attrs, IFLA_MASTER) or None,
+        'kind': attr_str(linkinfo, IFLA_INFO_KIND)
+    }
+
+
+def decode_address(payload):
+    """Decode an IPv4 RTM_NEWADDR/RTM_DELADDR message into (ifindex, cidr)"""
+    family, prefixlen, _, _, index = IFADDRMSG.unpack_from(payload)
+    if family != socket.AF_INET:
+        return index, None
+    attrs = parse_attrs(payload, IFADDRMSG.size)
+    packed = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    if not packed:
+        return index, None
+    return index, f"{socket.inet_ntop(socket.AF_INET, packed)}/{prefixlen}"
+
+
+def parse_handle(handle):
+    """Convert a tc handle string ('root', '1:', '1:10') to its numeric form"""
+    if handle in (None, '', 'none'):
+        return 0
+    if handle == 'root':
+        return TC_H_ROOT
+    major, _, minor = handle.partition(':')
+    return (int(major or '0', 16) << 16) | int(minor or '0', 16)
+
+
+def format_handle(value):
+    """Convert a numeric tc handle back to 'major:minor' notation"""
+    if value == TC_H_ROOT:
+        return 'root'
+    major, minor = value >> 16, value & 0xFFFF
+    return f'{major:x}:{minor:x}' if minor else f'{major:x}:'
+
+
+def parse_u32_handle(handle):
+    """Convert a u32 handle ('800:', '2:5:', '2:5:1') to its numeric form"""
+    parts = (handle.split(':') + ['', ''])[:3]
+    htid, bucket, node = (int(part or '0', 16) for part in parts)
+    return (htid << 20) | (bucket << 12) | node
+
+
+def _ticks(nanoseconds):
+    """Convert nanoseconds to psched ticks"""
+    return min(int(nanoseconds) >> PSCHED_SHIFT, 0xFFFFFFFF)
+
+
+def encode_netem(options):
+    """Encode netem options (delay/jitter in ms, loss in %)"""
+    latency = int(float(options.get('delay') or 0) * 1000000)
+    jitter = int(float(options.get('jitter') or 0) * 1000000)
+    loss = int(round(float(options.get('loss') or 0) / 100 * 0xFFFFFFFF))
+    qopt = _NETEM_QOPT.pack(_ticks(latency), int(options.get('limit') or 1000),
+                            min(loss, 0xFFFFFFFF), 0, 0, _ticks(jitter))
+    return (qopt
+            + nla(TCA_NETEM_LATENCY64, struct.pack('=q', latency))
+            + nla(TCA_NETEM_JITTER64, struct.pack('=q', jitter)))
+
+
+def decode_netem(payload):
+    """Decode netem options into delay/jitter (ms), loss (%) and limit"""
+    latency, limit, loss, _, _, jitter = _NETEM_QOPT.unpack_from(payload)
+    latency <<= PSCHED_SHIFT
+    jitter <<= PSCHED_SHIFT
+    attrs = parse_attrs(payload, (_NETEM_QOPT.size + 3) & ~3)
+    if TCA_NETEM_LATENCY64 in attrs:
+        latency = struct.unpack_from('=q', attrs[TCA_NETEM_LATENCY64])[0]
+    if TCA_NETEM_JITTER64 in attrs:
+        jitter = struct.unpack_from('=q', attrs[TCA_NETEM_JITTER64])[0]
+    return {
+        'delay': latency / 1000000,
+        'jitter': jitter / 1000000,
+        'loss': round(loss / 0xFFFFFFFF * 100, 4),
+        'limit': limit
+    }
+
+
+def encode_htb_qdisc(options):
+    """Encode HTB qdisc options (default class minor)"""
+    glob = _HTB_GLOB.pack(3, 10, int(options.get('default') or 0), 0, 0)
+    return nla(TCA_HTB_INIT, glob)
+
+
+def decode_htb_qdisc(payload):
+    """Decode HTB qdisc options"""
+    attrs = parse_attrs(payload)
+    if TCA_HTB_INIT not in attrs:
+        return {}
+    _, _, default, _, _ = _HTB_GLOB.unpack_from(attrs[TCA_HTB_INIT])
+    return {'default': default}
+
+
+def encode_htb_class(options):
+    """Encode HTB class options (rate/ceil in bit/s)"""
+    rate = int(options['rate']) // 8
+    ceil = int(options.get('ceil') or options['rate']) // 8
+    buffer = _ticks(1e9 * (HTB_MTU + rate // 1000) / rate)
+    cbuffer = _ticks(1e9 * (HTB_MTU + ceil // 1000) / ceil)
+    parms = _HTB_OPT.pack(0, TC_LINKLAYER_ETHERNET, 0, -1, 0, min(rate, 0xFFFFFFFF),
+                          0, TC_LINKLAYER_ETHERNET, 0, -1, 0, min(ceil, 0xFFFFFFFF),
+                          buffer, cbuffer, 0, 0, int(options.get('prio') or 0))
+    attrs = nla(TCA_HTB_PARMS, parms)
+    if rate > 0xFFFFFFFF:
+        attrs += nla(TCA_HTB_RATE64, struct.pack('=Q', rate))
+    if ceil > 0xFFFFFFFF:
+        attrs += nla(TCA_HTB_CEIL64, struct.pack('=Q', ceil))
+    return attrs
+
+
+def decode_htb_class(payload):
+    """Decode HTB class options into rate/ceil in bit/s"""
+    attrs = parse_attrs(payload)
+    if TCA_HTB_PARMS not in attrs:
+        return {}
+    fields = _HTB_OPT.unpack_from(attrs[TCA_HTB_PARMS])
+    rate, ceil, prio = fields[5], fields[11], fields[16]
+    if TCA_HTB_RATE64 in attrs:
+        rate = struct.unpack_from('=Q', attrs[TCA_HTB_RATE64])[0]
+    if TCA_HTB_CEIL64 in attrs:
+        ceil = struct.unpack_from('=Q', attrs[TCA_HTB_CEIL64])[0]
+    return {'rate': rate * 8, 'ceil': ceil * 8, 'prio': prio}
+
+
+# (offset, mask, shift) of the IPv4 header fields u32 filters match on; ports
+# assume no IP options, as `tc ... match ip dport` does
+_U32_FIELDS = {
+    'protocol': (8, 0x00FF0000, 16),
+    'dscp': (0, 0x00FC0000, 18),
+    'sport': (20, 0xFFFF0000, 16),
+    'dport': (20, 0x0000FFFF, 0),
+}
+
+
+def _u32_key(field, value):
+    """(offset, mask, value) of one u32 match"""
+    if field in ('dst', 'src'):
+        network = ipaddress.IPv4Network(value, strict=False)
+        mask = int(network.netmask)
+        return 16 if field == 'dst' else 12, mask, int(network.network_address) & mask
+    offset, mask, shift = _U32_FIELDS[field]
+    return offset, mask, (int(value) << shift) & mask
+
+
+def encode_u32(options):
+    """Encode u32 filter options (hash table, bucket/table, matches, hashkey, link, classid)"""
+    attrs = b''
+    if options.get('divisor'):
+        attrs += nla_u32(TCA_U32_DIVISOR, options['divisor'])
+    if options.get('ht'):
+        attrs += nla_u32(TCA_U32_HASH, parse_u32_handle(options['ht']))
+    if options.get('link'):
+        attrs += nla_u32(TCA_U32_LINK, parse_u32_handle(options['link']))
+    if options.get('classid'):
+        attrs += nla_u32(TCA_U32_CLASSID, parse_handle(options['classid']))
+
+    if options.get('match') or options.get('hashkey'):
+        # Zero masks match everything and need no key
+        keys = [key for key in (_u32_key(field, value) for field, value in options.get('match', [])) if key[1]]
+        hashkey = options.get('hashkey') or {}
+        flags = TC_U32_TERMINAL if options.get('classid') else 0
+        sel = _U32_SEL.pack(flags, 0, len(keys), 0, 0, 0, hashkey.get('at', 0))
+        sel += struct.pack('!I', hashkey.get('mask', 0))
+        for offset, mask, value in keys:
+            sel += struct.pack('!II', mask, value) + struct.pack('=ii', offset, 0)
+        attrs += nla(TCA_U32_SEL, sel)
+    return attrs
+
+
+def encode_flower(options):
+    """Encode flower filter options (IPv4 addresses, protocol, ports, dscp, classid)"""
+    attrs = nla(TCA_FLOWER_KEY_ETH_TYPE, struct.pack('!H', ETH_P_IP))
+    protocol = options.get('protocol')
+    if protocol is not None:
+        attrs += nla(TCA_FLOWER_KEY_IP_PROTO, struct.pack('B', protocol))
+    for key, value_attr, mask_attr in (('src', TCA_FLOWER_KEY_IPV4_SRC, TCA_FLOWER_KEY_IPV4_SRC_MASK),
+                                       ('dst', TCA_FLOWER_KEY_IPV4_DST, TCA_FLOWER_KEY_IPV4_DST_MASK)):
+        if key in options:
+            network = ipaddress.IPv4Network(options[key], strict=False)
+            attrs += nla(value_attr, network.network_address.packed) + nla(mask_attr, network.netmask.packed)
+    ports = {
+        6: (TCA_FLOWER_KEY_TCP_SRC, TCA_FLOWER_KEY_TCP_SRC_MASK, TCA_FLOWER_KEY_TCP_DST, TCA_FLOWER_KEY_TCP_DST_MASK),
+        17: (TCA_FLOWER_KEY_UDP_SRC, TCA_FLOWER_KEY_UDP_SRC_MASK, TCA_FLOWER_KEY_UDP_DST, TCA_FLOWER_KEY_UDP_DST_MASK),
+    }.get(protocol)
+    if ports:
+        for key, value_attr, mask_attr in (('sport', ports[0], ports[1]), ('dport', ports[2], ports[3])):
+            if key in options:
+                attrs += nla(value_attr, struct.pack('!H', options[key])) + nla(mask_attr, b'\xff\xff')
+    if 'dscp' in options:
+        attrs += nla(TCA_FLOWER_KEY_IP_TOS, struct.pack('B', options['dscp'] << 2))
+        attrs += nla(TCA_FLOWER_KEY_IP_TOS_MASK, b'\xfc')
+    if options.get('classid'):
+        attrs += nla_u32(TCA_FLOWER_CLASSID, parse_handle(options['classid']))
+    return attrs
+
+
+def encode_matchall_redirect(ifindex):
+    """Encode matchall options with a single mirred action redirecting to ifindex"""
+    mirred = nla(TCA_MIRRED_PARMS, _MIRRED_PARMS.pack(0, 0, TC_ACT_STOLEN, 0, 0, TCA_EGRESS_REDIR, ifindex))
+    action = nla_str(TCA_ACT_KIND, 'mirred') + nla(TCA_ACT_OPTIONS | NLA_F_NESTED, mirred)
+    # Actions are nested by their position, starting at 1
+    return nla(TCA_MATCHALL_ACT | NLA_F_NESTED, nla(1 | NLA_F_NESTED, action))
+
+
+def decode_tc_stats(attrs):
+    """Decode TCA_STATS2 (or legacy TCA_STATS) into a counter dict"""
+    stats = {'bytes': 0, 'packets': 0, 'drops': 0, 'overlimits': 0,
+             'requeues': 0, 'backlog': 0, 'qlen': 0}
+    if TCA_STATS2 in attrs:
+        nested = parse_attrs(attrs[TCA_STATS2])
+        if TCA_STATS_BASIC in nested:
+            stats['bytes'], stats['packets'] = struct.unpack_from('=QI', nested[TCA_STATS_BASIC])
+        if TCA_STATS_QUEUE in nested:
+            (stats['qlen'], stats['backlog'], stats['drops'],
+             stats['requeues'], stats['overlimits']) = struct.unpack_from('=IIIII', nested[TCA_STATS_QUEUE])
+    elif TCA_STATS in attrs:
+        (stats['bytes'], stats['packets'], stats['drops'], stats['overlimits'],
+         _, _, stats['qlen'], stats['backlog']) = struct.unpack_from('=QIIIIIII', attrs[TCA_STATS])
+    return stats
+
+
+class NetlinkSocket:
+    """NETLINK_ROUTE socket kept open for the process lifetime"""
+
+    def __init__(self, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        for option in (NETLINK_CAP_ACK, NETLINK_EXT_ACK):
+            try:
+                self.sock.setsockopt(SOL_NETLINK, option, 1)
+            except OSError:
+                pass
+        self.sock.bind((0, groups))
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the socket"""
+        self.sock.close()
+
+    def request(self, msg_type, body, flags=0):
+        """Send a request and wait for its acknowledgement, returns any replies"""
+        return self._transact(msg_type, NLM_F_REQUEST | NLM_F_ACK | flags, body)
+
+    def dump(self, msg_type, body):
+        """Run a dump request, returns [(msg_type, payload), ...]"""
+        return self._transact(msg_type, NLM_F_REQUEST | NLM_F_DUMP, body)
+
+    def receive(self):
+        """Block for the next multicast datagram, returns [(msg_type, payload), ...]
+
+        Raises OSError(ENOBUFS) when the kernel dropped events because the
+        receive buffer overflowed; the caller must resynchronise.
+        """
+        data = self.sock.recv(1 << 18)
+        return [(msg_type, payload) for msg_type, _, _, payload in iter_messages(data)
+                if msg_type not in (NLMSG_DONE, NLMSG_ERROR)]
+
+    def _transact(self, msg_type, flags, body):
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            seq = self._seq
+            self.sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(body), msg_type, flags, seq, 0) + body)
+
+            replies = []
+            while True:
+                data = self.sock.recv(1 << 18)
+                for reply_type, reply_flags, reply_seq, payload in iter_messages(data):
+                    if reply_seq != seq:
+                        continue
+                    if reply_type == NLMSG_DONE:
+                        return replies
+                    if reply_type == NLMSG_ERROR:
+                        code = struct.unpack_from('=i', payload)[0]
+                        if code == 0:
+                            return replies
+                        raise NetlinkError(-code, _ext_ack_message(payload, reply_flags))
+                    replies.append((reply_type, payload))
+                    if not reply_flags & NLM_F_MULTI and not flags & NLM_F_ACK:
+                        return replies
+
+
+def iter_messages(data):
+    """Split a receive buffer into (type, flags, seq, payload) tuples"""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield msg_type, flags, seq, data[offset + _NLMSGHDR.size:offset + length]
+        offset += (length + 3) & ~3
+
+
+def _ext_ack_message(payload, flags):
+    """Extract the extended ack error string, if the kernel sent one"""
+    if not flags & NLM_F_ACK_TLVS:
+        return None
+    # error code + echoed request (just its header when capped by NETLINK_CAP_ACK)
+    offset = 4 + _NLMSGHDR.size
+    if not flags & NLM_F_CAPPED:
+        offset = 4 + ((_NLMSGHDR.unpack_from(payload, 4)[0] + 3) & ~3)
+    attrs = parse_attrs(payload, offset)
+    message = attr_str(attrs, NLMSGERR_ATTR_MSG)
+    if message:
+        code = -struct.unpack_from('=i', payload)[0]
+        return f"{message} ({os.strerror(code)})" if code != errno.EINVAL else message
+    return None
@@ -0,0 +1,92 @@
+"""
+Network namespace switching - move the controller into a namespace created
+by `ip netns add` (the way `ip netns exec` does), or one thread into a
+namespace just long enough to open a socket there
+"""
+
+import ctypes
+import os
+from contextlib import contextmanager
+
+NETNS_RUN_DIR = '/var/run/netns'
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWNET = 0x40000000
+MS_REC = 0x4000
+MS_SLAVE = 1 << 19
+MNT_DETACH = 2
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+# The namespace the process started in, once enter() has left it
+_host_fd = None
+
+
+def _check(result, what):
+    if result != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, f"{what}: {os.strerror(error)}")
+
+
+def _setns(fd):
+    _check(_libc.setns(fd, CLONE_NEWNET), 'setns')
+
+
+def path(name):
+    return os.path.join(NETNS_RUN_DIR, name)
+
+
+def exists(name):
+    return os.path.exists(path(name))
+
+
+def enter(name):
+    """Run the whole process inside namespace `name`
+
+    Call it before any thread starts: threads and subprocesses inherit the
+    namespace of the thread creating them. The process also gets its own
+    mount namespace with sysfs mounted again, so /sys/class/net (and
+    /proc/net) describe the namespace's links. host() reaches back out.
+    """
+    global _host_fd
+    with open(path(name)) as target:
+        host_fd = os.open('/proc/self/ns/net', os.O_RDONLY)
+        _check(_libc.unshare(CLONE_NEWNS), 'unshare')
+        # Don't let our mounts propagate back to the host
+        _check(_libc.mount(b'none', b'/', None, MS_REC | MS_SLAVE, None), 'mount /')
+        _setns(target.fileno())
+    _check(_libc.umount2(b'/sys', MNT_DETACH), 'umount /sys')
+    _check(_libc.mount(name.encode(), b'/sys', b'sysfs', 0, None), 'mount /sys')
+    _host_fd = host_fd
+
+
+@contextmanager
+def _switched(fd):
+    with open('/proc/thread-self/ns/net') as own:
+        _setns(fd)
+        try:
+            yield
+        finally:
+            _setns(own.fileno())
+
+
+@contextmanager
+def entered(name):
+    """Move the calling thread into namespace `name` for the block
+
+    Meant for opening sockets (which stay in the namespace they were created
+    in) or starting subprocesses; never yield to other green threads inside.
+    """
+    with open(path(name)) as target:
+        with _switched(target.fileno()):
+            yield
+
+
+@contextmanager
+def host():
+    """Move the calling thread back into the namespace enter() left, for the block"""
+    if _host_fd is None:
+        yield
+        return
+    with _switched(_host_fd):
+        yield
@@ -0,0 +1,234 @@
+"""
+Trace playback - delay/bandwidth/loss changing on a timeline, with the tc
+operations of every step precomputed and applied by `change` on a
+monotonic-clock schedule
+"""
+
+import csv
+import io
+import json
+import threading
+import time
+from collections import deque
+
+from config import PLAYBACK_MIN_INTERVAL, PLAYBACK_SPIN
+from tc_model import build_fixed_tree, plan_changes
+
+TRACE_FIELDS = ('bandwidth', 'delay', 'jitter', 'packet_loss')
+
+
+def load_trace(data, fmt='json', interval=None):
+    """Parse a trace into steps [{'time', 'bandwidth', 'delay', 'jitter', 'packet_loss'}]
+
+    `data` is CSV text (header row with `time` and any of TRACE_FIELDS) or
+    JSON (a list of such objects, or {'interval', 'steps'}). Without a time
+    column, steps are `interval` seconds apart. Empty values repeat the
+    previous step. Raises ValueError on malformed traces.
+    """
+    if fmt == 'csv':
+        rows = list(csv.DictReader(io.StringIO(data)))
+    elif fmt == 'json':
+        rows = json.loads(data) if isinstance(data, str) else data
+        if isinstance(rows, dict):
+            interval = rows.get('interval', interval)
+            rows = rows.get('steps', [])
+    else:
+        raise ValueError(f"Unknown trace format '{fmt}', expected csv or json")
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("Trace has no steps")
+
+    steps = []
+    values = dict.fromkeys(TRACE_FIELDS, 0)
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise ValueError(f"Step {index}: expected an object")
+        for field in TRACE_FIELDS:
+            if row.get(field) not in (None, ''):
+                values[field] = float(row[field])
+
+        if row.get('time') not in (None, ''):
+            offset = float(row['time'])
+        elif interval:
+            offset = index * float(interval)
+        else:
+            raise ValueError(f"Step {index}: no time and no interval given")
+        if steps and offset - steps[-1]['time'] < PLAYBACK_MIN_INTERVAL:
+            raise ValueError(f"Step {index}: steps must be at least {PLAYBACK_MIN_INTERVAL}s apart and in order")
+        steps.append(dict(values, time=offset))
+    return steps
+
+
+def compile_trace(backend, interfaces, steps):
+    """Desired tree and operations of every step
+
+    All steps share one tree shape (HTB if any step limits bandwidth, netem
+    if any step impairs), so each step is just the `change` operations from
+    the previous one. Returns [(time, tree, ops), ...].
+    """
+    with_htb = any(step['bandwidth'] > 0 for step in steps)
+    with_netem = any(step['delay'] > 0 or step['jitter'] > 0 or step['packet_loss'] > 0 for step in steps)
+    if not with_htb and not with_netem:
+        raise ValueError("Trace never limits bandwidth or adds delay/jitter/loss")
+
+    compiled = []
+    previous = None
+    for step in steps:
+        tree = build_fixed_tree(step, with_htb, with_netem)
+        batch = backend.batch()
+        if previous is not None:
+            for interface in interfaces:
+                plan_changes(batch, interface, previous, tree)
+        compiled.append((step['time'], tree, batch.ops))
+        previous = tree
+    return compiled
+
+
+class _Timings:
+    """Running summary of a timing series (milliseconds), recent values for percentiles"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=1000)
+
+    def add(self, seconds):
+        value = seconds * 1000
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self):
+        if not self.count:
+            return {'mean': None, 'p50': None, 'p95': None, 'max': None}
+        ordered = sorted(self.recent)
+        return {
+            'mean': round(self.total / self.count, 3),
+            'p50': round(ordered[len(ordered) // 2], 3),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            'max': round(self.max, 3)
+        }
+
+
+class PlaybackRunner:
+    """Plays compiled steps back on one thread
+
+    Step times are absolute offsets from the start on the monotonic clock,
+    so lateness never accumulates. The last PLAYBACK_SPIN seconds before a
+    step are busy-waited for accuracy. If a step is missed entirely, the
+    runner jumps to the latest due step with a diff computed on the spot.
+    Each step runs under `lock` (the bridge's), like any other operation.
+    """
+
+    def __init__(self, backend, interfaces, compiled, lock, loop=False, on_step=None):
+        self.backend = backend
+        self.interfaces = list(interfaces)
+        self.compiled = compiled
+        self.lock = lock
+        self.loop = loop
+        self.on_step = on_step
+        self.step = 0
+        self.loops = 0
+        self.applied = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_error = None
+        self.lateness = _Timings()
+        self.apply_time = _Timings()
+        self._stop = threading.Event()
+        self._thread = None
+        # Step period for looping: the trace repeats one average interval after its last step
+        last = compiled[-1][0]
+        self.duration = last + (last / (len(compiled) - 1) if len(compiled) > 1 else PLAYBACK_MIN_INTERVAL)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='tc-playback', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the runner to stop (it exits before its next step)"""
+        self._stop.set()
+
+    def _sleep_until(self, target):
+        while True:
+            remaining = target - time.monotonic()
+            if remaining <= 0:
+                return
+            if remaining > PLAYBACK_SPIN:
+                self._stop.wait(remaining - PLAYBACK_SPIN)
+                if self._stop.is_set():
+                    return
+
+    def _run(self):
+        start = time.monotonic()
+        current = self.compiled[0][1]
+        while not self._stop.is_set():
+            index = 0
+            while index < len(self.compiled) and not self._stop.is_set():
+                offset, tree, ops = self.compiled[index]
+                # Missed steps: jump to the latest one that is already due
+                due = index
+                now = time.monotonic()
+                while due + 1 < len(self.compiled) and start + self.compiled[due + 1][0] <= now:
+                    due += 1
+                if due != index:
+                    self.skipped += due - index
+                    index = due
+                    offset, tree, _ = self.compiled[index]
+                    batch = self.backend.batch()
+                    for interface in self.interfaces:
+                        plan_changes(batch, interface, current, tree)
+                    ops = batch.ops
+
+                target = start + offset
+                self._sleep_until(target)
+                with self.lock:
+                    if self._stop.is_set():
+                        break
+                    self.lateness.add(time.monotonic() - target)
+                    if ops:
+                        began = time.monotonic()
+                        failures = self.backend.execute(ops)
+                        self.apply_time.add(time.monotonic() - began)
+                        if failures:
+                            self.failures += 1
+                            self.last_error = failures[0]['error']
+                    self.applied += 1
+                    self.step = index
+                    current = tree
+                    if self.on_step:
+                        self.on_step(tree)
+                index += 1
+
+            if not self.loop or self._stop.is_set():
+                break
+            self.loops += 1
+            start += self.duration
+            # Back to the first step: diff from where the last step left the tree
+            first = self.compiled[0]
+            batch = self.backend.batch()
+            for interface in self.interfaces:
+                plan_changes(batch, interface, current, first[1])
+            self.compiled[0] = (first[0], first[1], batch.ops)
+
+    def status(self):
+        """Progress and timing of the playback"""
+        return {
+            'running': self.running,
+            'interfaces': self.interfaces,
+            'step': self.step,
+            'steps': len(self.compiled),
+            'loop': self.loop,
+            'loops': self.loops,
+            'applied': self.applied,
+            'skipped': self.skipped,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'lateness_ms': self.lateness.summary(),
+            'apply_ms': self.apply_time.summary()
+        }
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Active latency probe - timestamped UDP probes sent across the bridge to a
+reflector, with round-trip percentiles, jitter and loss computed online in
+fixed memory, to check what the kernel actually delivers
+
+Usage: python3 prober.py reflect [--bind ADDR] [--port N]
+       python3 prober.py probe --target HOST[:PORT] [--rate N] [--size N] [--duration S]
+"""
+
+import argparse
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+from contextlib import nullcontext
+
+import netns
+from config import PROBE_MAX_RATE, PROBE_PORT, PROBE_RATE, PROBE_SIZE, PROBE_TIMEOUT
+
+# Probe payload: magic, run id, sequence, send time (monotonic ns), zero padded to the probe size
+_PROBE = struct.Struct('!IIQQ')
+_MAGIC = 0x7462706b
+MIN_SIZE = _PROBE.size
+MAX_SIZE = 65507
+
+# Latency histogram: 2**SUB_BITS exact buckets, then 2**(SUB_BITS - 1) per power of two
+SUB_BITS = 7
+_SUB_COUNT = 1 << SUB_BITS
+_HALF = _SUB_COUNT >> 1
+MAX_VALUE = (1 << 36) - 1  # microseconds, about 19 hours
+
+# Sends caught up at once after a stall (a longer stall skips probes instead)
+MAX_BURST = 64
+
+
+def _bucket(value):
+    if value < _SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return _SUB_COUNT + (shift - 1) * _HALF + (value >> shift) - _HALF
+
+
+def _bucket_limit(index):
+    """Highest value falling into a bucket"""
+    if index < _SUB_COUNT:
+        return index
+    shift = (index - _SUB_COUNT) // _HALF + 1
+    mantissa = (index - _SUB_COUNT) % _HALF + _HALF
+    return ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of microsecond values in one fixed array
+
+    Every recorded value is within 1/64 of the bound of its bucket, and the
+    memory used doesn't depend on how many values were recorded.
+    """
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * (_bucket(MAX_VALUE) + 1)))
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = min(max(int(value), 0), MAX_VALUE)
+        self.counts[_bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add another histogram's values to this one"""
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentiles(self, fractions):
+        """Values at sorted fractions (0..1), the highest value of each one's bucket"""
+        results = []
+        targets = [max(1, fraction * self.count) for fraction in fractions]
+        running = 0
+        index = 0
+        for bucket, count in enumerate(self.counts):
+            if not count:
+                continue
+            running += count
+            while index < len(targets) and running >= targets[index]:
+                results.append(min(_bucket_limit(bucket), self.max))
+                index += 1
+            if index == len(targets):
+                break
+        return results
+
+    def summary(self):
+        """min/mean/p50/p90/p99/p99.9/max/stddev in milliseconds, None without values"""
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        variance = max(self.squares / self.count - mean * mean, 0)
+        p50, p90, p99, p999 = self.percentiles((0.5, 0.9, 0.99, 0.999))
+        return {
+            'min': self.min / 1000,
+            'mean': round(mean / 1000, 3),
+            'p50': p50 / 1000,
+            'p90': p90 / 1000,
+            'p99': p99 / 1000,
+            'p999': p999 / 1000,
+            'max': self.max / 1000,
+            'stddev': round(variance ** 0.5 / 1000, 3)
+        }
+
+
+def _socket(family, namespace):
+    """UDP socket, opened inside network namespace `namespace` if given"""
+    with netns.entered(namespace) if namespace else nullcontext():
+        return socket.socket(family, socket.SOCK_DGRAM)
+
+
+def parse_target(target, port=PROBE_PORT):
+    """'host[:port]' as a getaddrinfo (family, address) pair"""
+    host, separator, port_text = str(target).rpartition(':')
+    if not separator:
+        host = port_text
+    elif port_text:
+        port = int(port_text)
+    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    return family, address
+
+
+class LatencyProbe:
+    """Sends probes to a reflector at a fixed rate and measures the replies
+
+    One thread paces sends on absolute deadlines and drains replies from a
+    non-blocking socket in between; the probe and receive buffers are
+    allocated once. Send times sit in a ring holding `timeout` seconds of
+    probes: a reply finds its send time by sequence number, and a probe whose
+    slot comes round again unanswered is lost. Counters are read without
+    locking, so a status taken mid-run can be off by a probe or two.
+    Probes are sent from network namespace `namespace` if given.
+    """
+
+    def __init__(self, target, rate=PROBE_RATE, size=PROBE_SIZE, duration=None, timeout=PROBE_TIMEOUT,
+                 namespace=None):
+        rate = float(rate)
+        size = int(size)
+        if not 0 < rate <= PROBE_MAX_RATE:
+            raise ValueError(f"Rate must be between 0 and {PROBE_MAX_RATE} probes per second")
+        if not MIN_SIZE <= size <= MAX_SIZE:
+            raise ValueError(f"Size must be between {MIN_SIZE} and {MAX_SIZE} bytes")
+        self.family, self.address = parse_target(target)
+        self.target = target
+        self.rate = rate
+        self.size = size
+        self.duration = float(duration) if duration else None
+        self.timeout = timeout
+        self.namespace = namespace
+
+        capacity = 16
+        while capacity < rate * timeout:
+            capacity <<= 1
+        self._mask = capacity - 1
+        self._seqs = array('q', [-1]) * capacity
+        self._sent_at = array('Q', bytes(8 * capacity))
+        self._buffer = bytearray(size)
+        self._reply = bytearray(max(size, 2048))
+        self.run_id = int.from_bytes(os.urandom(4), 'big')
+
+        self.histogram = LatencyHistogram()
+        self.jitter = 0.0
+        self._last_rtt = None
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started = None
+        self.finished = None
+        # Monotonic ns of the first send and the latest reply
+        self._first_send = None
+        self._last_reply = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start probing, returns (success, message)"""
+        if self.running:
+            return False, "Probe already running"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='latency-probe', daemon=True)
+        self._thread.start()
+        return True, f"Probing {self.target} at {self.rate:g}/s with {self.size} byte probes"
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            with _socket(self.family, self.namespace) as sock:
+                sock.setblocking(False)
+                sock.connect(self.address)
+                self._loop(sock)
+        except OSError as e:
+            print(f"Error probing {self.target}: {e}")
+            self.errors += 1
+        if self.finished is None:
+            self.finished = time.time()
+
+    def _loop(self, sock):
+        interval = int(1e9 / self.rate)
+        self.started = time.time()
+        self.finished = None
+        start = time.monotonic_ns()
+        self._first_send = start
+        end = start + int(self.duration * 1e9) if self.duration else None
+        next_send = start
+        seq = 0
+        while not self._stop.is_set():
+            now = time.monotonic_ns()
+            if end is not None and now >= end:
+                break
+            burst = 0
+            while next_send <= now and burst < MAX_BURST:
+                self._send(sock, seq, now)
+                seq += 1
+                burst += 1
+                next_send += interval
+            if next_send <= now:
+                missed = (now - next_send) // interval + 1
+                self.skipped += missed
+                next_send += missed * interval
+            self._drain(sock)
+            # Sleep until the next send or a reply
+            select.select((sock,), (), (), max(next_send - time.monotonic_ns(), 0) / 1e9)
+
+        # Sending is over (elapsed stops here); give the last probes their chance to come back
+        self.finished = time.time()
+        deadline = time.monotonic() + self.timeout
+        while not self._stop.is_set() and self.received + self.lost < self.sent:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            select.select((sock,), (), (), remaining)
+            self._drain(sock)
+
+    def _send(self, sock, seq, now):
+        slot = seq & self._mask
+        if self._seqs[slot] != -1:
+            self.lost += 1
+        self._seqs[slot] = seq
+        self._sent_at[slot] = now
+        _PROBE.pack_into(self._buffer, 0, _MAGIC, self.run_id, seq, now)
+        self.sent += 1
+        try:
+            sock.send(self._buffer)
+        except OSError:
+            # Full socket buffer or an ICMP error from an earlier probe: this one is lost
+            self.errors += 1
+
+    def _drain(self, sock):
+        while True:
+            try:
+                length = sock.recv_into(self._reply)
+            except BlockingIOError:
+                return
+            except OSError:
+                self.errors += 1
+                continue
+            now = time.monotonic_ns()
+            if length < MIN_SIZE:
+                self.late += 1
+                continue
+            magic, run_id, seq, sent = _PROBE.unpack_from(self._reply)
+            slot = seq & self._mask
+            if magic != _MAGIC or run_id != self.run_id or self._seqs[slot] != seq:
+                # Foreign, duplicated or older than the timeout
+                self.late += 1
+                continue
+            self._seqs[slot] = -1
+            self.received += 1
+            self._last_reply = now
+            rtt = (now - sent) // 1000
+            self.histogram.record(rtt)
+            # RFC 3550 interarrival jitter over consecutive round trips
+            if self._last_rtt is not None:
+                self.jitter += (abs(rtt - self._last_rtt) - self.jitter) / 16
+            self._last_rtt = rtt
+
+    def _expired(self):
+        """Unanswered probes older than the timeout"""
+        limit = time.monotonic_ns() - int(self.timeout * 1e9)
+        return sum(1 for slot, seq in enumerate(self._seqs) if seq != -1 and self._sent_at[slot] < limit)
+
+    def status(self):
+        """Counters, loss and round-trip statistics so far"""
+        lost = self.lost + self._expired()
+        answered = self.received + lost
+        end = self.finished or time.time()
+        # Replies queued by shaping keep arriving after the last send
+        replying = (self._last_reply - self._first_send) / 1e9 if self._last_reply else 0
+        return {
+            'running': self.running,
+            'target': self.target,
+            'rate': self.rate,
+            'size': self.size,
+            'duration': self.duration,
+            'elapsed': round(end - self.started, 3) if self.started else None,
+            'sent': self.sent,
+            'received': self.received,
+            'lost': lost,
+            'loss_percent': round(lost / answered * 100, 3) if answered else None,
+            'late': self.late,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'rtt_ms': self.histogram.summary(),
+            'jitter_ms': round(self.jitter / 1000, 3) if self.received > 1 else None,
+            'delivered_mbps': round(self.received * self.size * 8 / replying / 1e6, 3) if replying else None
+        }
+
+
+class Reflector:
+    """Echoes every probe back to its sender; run it on the far side of the bridge"""
+
+    def __init__(self, bind='0.0.0.0', port=PROBE_PORT, namespace=None):
+        self.family, self.address = parse_target(f"{bind}:{port}")
+        self.namespace = namespace
+        self.reflected = 0
+        self._stop = threading.Event()
+        self._socket = None
+
+    def start(self):
+        """Bind and reflect on a background thread"""
+        self._socket = _socket(self.family, self.namespace)
+        self._socket.bind(self.address)
+        threading.Thread(target=self.serve_forever, name='probe-reflector', daemon=True).start()
+
+    def serve_forever(self):
+        buffer = bytearray(MAX_SIZE)
+        view = memoryview(buffer)
+        if self._socket is None:
+            self._socket = _socket(self.family, self.namespace)
+            self._socket.bind(self.address)
+        with self._socket as sock:
+            # Wake up periodically so stop() is noticed
+            sock.settimeout(1.0)
+            while not self._stop.is_set():
+                try:
+                    length, sender = sock.recvfrom_into(buffer)
+                    sock.sendto(view[:length], sender)
+                    self.reflected += 1
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    print(f"Error reflecting probe: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    reflect = commands.add_parser('reflect', help='echo probes back to their sender')
+    reflect.add_argument('--bind', default='0.0.0.0')
+    reflect.add_argument('--port', type=int, default=PROBE_PORT)
+    probe = commands.add_parser('probe', help='send probes and report round-trip statistics')
+    probe.add_argument('--target', required=True, help='reflector as HOST[:PORT]')
+    probe.add_argument('--rate', type=float, default=PROBE_RATE, help='probes per second')
+    probe.add_argument('--size', type=int, default=PROBE_SIZE, help='UDP payload bytes')
+    probe.add_argument('--duration', type=float, default=10, help='seconds')
+    args = parser.parse_args()
+
+    if args.command == 'reflect':
+        print(f"Reflecting probes on {args.bind}:{args.port}")
+        try:
+            Reflector(args.bind, args.port).serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    runner = LatencyProbe(args.target, args.rate, args.size, args.duration)
+    print(runner.start()[1])
+    try:
+        while runner.running:
+            runner.wait(1)
+            status = runner.status()
+            rtt = status['rtt_ms'] or {}
+            print(f"sent {status['sent']} received {status['received']} loss {status['loss_percent']}% "
+                  f"p50 {rtt.get('p50')} p99 {rtt.get('p99')} jitter {status['jitter_ms']} ms")
+    except KeyboardInterrupt:
+        runner.stop()
+        runner.wait()
+    print(json.dumps(runner.status(), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Opt-in sampling profiler - a thread snapshots every thread's stack at a
+fixed interval and writes the counts as collapsed stacks (flamegraph.pl,
+speedscope, inferno)
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILER_DIR, PROFILER_INTERVAL
+
+
+def _collapse(thread_name, frame):
+    """'thread;outer (file:line);...;inner (file:line)' for one stack"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Collects stack samples until stopped; nothing runs while it is off"""
+
+    def __init__(self, interval=PROFILER_INTERVAL, directory=PROFILER_DIR):
+        self.interval = interval
+        self.directory = directory
+        self.samples = Counter()
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start sampling, returns (success, message)"""
+        if self.running:
+            return False, "Profiler already running"
+        self.samples = Counter()
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True, f"Profiling every {self.interval * 1000:g} ms"
+
+    def stop(self):
+        """Stop sampling and write the collapsed stacks, returns (success, message, path)"""
+        if not self.running:
+            return False, "Profiler not running", None
+        self._stop.set()
+        self._thread.join()
+        path = os.path.join(self.directory, f"tc-bridge-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        try:
+            self.write(path)
+        except OSError as e:
+            return False, f"Error writing profile: {e}", None
+        return True, f"Wrote {sum(self.samples.values())} samples", path
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.samples[_collapse(names.get(ident, str(ident)), frame)] += 1
+
+    def status(self):
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'started': self.started,
+            'samples': sum(self.samples.values())
+        }
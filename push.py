@@ -0,0 +1,174 @@
+"""
+Subscription based stats push - clients subscribe to interfaces/metrics,
+each distinct subscription gets a Socket.IO room, and the room receives
+delta frames (only changed values) with periodic keyframes
+"""
+
+import threading
+
+from config import PUSH_KEYFRAME_INTERVAL, PUSH_RATE_PRECISION
+from stats import COUNTER_FIELDS, DERIVED_FIELDS, RATE_FIELDS, derived_stats
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 'status' is the link state ('up'/'down'), the rest are numbers
+PUSH_METRICS = COUNTER_FIELDS + RATE_FIELDS + DERIVED_FIELDS + ('status',)
+FORMATS = ('json', 'packed', 'msgpack')
+FRAME_EVENT = 'stats_frame'
+
+
+class Subscription:
+    """One distinct (interfaces, metrics, format) combination and its delta state"""
+
+    def __init__(self, room, interfaces, metrics, fmt):
+        self.room = room
+        self.interfaces = interfaces
+        self.metrics = metrics
+        self.format = fmt
+        self.needs_derived = any(metric in DERIVED_FIELDS for metric in metrics)
+        self.members = set()
+        self.sequence = 0
+        self.ticks = 0
+        self.last = None
+
+    def read_values(self, sample, link_state=None):
+        """Current values as a flat list, row-major (interface, metric)"""
+        values = []
+        for interface in self.interfaces:
+            counters = sample.get(interface) or {}
+            rates = sample.get_rates(interface)
+            derived = derived_stats(counters, rates) if counters and self.needs_derived else {}
+            for metric in self.metrics:
+                if metric in rates:
+                    values.append(round(rates[metric], PUSH_RATE_PRECISION))
+                elif metric in derived:
+                    values.append(round(derived[metric], PUSH_RATE_PRECISION))
+                elif metric == 'status':
+                    values.append(link_state(interface) if counters and link_state else None)
+                else:
+                    values.append(counters.get(metric))
+        return values
+
+    def keyframe(self, values):
+        """Full frame with every subscribed value"""
+        if self.format == 'json':
+            width = len(self.metrics)
+            data = {interface: dict(zip(self.metrics, values[row * width:(row + 1) * width]))
+                    for row, interface in enumerate(self.interfaces)}
+            return {'seq': self.sequence, 'key': True, 'data': data}
+        return self._encode({'seq': self.sequence, 'key': 1, 'interfaces': list(self.interfaces),
+                             'metrics': list(self.metrics), 'values': values})
+
+    def delta(self, values):
+        """Frame with only the values that changed since the last frame, None if nothing did"""
+        changed = [index for index, value in enumerate(values) if value != self.last[index]]
+        if not changed:
+            return None
+        if self.format == 'json':
+            width = len(self.metrics)
+            data = {}
+            for index in changed:
+                interface = self.interfaces[index // width]
+                data.setdefault(interface, {})[self.metrics[index % width]] = values[index]
+            return {'seq': self.sequence, 'key': False, 'data': data}
+        flat = []
+        for index in changed:
+            flat.extend((index, values[index]))
+        return self._encode({'seq': self.sequence, 'key': 0, 'changes': flat})
+
+    def _encode(self, frame):
+        return msgpack.packb(frame) if self.format == 'msgpack' else frame
+
+
+class StatsPublisher:
+    """Tracks subscriptions per client and builds one frame per room per tick
+
+    `emit(event, payload, room)` is injected so the publisher can run
+    against Socket.IO or anything else (benchmarks, tests);
+    `link_state(name)` provides the 'status' metric.
+    """
+
+    def __init__(self, emit, keyframe_interval=PUSH_KEYFRAME_INTERVAL, link_state=None):
+        self.emit = emit
+        self.link_state = link_state
+        self.keyframe_interval = keyframe_interval
+        self._rooms = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, sid, interfaces, metrics=None, fmt='json'):
+        """Register a client's subscription, returns the room it must join
+
+        Raises ValueError for unknown metrics or formats.
+        """
+        metrics = tuple(metrics or PUSH_METRICS)
+        unknown = [metric for metric in metrics if metric not in PUSH_METRICS]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}', expected one of: {', '.join(FORMATS)}")
+        if fmt == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack format requires the msgpack package")
+
+        interfaces = tuple(sorted(set(interfaces)))
+        room = f"stats:{fmt}:{','.join(interfaces)}:{','.join(metrics)}"
+        with self._lock:
+            previous = self._unsubscribe(sid)
+            subscription = self._rooms.get(room)
+            if subscription is None:
+                subscription = self._rooms[room] = Subscription(room, interfaces, metrics, fmt)
+            subscription.members.add(sid)
+            self._clients[sid] = room
+        return previous, room
+
+    def unsubscribe(self, sid):
+        """Drop a client's subscription, returns the room it must leave (or None)"""
+        with self._lock:
+            return self._unsubscribe(sid)
+
+    def _unsubscribe(self, sid):
+        room = self._clients.pop(sid, None)
+        if room is not None:
+            subscription = self._rooms[room]
+            subscription.members.discard(sid)
+            if not subscription.members:
+                del self._rooms[room]
+        return room
+
+    def keyframe_for(self, sid, sample):
+        """Full frame of a client's subscription (new subscribers and resyncs)"""
+        with self._lock:
+            room = self._clients.get(sid)
+            if room is None:
+                return None
+            subscription = self._rooms[room]
+            return subscription.keyframe(subscription.read_values(sample, self.link_state))
+
+    def publish(self, sample):
+        """Emit this tick's frame to every room; returns the number of frames sent"""
+        frames = []
+        with self._lock:
+            for subscription in self._rooms.values():
+                values = subscription.read_values(sample, self.link_state)
+                is_key = subscription.last is None or subscription.ticks % self.keyframe_interval == 0
+                subscription.ticks += 1
+                subscription.sequence += 1
+                frame = subscription.keyframe(values) if is_key else subscription.delta(values)
+                subscription.last = values
+                if frame is None:
+                    # Nothing changed: no frame, and no gap in the sequence
+                    subscription.sequence -= 1
+                    continue
+                frames.append((frame, subscription.room))
+
+        for frame, room in frames:
+            self.emit(FRAME_EVENT, frame, room)
+        return len(frames)
+
+    def stats(self):
+        """Subscription counts, for diagnostics"""
+        with self._lock:
+            return {'rooms': len(self._rooms), 'clients': len(self._clients)}
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Sandbox topology - veth pairs with one end in a dedicated namespace (the
+ports the controller bridges, see NETNS) and the other in a namespace per
+port, plus a traffic generator between them, to load test the controller
+without touching real links
+
+Usage: python3 sandbox.py up [--ports N]
+       python3 sandbox.py traffic [--rate N] [--size N] [--duration S] [--json]
+       python3 sandbox.py down
+"""
+
+import argparse
+import ipaddress
+import json
+import sys
+import time
+
+import netns
+from config import PROBE_PORT, PROBE_RATE, PROBE_SIZE, SANDBOX_NETNS, SANDBOX_PORTS, SANDBOX_SUBNET
+from prober import LatencyHistogram, LatencyProbe, Reflector
+from tc_batch import CommandBatch, describe_failures
+
+PORT_PREFIX = 'sp'
+ENDPOINT_DEV = 'eth0'
+
+
+class Sandbox:
+    """`ports` veth pairs: sp<i> in namespace `name`, eth0 in namespace <name>-<i>
+
+    Endpoint i gets address i + 1 of `subnet`; with the ports bridged, all
+    endpoints share one L2 segment.
+    """
+
+    def __init__(self, name=SANDBOX_NETNS, ports=SANDBOX_PORTS, subnet=SANDBOX_SUBNET):
+        self.name = name
+        self.network = ipaddress.ip_network(subnet)
+        if not 2 <= ports <= self.network.num_addresses - 2:
+            raise ValueError(f"Ports must be between 2 and {self.network.num_addresses - 2} for {subnet}")
+        self.count = ports
+
+    @property
+    def ports(self):
+        return [f'{PORT_PREFIX}{index}' for index in range(self.count)]
+
+    def endpoint(self, index):
+        """(namespace, address) of the endpoint behind port `index`"""
+        return f'{self.name}-{index}', str(self.network[index + 1])
+
+    def exists(self):
+        return netns.exists(self.name)
+
+    def create(self):
+        """Build the namespaces and veth pairs, returns (success, message)"""
+        if self.exists():
+            return False, f"Sandbox {self.name} already exists"
+        batch = CommandBatch('ip', force=False)
+        batch.add(['netns', 'add', self.name])
+        for index, port in enumerate(self.ports):
+            namespace, _ = self.endpoint(index)
+            batch.add(['netns', 'add', namespace])
+            batch.add(['link', 'add', port, 'netns', self.name, 'type', 'veth',
+                       'peer', 'name', ENDPOINT_DEV, 'netns', namespace], interface=port)
+        failures = batch.run()
+
+        # ip started in a namespace configures that namespace
+        for index in range(-1, self.count):
+            if failures:
+                break
+            batch = CommandBatch('ip', force=False)
+            batch.add(['link', 'set', 'lo', 'up'])
+            if index < 0:
+                namespace = self.name
+            else:
+                namespace, address = self.endpoint(index)
+                batch.add(['addr', 'add', f'{address}/{self.network.prefixlen}', 'dev', ENDPOINT_DEV],
+                          interface=namespace)
+                batch.add(['link', 'set', ENDPOINT_DEV, 'up'], interface=namespace)
+            with netns.entered(namespace):
+                failures = batch.run()
+
+        if failures:
+            self.destroy()
+            return False, f"Error creating sandbox: {describe_failures(failures)}"
+        return True, f"Created sandbox {self.name} with {self.count} ports"
+
+    def destroy(self):
+        """Delete every namespace (their veth pairs go with them), returns (success, message)"""
+        names = [self.name] + [self.endpoint(index)[0] for index in range(self.count)]
+        batch = CommandBatch('ip', force=True)
+        for name in names:
+            if netns.exists(name):
+                batch.add(['netns', 'del', name])
+        if not len(batch):
+            return False, f"Sandbox {self.name} doesn't exist"
+        failures = batch.run()
+        if failures:
+            return False, f"Error deleting sandbox: {describe_failures(failures)}"
+        return True, f"Deleted sandbox {self.name}"
+
+
+class TrafficGenerator:
+    """UDP flows across the bridge: endpoint 2k sends to a reflector on endpoint 2k+1
+
+    Each flow enters the bridge on one port and leaves on the next, so it
+    goes through that port's egress shaping (and the replies through the
+    sender port's). Flows are latency probes, so besides throughput they
+    report round trips and loss.
+    """
+
+    def __init__(self, sandbox, rate=PROBE_RATE, size=PROBE_SIZE, duration=10, port=PROBE_PORT):
+        self.sandbox = sandbox
+        self.reflectors = []
+        self.flows = []
+        for index in range(0, sandbox.count - 1, 2):
+            sender, _ = sandbox.endpoint(index)
+            receiver, address = sandbox.endpoint(index + 1)
+            self.reflectors.append(Reflector('0.0.0.0', port, namespace=receiver))
+            self.flows.append(LatencyProbe(f'{address}:{port}', rate, size, duration, namespace=sender))
+
+    @property
+    def running(self):
+        return any(flow.running for flow in self.flows)
+
+    def start(self):
+        for reflector in self.reflectors:
+            reflector.start()
+        for flow in self.flows:
+            flow.start()
+
+    def wait(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for flow in self.flows:
+            flow.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if not self.running:
+            for reflector in self.reflectors:
+                reflector.stop()
+
+    def stop(self):
+        for flow in self.flows:
+            flow.stop()
+        self.wait()
+
+    def status(self):
+        """Totals over every flow, with the throughput each delivered (see LatencyProbe.status)"""
+        histogram = LatencyHistogram()
+        flows = []
+        totals = {'sent': 0, 'received': 0, 'lost': 0}
+        for index, flow in enumerate(self.flows):
+            status = flow.status()
+            histogram.merge(flow.histogram)
+            for key in totals:
+                totals[key] += status[key]
+            flows.append({
+                'ports': [f'{PORT_PREFIX}{2 * index}', f'{PORT_PREFIX}{2 * index + 1}'],
+                'throughput_mbps': status['delivered_mbps'],
+                'loss_percent': status['loss_percent'],
+                'rtt_ms': status['rtt_ms']
+            })
+        answered = totals['received'] + totals['lost']
+        return {
+            'running': self.running,
+            'flows': flows,
+            **totals,
+            'loss_percent': round(totals['lost'] / answered * 100, 3) if answered else None,
+            'throughput_mbps': round(sum(flow['throughput_mbps'] or 0 for flow in flows), 3),
+            'rtt_ms': histogram.summary()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--name', default=SANDBOX_NETNS, help='sandbox namespace')
+    parser.add_argument('--ports', type=int, default=SANDBOX_PORTS)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('up', help='create the namespaces and veth pairs')
+    commands.add_parser('down', help='delete them')
+    traffic = commands.add_parser('traffic', help='send UDP flows between port pairs across the bridge')
+    traffic.add_argument('--rate', type=float, default=PROBE_RATE, help='packets per second per flow')
+    traffic.add_argument('--size', type=int, default=PROBE_SIZE, help='UDP payload bytes')
+    traffic.add_argument('--duration', type=float, default=10, help='seconds')
+    traffic.add_argument('--json', action='store_true', help='only print the final status, with every flow')
+    args = parser.parse_args()
+
+    sandbox = Sandbox(args.name, args.ports)
+    if args.command == 'up':
+        success, message = sandbox.create()
+        print(message)
+        if success:
+            print(f"Bridge ports {sandbox.ports[0]}..{sandbox.ports[-1]} in namespace {sandbox.name}: "
+                  f"set NETNS = \"{sandbox.name}\" to run the controller against them")
+        return 0 if success else 1
+    if args.command == 'down':
+        success, message = sandbox.destroy()
+        print(message)
+        return 0 if success else 1
+
+    if not sandbox.exists():
+        print(f"Sandbox {sandbox.name} doesn't exist, run: python3 sandbox.py up")
+        return 1
+    generator = TrafficGenerator(sandbox, args.rate, args.size, args.duration)
+    generator.start()
+    if args.json:
+        generator.wait()
+        print(json.dumps(generator.status()))
+        return 0
+    print(f"{len(generator.flows)} flows at {args.rate:g} packets/s of {args.size} bytes")
+    try:
+        while generator.running:
+            generator.wait(1)
+            status = generator.status()
+            rtt = status['rtt_ms'] or {}
+            print(f"received {status['received']} loss {status['loss_percent']}% "
+                  f"throughput {status['throughput_mbps']} Mbit/s p50 {rtt.get('p50')} p99 {rtt.get('p99')} ms")
+    except KeyboardInterrupt:
+        generator.stop()
+    status = generator.status()
+    print(json.dumps({key: value for key, value in status.items() if key != 'flows'}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,12 +2,18 @@
 
 class BridgeController {
     constructor() {
-        this.socket = io();
+        // Socket.IO reconnects on its own; back off exponentially with jitter
+        this.socket = io({
+            reconnectionDelay: 1000,
+            reconnectionDelayMax: 30000,
+            randomizationFactor: 0.5
+        });
         this.selectedInterfaces = [];
         this.selectedTCTargets = [];
         this.currentBridgeStatus = null;
         this.selectedInterface = null;
         this.availableInterfaces = [];
+        this.statsFrames = { seq: null, values: {} };
         this.init();
     }
 
@@ -15,15 +21,11 @@ class BridgeController {
         this.setupEventListeners();
         this.loadInterfaces();
         this.loadBridgeStatus();
-        this.loadNetworkStats();
         this.updateCurrentTime();
         this.setupSocketListeners();
         
-        // Update time every second
+        // Update time every second (stats are pushed by the server)
         setInterval(() => this.updateCurrentTime(), 1000);
-        
-        // Update network stats every second
-        setInterval(() => this.loadNetworkStats(), 1000);
     }
 
     setupEventListeners() {
@@ -66,41 +68,94 @@ class BridgeController {
         // Interface selector for network stats
         document.getElementById('interface-selector').addEventListener('change', (e) => {
             this.selectedInterface = e.target.value;
-            this.loadInterfaceStats();
+            this.subscribeInterfaceStats();
         });
     }
 
     setupSocketListeners() {
+        this.socket.on('connect', () => {
+            // Subscriptions don't survive a reconnect: subscribe again
+            this.subscribeInterfaceStats();
+        });
+
+        this.socket.on('disconnect', (reason) => {
+            this.log('Disconnected from server: ' + reason, 'warning');
+        });
+
+        this.socket.io.on('reconnect', (attempt) => {
+            this.log(`Reconnected to server after ${attempt} attempts`, 'success');
+        });
+
         this.socket.on('bridge_status_update', (status) => {
             this.updateBridgeStatus(status);
         });
         
-        this.socket.on('network_stats_update', (stats) => {
-            this.updateNetworkStats(stats);
+        this.socket.on('stats_frame', (frame) => {
+            this.handleStatsFrame(frame);
         });
     }
 
-    async loadInterfaces() {
-        try {
-            const response = await fetch('/api/interfaces');
-            const interfaces = await response.json();
-            this.availableInterfaces = interfaces;
-            this.renderInterfaceList(interfaces);
-            this.updateInterfaceSelector(interfaces);
-        } catch (error) {
-            this.log('Error loading interfaces: ' + error.message, 'error');
+    subscribeInterfaceStats() {
+        this.statsFrames = { seq: null, values: {} };
+
+        if (!this.selectedInterface) {
+            this.socket.emit('unsubscribe');
+            this.hideInterfaceStats();
+            return;
+        }
+
+        this.socket.emit('subscribe', {
+            interfaces: [this.selectedInterface],
+            metrics: BridgeController.STATS_METRICS,
+            format: 'json'
+        }, (result) => {
+            if (result && !result.success) {
+                this.log(`Error subscribing to ${this.selectedInterface} stats: ${result.message}`, 'error');
+            }
+        });
+    }
+
+    handleStatsFrame(frame) {
+        const state = this.statsFrames;
+
+        if (frame.key) {
+            state.values = frame.data;
+        } else if (state.seq === null || frame.seq !== state.seq + 1) {
+            // Missed a frame (or no keyframe yet): deltas can't be applied
+            state.seq = null;
+            this.socket.emit('resync');
+            return;
+        } else {
+            Object.entries(frame.data).forEach(([iface, changes]) => {
+                state.values[iface] = Object.assign(state.values[iface] || {}, changes);
+            });
+        }
+        state.seq = frame.seq;
+
+        const values = state.values[this.selectedInterface];
+        if (!values || values.rx_bytes === null || values.rx_bytes === undefined) {
+            this.hideInterfaceStats();
+            return;
         }
+
+        this.updateInterfaceStats({
+            interface: this.selectedInterface,
+            status: values.status,
+            raw_stats: values,
+            rates: values,
+            error_rate: values.error_rate
+        });
     }
 
-    async refreshInterfaceSelector() {
-        // Only refresh the interface selector dropdown, not the entire interface list
+    async loadInterfaces() {
         try {
             const response = await fetch('/api/interfaces');
             const interfaces = await response.json();
             this.availableInterfaces = interfaces;
+            this.renderInterfaceList(interfaces);
             this.updateInterfaceSelector(interfaces);
         } catch (error) {
-            this.log('Error refreshing interface selector: ' + error.message, 'error');
+            this.log('Error loading interfaces: ' + error.message, 'error');
         }
     }
 
@@ -114,16 +169,6 @@ class BridgeController {
         }
     }
 
-    async loadNetworkStats() {
-        try {
-            const response = await fetch('/api/network/stats');
-            const stats = await response.json();
-            this.updateNetworkStats(stats);
-        } catch (error) {
-            this.log('Error loading network stats: ' + error.message, 'error');
-        }
-    }
-
     renderInterfaceList(interfaces) {
         const container = document.getElementById('interface-list');
         const modalContainer = document.getElementById('modal-interface-list');
@@ -515,27 +560,6 @@ class BridgeController {
         }
     }
 
-    async loadInterfaceStats() {
-        if (!this.selectedInterface) {
-            this.hideInterfaceStats();
-            return;
-        }
-
-        try {
-            const response = await fetch(`/api/network/stats/${this.selectedInterface}`);
-            if (response.ok) {
-                const stats = await response.json();
-                this.updateInterfaceStats(stats);
-            } else {
-                this.log(`Error loading stats for ${this.selectedInterface}: Interface not found`, 'error');
-                this.hideInterfaceStats();
-            }
-        } catch (error) {
-            this.log(`Error loading interface stats: ${error.message}`, 'error');
-            this.hideInterfaceStats();
-        }
-    }
-
     updateInterfaceStats(stats) {
         // Show interface status
         const statusDiv = document.getElementById('interface-status');
@@ -627,23 +651,6 @@ class BridgeController {
         document.getElementById('error-total').textContent = 'Total: 0 errors';
     }
 
-    updateNetworkStats(stats) {
-        // Only update interface selector if bridge status actually changed
-        const bridgeActive = stats.bridge && Object.keys(stats.bridge).length > 0;
-        const statusChanged = this.currentBridgeStatus && 
-            this.currentBridgeStatus.active !== bridgeActive;
-        
-        if (statusChanged) {
-            // Only refresh interface selector, not the entire interface list
-            this.refreshInterfaceSelector();
-        }
-        
-        // If an interface is selected, load its stats
-        if (this.selectedInterface) {
-            this.loadInterfaceStats();
-        }
-    }
-
     formatBytes(bytes) {
         if (bytes === 0) return '0 B';
         const k = 1024;
@@ -688,6 +695,13 @@ class BridgeController {
     }
 }
 
+// Values the interface statistics panel subscribes to
+BridgeController.STATS_METRICS = [
+    'rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets', 'rx_errors', 'tx_errors',
+    'rx_bytes_per_sec', 'tx_bytes_per_sec', 'rx_packets_per_sec', 'tx_packets_per_sec',
+    'error_rate', 'status'
+];
+
 // Initialize the application when DOM is loaded
 document.addEventListener('DOMContentLoaded', () => {
     new BridgeController();
@@ -0,0 +1,270 @@
+"""
+Interface counter collection - every interface's counters from a single
+read of /proc/net/dev, kept in a compact array-backed snapshot, sampled by
+one background thread that also computes rates
+"""
+
+import threading
+import time
+from array import array
+from concurrent.futures import Future
+
+from config import STATS_SAMPLE_INTERVAL
+from metrics import SAMPLE_SECONDS
+
+COUNTER_FIELDS = ('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
+                  'rx_errors', 'tx_errors', 'rx_dropped', 'tx_dropped')
+NUM_COUNTERS = len(COUNTER_FIELDS)
+
+# Column of each COUNTER_FIELDS entry in a /proc/net/dev line (after "iface:")
+# receive: bytes packets errs drop fifo frame compressed multicast
+# transmit: bytes packets errs drop fifo colls carrier compressed
+_PROC_COLUMNS = (0, 8, 1, 9, 2, 10, 3, 11)
+
+
+class CounterSnapshot:
+    """Counters of all interfaces at one instant
+
+    Counters live in a single flat array('Q'), NUM_COUNTERS per interface in
+    COUNTER_FIELDS order; `index` maps an interface name to its row.
+    """
+
+    __slots__ = ('timestamp', 'names', 'index', 'counters')
+
+    def __init__(self, timestamp, names, counters):
+        self.timestamp = timestamp
+        self.names = tuple(names)
+        self.index = {name: row for row, name in enumerate(self.names)}
+        self.counters = counters
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, name):
+        """Counters of one interface as a tuple, None if unknown"""
+        row = self.index.get(name)
+        if row is None:
+            return None
+        start = row * NUM_COUNTERS
+        return tuple(self.counters[start:start + NUM_COUNTERS])
+
+    def get(self, name):
+        """Counters of one interface as a dict, None if unknown"""
+        values = self.row(name)
+        return dict(zip(COUNTER_FIELDS, values)) if values is not None else None
+
+
+def read_proc_net_dev(path='/proc/net/dev'):
+    """Read every interface's counters with a single file read"""
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()[2:]
+    timestamp = time.monotonic()
+
+    names = []
+    counters = array('Q')
+    for line in lines:
+        name, sep, data = line.partition(':')
+        if not sep:
+            continue
+        fields = data.split()
+        if len(fields) < 16:
+            continue
+        names.append(name.strip())
+        counters.extend(int(fields[column]) for column in _PROC_COLUMNS)
+    return CounterSnapshot(timestamp, names, counters)
+
+
+def counter_delta(current, previous):
+    """Difference between two counter readings, handling wraparound and resets"""
+    if current >= previous:
+        return current - previous
+    if 2 ** 31 < previous < 2 ** 32 and current < 2 ** 31:
+        # 32-bit counter (some drivers) wrapped
+        return current + 2 ** 32 - previous
+    # Anything else going backwards (64-bit counters never wrap in practice)
+    # is a reset: the interface was recreated, count from zero
+    return current
+
+
+RATE_FIELDS = ('rx_bytes_per_sec', 'tx_bytes_per_sec', 'rx_packets_per_sec',
+               'tx_packets_per_sec', 'rx_errors_per_sec', 'tx_errors_per_sec')
+NUM_RATES = len(RATE_FIELDS)
+
+
+DERIVED_FIELDS = ('error_rate', 'total_throughput', 'total_packet_rate')
+
+
+def derived_stats(counters, rates):
+    """Error rate (% of packets) and combined rx+tx rates of one interface"""
+    total_packets = counters['rx_packets'] + counters['tx_packets']
+    total_errors = counters['rx_errors'] + counters['tx_errors']
+    error_rate = (total_errors / total_packets * 100) if total_packets > 0 else 0
+    return {
+        'error_rate': round(error_rate, 2),
+        'total_throughput': rates.get('rx_bytes_per_sec', 0) + rates.get('tx_bytes_per_sec', 0),
+        'total_packet_rate': rates.get('rx_packets_per_sec', 0) + rates.get('tx_packets_per_sec', 0)
+    }
+
+
+class StatsSample:
+    """Immutable result of one sampling tick: counters plus per-second rates
+
+    Rates are stored like the counters, NUM_RATES per snapshot row;
+    `has_rates` marks rows that had a previous reading to compare with.
+    """
+
+    __slots__ = ('sequence', 'snapshot', 'rates', 'has_rates')
+
+    def __init__(self, sequence, snapshot, rates, has_rates):
+        self.sequence = sequence
+        self.snapshot = snapshot
+        self.rates = rates
+        self.has_rates = has_rates
+
+    @property
+    def timestamp(self):
+        return self.snapshot.timestamp
+
+    def get(self, name):
+        """Counters of one interface as a dict, None if unknown"""
+        return self.snapshot.get(name)
+
+    def get_rates(self, name):
+        """Per-second rates of one interface as a dict, empty if not available yet"""
+        row = self.snapshot.index.get(name)
+        if row is None or not self.has_rates[row]:
+            return {}
+        start = row * NUM_RATES
+        return dict(zip(RATE_FIELDS, self.rates[start:start + NUM_RATES]))
+
+
+def compute_sample(sequence, snapshot, previous):
+    """Build a StatsSample from a snapshot and the previous one (or None)"""
+    rates = array('d', bytes(8 * NUM_RATES * len(snapshot)))
+    has_rates = array('b', bytes(len(snapshot)))
+    if previous is not None:
+        elapsed = snapshot.timestamp - previous.timestamp
+        if elapsed > 0:
+            current, prev = snapshot.counters, previous.counters
+            for row, name in enumerate(snapshot.names):
+                prev_row = previous.index.get(name)
+                if prev_row is None:
+                    continue
+                base, prev_base = row * NUM_COUNTERS, prev_row * NUM_COUNTERS
+                # Rate fields follow the first NUM_RATES counters (bytes, packets, errors)
+                for i in range(NUM_RATES):
+                    rates[row * NUM_RATES + i] = counter_delta(current[base + i], prev[prev_base + i]) / elapsed
+                has_rates[row] = 1
+    return StatsSample(sequence, snapshot, rates, has_rates)
+
+
+class StatsSampler:
+    """Single thread snapshotting all counters at a fixed interval
+
+    Rates are computed once per tick; every REST and Socket.IO consumer
+    reads the latest immutable StatsSample instead of touching the kernel.
+    """
+
+    def __init__(self, path='/proc/net/dev', interval=STATS_SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._latest = None
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._listeners = []
+        # Futures waiting for the next sample (see next_sample)
+        self._waiters = []
+
+    def add_listener(self, callback):
+        """Call `callback(sample)` from the sampler thread after every tick"""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Start the sampling thread"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='stats-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sampling thread"""
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self._running:
+            started = time.monotonic()
+            sample = self.sample_once()
+            for callback in self._listeners:
+                try:
+                    callback(sample)
+                except Exception as e:
+                    print(f"Error in stats listener: {e}")
+            SAMPLE_SECONDS.observe(time.monotonic() - started)
+            # Schedule against the original cadence so the interval doesn't drift
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Fell behind (e.g. suspended): skip missed ticks
+                next_tick = time.monotonic()
+                delay = 0
+            time.sleep(delay)
+
+    def sample_once(self):
+        """Take a snapshot now and publish it as the latest sample"""
+        try:
+            snapshot = read_proc_net_dev(self.path)
+        except OSError as e:
+            print(f"Error reading {self.path}: {e}")
+            snapshot = CounterSnapshot(time.monotonic(), [], array('Q'))
+
+        with self._condition:
+            previous = self._latest.snapshot if self._latest is not None else None
+            self._sequence += 1
+            self._publish(compute_sample(self._sequence, snapshot, previous))
+            return self._latest
+
+    def _publish(self, sample):
+        # Condition held: make `sample` the latest and wake everyone waiting for it
+        self._latest = sample
+        self._condition.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            future.set_result(sample)
+
+    def latest(self):
+        """Latest sample (taken synchronously if the sampler hasn't run yet)"""
+        sample = self._latest
+        if sample is None:
+            sample = self.sample_once()
+        return sample
+
+    def wait_for_sample(self, after_sequence, timeout=None):
+        """Block until a sample newer than `after_sequence` exists, returns it"""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._running or (self._latest is not None and self._latest.sequence > after_sequence),
+                timeout)
+            return self._latest
+
+    def next_sample(self, after_sequence):
+        """Future of the first sample newer than `after_sequence`
+
+        Unlike wait_for_sample, green threads can wait on it through
+        IOPool.wait without blocking the hub.
+        """
+        future = Future()
+        with self._condition:
+            if self._latest is not None and self._latest.sequence > after_sequence:
+                future.set_result(self._latest)
+            else:
+                self._waiters.append(future)
+        return future
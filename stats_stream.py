@@ -0,0 +1,144 @@
+"""
+Streaming stats export - every sample as struct-of-arrays frames taken
+straight from the StatsSample arrays, as length-prefixed binary or NDJSON,
+for collectors tailing /api/network/stats/stream over long captures
+
+Binary stream: frames of type (uint8) and payload length (uint32), both
+big-endian, with little-endian payloads:
+  NAMES_FRAME   JSON {"names", "counter_fields", "rate_fields"}, describing
+                the rows of every sample frame after it (sent on change)
+  SAMPLE_FRAME  sequence (uint64), timestamp (float64, monotonic seconds),
+                time (float64, unix seconds), then per row len(counter_fields)
+                uint64 counters, len(rate_fields) float64 rates, and finally
+                one int8 per row: 1 if the row has rates yet
+NDJSON has one sample object per line with the same fields, plus "names",
+"counter_fields" and "rate_fields" on the lines where the rows change.
+"""
+
+import json
+import struct
+import sys
+import time
+from array import array
+
+from stats import COUNTER_FIELDS, NUM_COUNTERS, NUM_RATES, RATE_FIELDS, CounterSnapshot, StatsSample
+
+FORMATS = ('ndjson', 'binary')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'binary': 'application/octet-stream'}
+
+_FRAME = struct.Struct('!BI')
+_SAMPLE = struct.Struct('<Qdd')
+
+NAMES_FRAME = 1
+SAMPLE_FRAME = 2
+
+_SWAP = sys.byteorder != 'little'
+
+
+def _little_endian(values):
+    if not _SWAP:
+        return values.tobytes()
+    values = array(values.typecode, values)
+    values.byteswap()
+    return values.tobytes()
+
+
+class StreamEncoder:
+    """Encodes consecutive samples of one stream, optionally for a subset of interfaces
+
+    Row names are only sent when they change, so a steady stream costs the
+    sample header plus the raw array bytes per tick; no per-interface
+    objects are built.
+    """
+
+    def __init__(self, fmt='ndjson', interfaces=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}', expected one of: {', '.join(FORMATS)}")
+        self.format = fmt
+        self.interfaces = list(interfaces) if interfaces else None
+        self._names = None
+        # Snapshot rows streamed (None: all of them) and their names
+        self._rows = None
+        self._selected = ()
+
+    def _select(self, snapshot):
+        """Follow the snapshot's rows, True if the streamed names changed"""
+        if snapshot.names == self._names:
+            return False
+        self._names = snapshot.names
+        if self.interfaces is None:
+            self._rows = None
+            selected = snapshot.names
+        else:
+            self._rows = [snapshot.index[name] for name in self.interfaces if name in snapshot.index]
+            selected = tuple(snapshot.names[row] for row in self._rows)
+        changed = selected != self._selected
+        self._selected = selected
+        return changed
+
+    def _arrays(self, sample):
+        if self._rows is None:
+            return sample.snapshot.counters, sample.rates, sample.has_rates
+        counters, rates, has_rates = array('Q'), array('d'), array('b')
+        for row in self._rows:
+            counters.extend(sample.snapshot.counters[row * NUM_COUNTERS:(row + 1) * NUM_COUNTERS])
+            rates.extend(sample.rates[row * NUM_RATES:(row + 1) * NUM_RATES])
+            has_rates.append(sample.has_rates[row])
+        return counters, rates, has_rates
+
+    def encode(self, sample):
+        """Bytes to send for one sample"""
+        changed = self._select(sample.snapshot)
+        counters, rates, has_rates = self._arrays(sample)
+        # Wall clock time of the sample from its monotonic timestamp
+        wall = time.time() - (time.monotonic() - sample.timestamp)
+        if self.format == 'binary':
+            frames = []
+            if changed:
+                header = json.dumps({'names': self._selected, 'counter_fields': COUNTER_FIELDS,
+                                     'rate_fields': RATE_FIELDS}).encode()
+                frames.append(_FRAME.pack(NAMES_FRAME, len(header)) + header)
+            body = b''.join((_SAMPLE.pack(sample.sequence, sample.timestamp, wall), _little_endian(counters),
+                             _little_endian(rates), has_rates.tobytes()))
+            frames.append(_FRAME.pack(SAMPLE_FRAME, len(body)) + body)
+            return b''.join(frames)
+
+        line = {'sequence': sample.sequence, 'timestamp': sample.timestamp, 'time': wall}
+        if changed:
+            line.update(names=self._selected, counter_fields=COUNTER_FIELDS, rate_fields=RATE_FIELDS)
+        line.update(counters=counters.tolist(), rates=rates.tolist(), has_rates=has_rates.tolist())
+        return (json.dumps(line, separators=(',', ':')) + '\n').encode()
+
+
+def read_stream(stream):
+    """Decode a binary stream from a file-like object, yields (time, StatsSample) per sample
+
+    The samples' sequence numbers are the controller's own.
+    """
+    names = ()
+    while True:
+        header = stream.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            return
+        frame_type, length = _FRAME.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            return
+        if frame_type == NAMES_FRAME:
+            names = tuple(json.loads(payload)['names'])
+            continue
+        if frame_type != SAMPLE_FRAME:
+            continue
+        sequence, timestamp, wall = _SAMPLE.unpack_from(payload)
+        offset = _SAMPLE.size
+        arrays = []
+        for typecode, width in (('Q', NUM_COUNTERS), ('d', NUM_RATES), ('b', 1)):
+            values = array(typecode)
+            size = values.itemsize * width * len(names)
+            values.frombytes(payload[offset:offset + size])
+            if _SWAP and values.itemsize > 1:
+                values.byteswap()
+            offset += size
+            arrays.append(values)
+        counters, rates, has_rates = arrays
+        yield wall, StatsSample(sequence, CounterSnapshot(timestamp, names, counters), rates, has_rates)
@@ -0,0 +1,96 @@
+"""
+Persistent controller state - bridges and qdisc trees applied through the
+API, kept in SQLite so a restarted controller can restore and reconcile them
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from config import STATE_DB
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS bridges (name TEXT PRIMARY KEY, ip TEXT, interfaces TEXT NOT NULL)',
+    # One row per interface: the tree the controller last applied to it
+    'CREATE TABLE IF NOT EXISTS tc (interface TEXT PRIMARY KEY, bridge TEXT NOT NULL, '
+    'tree TEXT NOT NULL, profile TEXT)',
+)
+
+
+class StateStore:
+    """Active bridges (ip, ports) and the desired qdisc tree and profile per interface
+
+    The database runs in WAL mode with synchronous=NORMAL: every change is
+    one small transaction appended to the log, without an fsync per commit.
+    Errors are reported and never fail the operation that caused the write.
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def _write(self, statements):
+        try:
+            with self._lock, self._db:
+                for sql, params in statements:
+                    self._db.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Error saving state to {self.path}: {e}")
+
+    def save_bridge(self, name, ip, interfaces):
+        self._write([('INSERT OR REPLACE INTO bridges VALUES (?, ?, ?)', (name, ip, json.dumps(interfaces)))])
+
+    def delete_bridge(self, name):
+        self._write([('DELETE FROM bridges WHERE name = ?', (name,))])
+
+    def save_tc(self, bridge, trees, profiles=None):
+        """Store {interface: tree} applied by a bridge in one transaction; empty trees are removed"""
+        profiles = profiles or {}
+        statements = []
+        for interface, tree in trees.items():
+            if tree:
+                profile = profiles.get(interface)
+                statements.append(('INSERT OR REPLACE INTO tc VALUES (?, ?, ?, ?)',
+                                   (interface, bridge, json.dumps(tree),
+                                    json.dumps(profile) if profile is not None else None)))
+            else:
+                statements.append(('DELETE FROM tc WHERE interface = ?', (interface,)))
+        self._write(statements)
+
+    def delete_tc(self, bridge):
+        """Forget every tree applied by a bridge"""
+        self._write([('DELETE FROM tc WHERE bridge = ?', (bridge,))])
+
+    def load(self):
+        """Stored state as ({bridge: {'ip', 'interfaces'}}, {bridge: {interface: {'tree', 'profile'}}})"""
+        bridges = {}
+        tc = {}
+        try:
+            with self._lock:
+                bridge_rows = self._db.execute('SELECT name, ip, interfaces FROM bridges').fetchall()
+                tc_rows = self._db.execute('SELECT interface, bridge, tree, profile FROM tc').fetchall()
+        except sqlite3.Error as e:
+            print(f"Error loading state from {self.path}: {e}")
+            return bridges, tc
+        for name, ip, interfaces in bridge_rows:
+            bridges[name] = {'ip': ip, 'interfaces': json.loads(interfaces)}
+        for interface, bridge, tree, profile in tc_rows:
+            tc.setdefault(bridge, {})[interface] = {
+                'tree': json.loads(tree),
+                'profile': json.loads(profile) if profile is not None else None
+            }
+        return bridges, tc
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,106 @@
+"""
+Command batching for tc and ip - runs a whole request worth of operations
+through a single `tc -batch -` / `ip -batch -` process
+"""
+
+import re
+import subprocess
+
+from config import BATCH_FORCE, COMMAND_TIMEOUT
+
+# tc/ip report a failing batch line as "Command failed -:<line>" on stderr,
+# preceded by the error message(s) for that line
+_FAILED_LINE = re.compile(r'^Command failed -:(\d+)\s*$')
+
+
+def format_batch_line(args):
+    """Format an argument list as a single batch line"""
+    return ' '.join(f'"{arg}"' if any(c.isspace() for c in str(arg)) else str(arg)
+                    for arg in args)
+
+
+class CommandBatch:
+    """Collects tc or ip operations and executes them with one process spawn"""
+
+    def __init__(self, tool, force=BATCH_FORCE):
+        self.tool = tool
+        self.force = force
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, args, interface=None):
+        """Queue a command (arguments without the tool name) for an interface
+
+        Best-effort operations are split off by Backend.execute, which runs
+        them in their own forced batch.
+        """
+        self.commands.append((list(args), interface))
+
+    def run(self):
+        """Run all queued commands, returns a list of failures (empty on success)"""
+        if not self.commands:
+            return []
+        return self._execute(self.commands, force=self.force)
+
+    def _execute(self, commands, force):
+        """Pipe commands into `<tool> [-force] -batch -` and map errors back to lines"""
+        cmd = [self.tool]
+        if force:
+            cmd.append('-force')
+        cmd.extend(['-batch', '-'])
+
+        script = ''.join(format_batch_line(args) + '\n' for args, _ in commands)
+        try:
+            result = subprocess.run(cmd, input=script, capture_output=True, text=True, timeout=COMMAND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # The process is killed; which lines ran is unknown, so blame all of them
+            return [{'interface': interface, 'command': f"{self.tool} {format_batch_line(args)}",
+                     'error': f"timed out after {COMMAND_TIMEOUT}s"} for args, interface in commands]
+        except OSError as e:
+            return [{'interface': None, 'command': ' '.join(cmd), 'error': str(e)}]
+
+        if result.returncode == 0:
+            return []
+        return self._map_failures(result.stderr, commands)
+
+    def _map_failures(self, stderr, commands):
+        """Map "Command failed -:<n>" markers back to the queued commands"""
+        failures = []
+        pending = []
+        for line in stderr.splitlines():
+            match = _FAILED_LINE.match(line)
+            if not match:
+                # Warnings (e.g. HTB quantum hints) don't belong to a failing line
+                if line.strip() and not line.startswith('Warning:'):
+                    pending.append(line.strip())
+                continue
+
+            index = int(match.group(1)) - 1
+            if 0 <= index < len(commands):
+                args, interface = commands[index]
+                failures.append({
+                    'interface': interface,
+                    'command': f"{self.tool} {format_batch_line(args)}",
+                    'error': ' '.join(pending) or 'command failed'
+                })
+            pending = []
+
+        if not failures:
+            # Failed without pointing at a line (e.g. the batch itself was rejected)
+            failures.append({
+                'interface': None,
+                'command': f"{self.tool} -batch",
+                'error': ' '.join(pending) or 'batch failed'
+            })
+        return failures
+
+
+def describe_failures(failures):
+    """Render a failure list as a short message, first error per interface"""
+    messages = {}
+    for failure in failures:
+        messages.setdefault(failure['interface'], failure['error'])
+    return '; '.join(f"{interface}: {error}" if interface else error
+                     for interface, error in messages.items())
@@ -0,0 +1,397 @@
+"""
+Desired-state model of an interface's qdisc tree, and the diff that moves
+the kernel to it with `change` operations instead of delete-and-recreate
+"""
+
+import hashlib
+import ipaddress
+
+from config import TC_CLASSIFIER, TC_MAX_RATE, U32_HASH_THRESHOLD
+
+ROOT_HANDLE = '1:'
+HTB_CLASS = '1:1'
+NETEM_HANDLE = '10:'
+
+# Per-flow profiles: class 1:1 takes unclassified traffic, traffic classes
+# use 1:2 upwards and all filters live at one priority on the root qdisc
+MAX_CLASSES = 254
+FILTER_PRIO = 1
+CLASSIFIERS = ('u32', 'flower')
+U32_ROOT_TABLE = '800:'
+U32_HASH_TABLE = '2:'
+MATCH_FIELDS = ('dst', 'src', 'protocol', 'dport', 'sport', 'dscp')
+PROTOCOLS = {'icmp': 1, 'tcp': 6, 'udp': 17}
+
+# Ingress shaping: the ingress qdisc hands every packet to one matchall
+# filter whose mirred action redirects it to the interface's IFB device,
+# where an ordinary root tree shapes it
+DIRECTIONS = ('egress', 'ingress', 'both')
+INGRESS_PARENT = 'ffff:fff1'
+INGRESS_HANDLE = 'ffff:'
+INGRESS_PRIO = 1
+IFB_PREFIX = 'ifb-'
+IFNAMSIZ = 15
+
+# Relative tolerance when comparing kernel values (rates are stored in
+# bytes/s, delays in ticks, loss as a u32 fraction)
+_TOLERANCE = 0.001
+
+
+def _node(node_type, kind, handle, parent, options=None):
+    return {'type': node_type, 'kind': kind, 'handle': handle, 'parent': parent, 'options': options or {}}
+
+
+def netem_options(delay=0, jitter=0, loss=0):
+    """Complete netem option set (delay/jitter in ms, loss in %)"""
+    return {'delay': float(delay or 0), 'jitter': float(jitter or 0), 'loss': float(loss or 0)}
+
+
+def _impairment(rules):
+    """netem options for a rule set's delay/jitter/loss, None if it has none"""
+    delay = int(rules.get('delay') or 0)
+    jitter = int(rules.get('jitter') or 0)
+    loss = float(rules.get('packet_loss') or 0)
+    if delay <= 0 and jitter <= 0 and loss <= 0:
+        return None
+    # Jitter only applies on top of a delay
+    return netem_options(max(delay, 0), jitter if delay > 0 and jitter > 0 else 0, max(loss, 0))
+
+
+def build_tree(rules):
+    """Desired qdisc tree for filtered rules, as a parents-first node list
+
+    An empty list means no shaping at all. Raises ValueError/TypeError on
+    invalid rule values.
+    """
+    bandwidth = float(rules.get('bandwidth') or 0)
+    netem = _impairment(rules)
+    if bandwidth <= 0 and not netem:
+        return []
+    return build_fixed_tree(rules, with_htb=bandwidth > 0, with_netem=netem is not None)
+
+
+def build_fixed_tree(rules, with_htb, with_netem):
+    """Tree of a given shape for rules, so changing values never changes the shape
+
+    Missing values become no-ops: an unlimited HTB rate, a netem without
+    delay or loss. Used directly by trace playback, where every step must
+    be reachable with `change` operations.
+    """
+    bandwidth = float(rules.get('bandwidth') or 0)
+    netem = _impairment(rules) or netem_options()
+
+    if with_htb:
+        # HTB for bandwidth limiting, netem for delay/jitter/loss below the class;
+        # `default 1` sends all (unclassified) traffic through the class
+        rate = int((bandwidth if bandwidth > 0 else TC_MAX_RATE) * 1000000)
+        tree = [
+            _node('qdisc', 'htb', ROOT_HANDLE, 'root', {'default': 1}),
+            _node('class', 'htb', HTB_CLASS, ROOT_HANDLE, {'rate': rate, 'ceil': rate}),
+        ]
+        if with_netem:
+            tree.append(_node('qdisc', 'netem', NETEM_HANDLE, HTB_CLASS, netem))
+        return tree
+
+    return [_node('qdisc', 'netem', ROOT_HANDLE, 'root', netem)] if with_netem else []
+
+
+def tree_settings(tree):
+    """Bandwidth (Mbit/s), delay/jitter (ms) and loss (%) a tree applies to default traffic
+
+    None for values the tree doesn't set; in profile trees only the default
+    class 1:1 is described.
+    """
+    settings = {'bandwidth': None, 'delay': None, 'jitter': None, 'packet_loss': None}
+    for node in tree or []:
+        if node['type'] == 'class' and node['handle'] == HTB_CLASS:
+            settings['bandwidth'] = node['options']['rate'] / 1000000
+        elif node['kind'] == 'netem' and node['parent'] in ('root', HTB_CLASS):
+            options = node['options']
+            settings.update(delay=options.get('delay'), jitter=options.get('jitter'),
+                            packet_loss=options.get('loss'))
+    return settings
+
+
+def _filter_node(kind, handle, options):
+    node = _node('filter', kind, handle, ROOT_HANDLE, options)
+    node['prio'] = FILTER_PRIO
+    return node
+
+
+def parse_match(match, label):
+    """Validate one class match ({'dst', 'src', 'protocol', 'dport', 'sport', 'dscp'})"""
+    if not isinstance(match, dict) or not match:
+        raise ValueError(f"Class {label}: a match must be a non-empty object")
+    unknown = [key for key in match if key not in MATCH_FIELDS]
+    if unknown:
+        raise ValueError(f"Class {label}: unknown match fields: {', '.join(unknown)}")
+
+    parsed = {}
+    for key in ('dst', 'src'):
+        if match.get(key):
+            parsed[key] = str(ipaddress.IPv4Network(match[key], strict=False))
+    if match.get('protocol') not in (None, ''):
+        protocol = PROTOCOLS.get(str(match['protocol']).lower(), match['protocol'])
+        parsed['protocol'] = int(protocol)
+        if not 0 <= parsed['protocol'] <= 255:
+            raise ValueError(f"Class {label}: protocol must be 0-255")
+    for key in ('dport', 'sport'):
+        if match.get(key) not in (None, ''):
+            if parsed.get('protocol') not in (PROTOCOLS['tcp'], PROTOCOLS['udp']):
+                raise ValueError(f"Class {label}: port matches need protocol tcp or udp")
+            parsed[key] = int(match[key])
+            if not 1 <= parsed[key] <= 65535:
+                raise ValueError(f"Class {label}: ports must be 1-65535")
+    if match.get('dscp') not in (None, ''):
+        parsed['dscp'] = int(match['dscp'])
+        if not 0 <= parsed['dscp'] <= 63:
+            raise ValueError(f"Class {label}: dscp must be 0-63")
+    return parsed
+
+
+def build_profile_tree(profile):
+    """Desired tree for per-flow shaping, as a parents-first node list
+
+    Every traffic class gets an HTB class (plus a netem child for delay,
+    jitter or loss) and filters steering its matches into it; traffic that
+    matches no class goes to class 1:1 shaped by `profile['default']`.
+    Raises ValueError/TypeError on invalid values.
+    """
+    classes = profile.get('classes') or []
+    if len(classes) > MAX_CLASSES:
+        raise ValueError(f"At most {MAX_CLASSES} classes per interface")
+    classifier = profile.get('classifier') or TC_CLASSIFIER
+    if classifier not in CLASSIFIERS:
+        raise ValueError(f"Unknown classifier '{classifier}', expected one of: {', '.join(CLASSIFIERS)}")
+
+    tree = [_node('qdisc', 'htb', ROOT_HANDLE, 'root', {'default': 1})]
+    matches = []
+    for minor, rules in enumerate([profile.get('default') or {}] + classes, start=1):
+        classid = f'1:{minor:x}'
+        bandwidth = int(rules.get('bandwidth') or 0)
+        # Classes without a bandwidth limit still need an HTB rate
+        rate = (bandwidth if bandwidth > 0 else TC_MAX_RATE) * 1000000
+        tree.append(_node('class', 'htb', classid, ROOT_HANDLE, {'rate': rate, 'ceil': rate}))
+        netem = _impairment(rules)
+        if netem:
+            tree.append(_node('qdisc', 'netem', f'{0x10 + minor - 1:x}:', classid, netem))
+
+        if minor > 1:
+            label = rules.get('name') or classid
+            class_matches = rules.get('match')
+            if isinstance(class_matches, dict):
+                class_matches = [class_matches]
+            if not class_matches:
+                raise ValueError(f"Class {label} has no match")
+            matches.extend((classid, parse_match(match, label)) for match in class_matches)
+
+    if classifier == 'flower':
+        tree.extend(_filter_node('flower', str(index), dict(match, classid=classid))
+                    for index, (classid, match) in enumerate(matches, start=1))
+    else:
+        tree.extend(_u32_filters(matches))
+    return tree
+
+
+def _u32_keys(match):
+    return [[key, match[key]] for key in MATCH_FIELDS if key in match]
+
+
+def _u32_filters(matches):
+    """u32 filters for (classid, match) pairs
+
+    With U32_HASH_THRESHOLD or more destination matches of /24 or longer,
+    those go into a 256 bucket hash table keyed on one destination octet
+    (the last if all are /32 hosts, the third otherwise), so the kernel
+    inspects one bucket per packet instead of every filter. The rest is
+    matched linearly in the root table, before the hash table link.
+    """
+    hashable = [(classid, match) for classid, match in matches
+                if ipaddress.IPv4Network(match.get('dst', '0.0.0.0/0')).prefixlen >= 24]
+    if len(hashable) < U32_HASH_THRESHOLD:
+        hashable = []
+
+    octet = 3 if all(match['dst'].endswith('/32') for _, match in hashable) else 2
+    filters = []
+    if hashable:
+        filters.append(_filter_node('u32', U32_HASH_TABLE, {'divisor': 256}))
+        for classid, match in hashable:
+            bucket = ipaddress.IPv4Network(match['dst']).network_address.packed[octet]
+            filters.append(_filter_node('u32', None, {'ht': f'{U32_HASH_TABLE}{bucket:x}:',
+                                                      'match': _u32_keys(match), 'classid': classid}))
+
+    filters.extend(_filter_node('u32', None, {'match': _u32_keys(match), 'classid': classid})
+                   for classid, match in matches if (classid, match) not in hashable)
+
+    if hashable:
+        # Destination address is at offset 16 of the IPv4 header
+        filters.append(_filter_node('u32', None, {
+            'ht': U32_ROOT_TABLE,
+            'match': [['dst', '0.0.0.0/0']],
+            'hashkey': {'mask': 0xff << (8 * (3 - octet)), 'at': 16},
+            'link': U32_HASH_TABLE
+        }))
+    return filters
+
+
+def ifb_name(interface):
+    """IFB device carrying an interface's ingress traffic, within the kernel's name limit"""
+    name = IFB_PREFIX + interface
+    if len(name) > IFNAMSIZ:
+        name = IFB_PREFIX + hashlib.sha1(interface.encode()).hexdigest()[:IFNAMSIZ - len(IFB_PREFIX)]
+    return name
+
+
+def has_redirect(backend, dev, qdiscs, dumped=None):
+    """True if dev's ingress qdisc (in its `qdiscs`) has a matchall redirect filter
+
+    `dumped` can be dev's entry of an earlier list_tc() dump.
+    """
+    if not any(qdisc['parent'] == INGRESS_PARENT for qdisc in qdiscs):
+        return False
+    if dumped is not None and INGRESS_HANDLE in dumped['filters']:
+        filters = dumped['filters'][INGRESS_HANDLE]
+    else:
+        filters = backend.get_filters(dev, INGRESS_HANDLE)
+    return any(entry['kind'] == 'matchall' for entry in filters)
+
+
+def plan_redirect(batch, dev, ifb):
+    """Queue an ingress qdisc on dev redirecting all traffic to ifb (replacing any other ingress qdisc)"""
+    batch.qdisc('del', dev, INGRESS_PARENT, handle=INGRESS_HANDLE, ignore_errors=True)
+    batch.qdisc('add', dev, INGRESS_PARENT, 'ingress', handle=INGRESS_HANDLE)
+    batch.tfilter('add', dev, INGRESS_HANDLE, 'matchall', prio=INGRESS_PRIO, protocol='all',
+                  options={'redirect': ifb})
+
+
+def read_tree(backend, dev, qdiscs=None, dumped=None):
+    """Current qdisc tree of an interface as reported by the kernel
+
+    `qdiscs` can be the interface's entries of an earlier list_qdiscs() dump,
+    `dumped` its entry of an earlier list_tc() dump.
+    """
+    tree = []
+    if qdiscs is None:
+        qdiscs = backend.get_qdiscs(dev)
+    for qdisc in qdiscs:
+        # Handle 0: is the kernel default (pfifo_fast, noqueue, builtin leaf qdiscs)
+        # and the ingress qdisc isn't part of the (egress) tree
+        if qdisc['handle'] in (None, '0:') or qdisc['parent'] == INGRESS_PARENT:
+            continue
+        tree.append(_node('qdisc', qdisc['kind'], qdisc['handle'], qdisc['parent'], qdisc['options']))
+
+    if any(node['kind'] == 'htb' for node in tree):
+        if dumped is None or ROOT_HANDLE not in dumped['filters']:
+            dumped = {'classes': backend.get_classes(dev),
+                      'filters': {ROOT_HANDLE: backend.get_filters(dev, ROOT_HANDLE)}}
+        for cls in dumped['classes']:
+            tree.append(_node('class', cls['kind'], cls['handle'], cls['parent'], cls['options']))
+        # Filter options aren't read back, only whether there are any
+        for entry in dumped['filters'][ROOT_HANDLE]:
+            node = _filter_node(entry['kind'], entry['handle'], {})
+            node['prio'] = entry['prio']
+            tree.append(node)
+    return tree
+
+
+def _root(tree):
+    return next((node for node in tree if node['type'] == 'qdisc' and node['parent'] == 'root'), None)
+
+
+def _key(node):
+    return node['type'], node['handle']
+
+
+def options_differ(desired, current):
+    """True if any desired option differs from the current value beyond tolerance"""
+    for key, value in desired.items():
+        actual = current.get(key, 0) or 0
+        if isinstance(value, (int, float)):
+            if abs(value - actual) > max(1e-6, abs(value) * _TOLERANCE):
+                return True
+        elif value != actual:
+            return True
+    return False
+
+
+def _queue(batch, action, dev, node):
+    if node['type'] == 'qdisc':
+        batch.qdisc(action, dev, node['parent'], node['kind'], handle=node['handle'], options=node['options'])
+    elif node['type'] == 'filter':
+        batch.tfilter(action, dev, node['parent'], node['kind'], prio=node['prio'], handle=node['handle'],
+                      options=node['options'])
+    else:
+        batch.tclass(action, dev, node['parent'], node['handle'], node['kind'], options=node['options'])
+
+
+def _split_filters(tree):
+    return ([node for node in tree if node['type'] != 'filter'],
+            [node for node in tree if node['type'] == 'filter'])
+
+
+def plan_changes(batch, dev, current, desired, applied=None):
+    """Queue the minimal operations turning `current` into `desired`, returns how many
+
+    Filters can't be read back in full, so they are compared with `applied`
+    (the tree this controller last applied, None if unknown) and replaced
+    as a group whenever they differ.
+    """
+    queued = len(batch)
+    current, current_filters = _split_filters(current)
+    desired, desired_filters = _split_filters(desired)
+    applied_filters = _split_filters(applied or [])[1]
+    current_root, desired_root = _root(current), _root(desired)
+
+    if not desired:
+        if current_root is not None:
+            batch.qdisc('del', dev, 'root')
+        return len(batch) - queued
+
+    if current_root is None or current_root['handle'] != desired_root['handle'] \
+            or current_root['kind'] != desired_root['kind']:
+        # Different tree shape at the root: rebuild it in one go
+        if current_root is not None and current_root['handle'] == desired_root['handle']:
+            # Same handle with a different kind can't be replaced in place
+            batch.qdisc('del', dev, 'root')
+            action = 'add'
+        else:
+            action = 'replace'
+        _queue(batch, action, dev, desired_root)
+        for node in desired + desired_filters:
+            if node is not desired_root:
+                _queue(batch, 'add', dev, node)
+        return len(batch) - queued
+
+    filters_changed = desired_filters != applied_filters or not current_filters
+    if current_filters and (not desired_filters or filters_changed):
+        # Unhook the old filters before classes they point to change
+        batch.tfilter('del', dev, ROOT_HANDLE)
+
+    current_nodes = {_key(node): node for node in current}
+    desired_nodes = {_key(node): node for node in desired}
+
+    # Remove nodes that are gone or moved, children (qdiscs) before classes
+    for node in sorted(current, key=lambda n: n['type'] != 'qdisc'):
+        wanted = desired_nodes.get(_key(node))
+        if node is current_root or (wanted and wanted['parent'] == node['parent']
+                                    and wanted['kind'] == node['kind']):
+            continue
+        if node['type'] == 'qdisc':
+            batch.qdisc('del', dev, node['parent'], handle=node['handle'])
+        else:
+            batch.tclass('del', dev, node['parent'], node['handle'])
+        current_nodes.pop(_key(node), None)
+
+    # Change what differs, add what is missing (desired is parents first)
+    for node in desired:
+        existing = current_nodes.get(_key(node))
+        if existing is None:
+            _queue(batch, 'add', dev, node)
+        elif options_differ(node['options'], existing['options']):
+            _queue(batch, 'change', dev, node)
+
+    if desired_filters and filters_changed:
+        for node in desired_filters:
+            _queue(batch, 'add', dev, node)
+
+    return len(batch) - queued
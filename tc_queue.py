@@ -0,0 +1,230 @@
+"""
+Coalescing queue for TC rule updates - rapid updates to the same interface
+(a dragged slider in the UI) are merged last-writer-wins within a short
+window and reach the kernel as one reconfiguration, tracked as jobs
+"""
+
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from config import TC_COALESCE_WINDOW, TC_JOB_HISTORY
+from tc_model import DIRECTIONS, build_tree
+
+_SIDES = {'egress': ('egress',), 'ingress': ('ingress',), 'both': ('egress', 'ingress')}
+
+
+class TCJob:
+    """One submitted update; `future` resolves to (success, message) once it is applied or superseded"""
+
+    def __init__(self, job_id, bridge, rules, interfaces, direction):
+        self.id = job_id
+        self.bridge = bridge
+        self.rules = rules
+        self.interfaces = interfaces
+        self.direction = direction
+        self.state = 'queued'
+        self.message = None
+        self.superseded_by = None
+        self.submitted = time.time()
+        self.finished = None
+        self.future = Future()
+        # (interface, side) entries still waiting for this job in the queue
+        self.pending = 0
+
+    def finish(self, state, success, message):
+        if self.future.done():
+            return
+        self.state = state
+        self.message = message
+        self.finished = time.time()
+        self.future.set_result((success, message))
+
+    def status(self):
+        return {
+            'id': self.id,
+            'bridge': self.bridge,
+            'interfaces': self.interfaces,
+            'direction': self.direction,
+            'rules': self.rules,
+            'state': self.state,
+            'message': self.message,
+            'superseded_by': self.superseded_by,
+            'submitted': self.submitted,
+            'finished': self.finished
+        }
+
+
+def _apply_calls(bridge, calls, jobs):
+    """Run merged apply_tc_rules calls on a bridge (in a worker, under its lock)"""
+    for job in jobs:
+        if not job.future.done():
+            job.state = 'running'
+    return [bridge.apply_tc_rules({**rules, 'interfaces': interfaces, 'direction': direction})
+            for rules, interfaces, direction in calls]
+
+
+class TCUpdateQueue:
+    """Per-interface update queue in front of NetworkBridge.apply_tc_rules
+
+    Updates wait in a per-bridge map keyed by (interface, egress/ingress):
+    a newer update for the same key replaces the older one, which is
+    reported as superseded once nothing of it is left. `window` seconds
+    after the first waiting update the map is flushed as one bridge
+    operation (serialized with all others by the bridge lock), and updates
+    with identical rules share one apply_tc_rules call.
+    """
+
+    def __init__(self, submit, window=TC_COALESCE_WINDOW, history=TC_JOB_HISTORY):
+        self._submit = submit
+        self.window = window
+        self.history = history
+        self._ids = itertools.count(1)
+        self._jobs = OrderedDict()
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.superseded = 0
+        self.flushes = 0
+        self.applies = 0
+
+    def submit(self, bridge, rules):
+        """Queue filtered TC rules ({..., 'interfaces', 'direction'}) for a bridge, returns the TCJob"""
+        interfaces = list(dict.fromkeys(rules.get('interfaces') or []))
+        direction = rules.get('direction') or 'egress'
+        values = {k: v for k, v in rules.items()
+                  if k not in ('interfaces', 'direction') and v is not None and v != ''}
+        with self._lock:
+            job = TCJob(next(self._ids), bridge, values, interfaces, direction)
+            self._remember(job)
+            self.submitted += 1
+
+        error = None
+        if not interfaces:
+            error = "No interfaces selected for TC rules"
+        elif direction not in DIRECTIONS:
+            error = f"Invalid direction '{direction}', expected one of {', '.join(DIRECTIONS)}"
+        else:
+            try:
+                # Rejected now, so an invalid update never supersedes a valid one
+                build_tree(values)
+            except (ValueError, TypeError) as e:
+                error = f"Invalid TC rule values: {str(e)}"
+        if error:
+            job.finish('failed', False, error)
+            return job
+
+        with self._lock:
+            pending = self._pending.setdefault(bridge, {})
+            for interface in interfaces:
+                for side in _SIDES[direction]:
+                    older = pending.get((interface, side))
+                    if older is not None and older is not job:
+                        self._release(older, job.id)
+                    pending[(interface, side)] = job
+                    job.pending += 1
+            if bridge not in self._timers:
+                timer = threading.Timer(self.window, self._flush, (bridge,))
+                timer.daemon = True
+                self._timers[bridge] = timer
+                timer.start()
+        return job
+
+    def supersede(self, bridge, interfaces=None, by='a direct operation'):
+        """Drop waiting updates of a bridge (only for `interfaces` if given), e.g. before a bulk apply"""
+        with self._lock:
+            pending = self._pending.get(bridge, {})
+            for key in [key for key in pending if interfaces is None or key[0] in interfaces]:
+                self._release(pending.pop(key), by)
+
+    def _release(self, job, by):
+        # Lock held: one of the job's entries was taken over
+        job.pending -= 1
+        if job.pending == 0:
+            job.superseded_by = by
+            self.superseded += 1
+            by = f"job {by}" if isinstance(by, int) else by
+            job.finish('superseded', True, f"Superseded by {by}")
+
+    def _remember(self, job):
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.history:
+            self._jobs.popitem(last=False)
+
+    def _flush(self, bridge):
+        with self._lock:
+            pending = self._pending.pop(bridge, {})
+            self._timers.pop(bridge, None)
+            if not pending:
+                return
+            self.flushes += 1
+
+        # Sides of each interface per distinct rule set, then one call per rules and direction
+        targets = {}
+        # Interfaces each job still has in this flush (others were superseded)
+        applied = {}
+        for (interface, side), job in pending.items():
+            applied.setdefault(job, set()).add(interface)
+            key = json.dumps(job.rules, sort_keys=True)
+            target = targets.setdefault((key, interface), {'rules': job.rules, 'sides': set(), 'jobs': set()})
+            target['sides'].add(side)
+            target['jobs'].add(job)
+        merged = {}
+        for (key, interface), target in targets.items():
+            direction = 'both' if len(target['sides']) == 2 else next(iter(target['sides']))
+            call = merged.setdefault((key, direction), {'rules': target['rules'], 'direction': direction,
+                                                        'interfaces': [], 'jobs': set()})
+            call['interfaces'].append(interface)
+            call['jobs'] |= target['jobs']
+        calls = list(merged.values())
+        jobs = set().union(*(call['jobs'] for call in calls))
+        with self._lock:
+            self.applies += len(calls)
+
+        def done(future):
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [(False, f"Error applying TC rules: {e}")] * len(calls)
+            if not isinstance(results, list):
+                # The bridge refused the operation itself (e.g. no longer managed)
+                results = [results] * len(calls)
+            failures = {}
+            for call, (success, message) in zip(calls, results):
+                if not success:
+                    for job in call['jobs']:
+                        failures.setdefault(job, []).append(message)
+            for job in jobs:
+                if job in failures:
+                    job.finish('failed', False, '; '.join(failures[job]))
+                elif job.rules:
+                    job.finish('done', True, f"TC rules applied successfully to {len(applied[job])} interfaces")
+                else:
+                    job.finish('done', True, f"TC rules cleared from {len(applied[job])} interfaces")
+
+        future = self._submit(bridge, _apply_calls, [(call['rules'], call['interfaces'], call['direction'])
+                                                     for call in calls], jobs)
+        future.add_done_callback(done)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def recent(self, limit=50):
+        with self._lock:
+            return [job.status() for job in list(self._jobs.values())[-limit:]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'window': self.window,
+                'waiting': sum(len(pending) for pending in self._pending.values()),
+                'submitted': self.submitted,
+                'superseded': self.superseded,
+                'flushes': self.flushes,
+                'applies': self.applies
+            }
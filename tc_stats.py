@@ -0,0 +1,151 @@
+"""
+Structured tc statistics - the qdisc/class tree of every link with its
+counters and per-second rates, dumped on a fixed interval and served from cache
+"""
+
+import threading
+import time
+
+from config import TC_STATS_INTERVAL
+from stats import counter_delta
+
+# Qdiscs whose classes are dumped (the others have none worth showing)
+CLASSFUL_KINDS = ('htb', 'hfsc', 'drr', 'qfq', 'prio', 'ets', 'multiq')
+RATE_COUNTERS = ('bytes', 'packets', 'drops', 'overlimits', 'requeues')
+
+
+def compute_rates(current, previous, elapsed):
+    """Per-second rates of RATE_COUNTERS between two stats dicts"""
+    return {f'{key}_per_sec': round(counter_delta(current.get(key, 0), previous.get(key, 0)) / elapsed, 1)
+            for key in RATE_COUNTERS}
+
+
+def build_stats_tree(qdiscs, classes, rates=None):
+    """Nest qdiscs and classes by parent handle
+
+    Each node is {'type', 'kind', 'handle', 'parent', 'options', 'stats',
+    'rates', 'children'}; rates is None until a previous dump exists.
+    Returns the root nodes (root and ingress qdiscs, or orphans).
+    """
+    rates = rates or {}
+    nodes = {}
+    order = []
+    for node_type, entries in (('qdisc', qdiscs), ('class', classes)):
+        for entry in entries:
+            node = {
+                'type': node_type,
+                'kind': entry['kind'],
+                'handle': entry['handle'],
+                'parent': entry['parent'],
+                'options': entry['options'],
+                'stats': entry['stats'],
+                'rates': rates.get((node_type, entry['handle'])),
+                'children': []
+            }
+            nodes[(node_type, entry['handle'])] = node
+            order.append(node)
+
+    roots = []
+    for node in order:
+        # A class hangs off its parent class or its qdisc, a qdisc off a class
+        parent = nodes.get(('class', node['parent']))
+        if parent is None and node['type'] == 'class':
+            parent = nodes.get(('qdisc', node['parent']))
+        if parent is None or parent is node:
+            roots.append(node)
+        else:
+            parent['children'].append(node)
+    return roots
+
+
+class TCStatsCache:
+    """Qdisc and class statistics of every link
+
+    Qdiscs of all links come from one backend dump; classes are dumped only
+    for links with a classful qdisc. Refreshes run on the I/O pool every
+    TC_STATS_INTERVAL seconds, driven by the stats sampler.
+    """
+
+    def __init__(self, backend, pool=None, interval=TC_STATS_INTERVAL):
+        self.backend = backend
+        self.pool = pool
+        self.interval = interval
+        self._qdiscs = {}
+        self._trees = {}
+        self._previous = {}
+        self._timestamp = None
+        self._updated = None
+        self._due = 0.0
+        self._future = None
+        self._lock = threading.Lock()
+
+    def update(self, sample=None):
+        """Sampler listener: start a refresh if one is due and none is running"""
+        now = time.monotonic()
+        if now < self._due or (self._future is not None and not self._future.done()):
+            return
+        self._due = now + self.interval
+        if self.pool is not None:
+            self._future = self.pool.submit(self.refresh)
+        else:
+            self.refresh()
+
+    def refresh(self):
+        """Dump qdiscs and classes now and rebuild every tree"""
+        try:
+            qdiscs = self.backend.list_qdiscs()
+            classes = {dev: self.backend.get_classes(dev) for dev, entries in qdiscs.items()
+                       if any(qdisc['kind'] in CLASSFUL_KINDS for qdisc in entries)}
+        except Exception as e:
+            print(f"Error reading tc stats: {e}")
+            return
+        now = time.monotonic()
+
+        counters = {}
+        rates = {}
+        elapsed = now - self._timestamp if self._timestamp is not None else 0
+        for dev in qdiscs:
+            dev_rates = rates[dev] = {}
+            for node_type, entries in (('qdisc', qdiscs[dev]), ('class', classes.get(dev, []))):
+                for entry in entries:
+                    key = (dev, node_type, entry['handle'])
+                    counters[key] = entry['stats']
+                    previous = self._previous.get(key)
+                    if previous is not None and elapsed > 0:
+                        dev_rates[(node_type, entry['handle'])] = compute_rates(entry['stats'], previous, elapsed)
+
+        trees = {dev: build_stats_tree(qdiscs[dev], classes.get(dev, []), rates[dev]) for dev in qdiscs}
+        with self._lock:
+            self._qdiscs = qdiscs
+            self._trees = trees
+            self._previous = counters
+            self._timestamp = now
+            self._updated = time.time()
+
+    def qdiscs(self):
+        """Flat qdisc list of the last dump as {name: [qdisc, ...]}"""
+        with self._lock:
+            return self._qdiscs
+
+    def _ensure_loaded(self):
+        if self._timestamp is None:
+            if self.pool is not None:
+                self.pool.run(self.refresh)
+            else:
+                self.refresh()
+
+    def get(self, interface):
+        """Tree of one interface with its dump time, None if unknown"""
+        self._ensure_loaded()
+        with self._lock:
+            tree = self._trees.get(interface)
+            if tree is None:
+                return None
+            return {'interface': interface, 'updated': self._updated, 'interval': self.interval, 'qdiscs': tree}
+
+    def all(self):
+        """Trees of every interface"""
+        self._ensure_loaded()
+        with self._lock:
+            return {'updated': self._updated, 'interval': self.interval,
+                    'interfaces': {dev: tree for dev, tree in sorted(self._trees.items())}}
@@ -0,0 +1,102 @@
+"""
+Tests for the bridge controller against the fake backend: bulk apply
+rollback, restoring stored state and IFB ingress shaping
+"""
+
+import config
+
+# Never touch the real kernel or state database
+config.BACKEND = 'fake'
+config.STATE_DB = None
+
+import app
+from backends import FakeBackend
+from store import StateStore
+from tc_model import read_tree
+
+
+def make_manager(backend, store=None):
+    """BridgeManager of a single br0 over `backend`"""
+    manager = app.BridgeManager(backend=backend, bridges={'br0': None}, store=store)
+    manager.topology.start()
+    return manager
+
+
+def create_bridge(manager, interfaces=('eth0', 'eth1')):
+    assert manager.wait(manager.create('br0', list(interfaces))) == (True, "Bridge created successfully")
+    return manager.get('br0')
+
+
+def test_bulk_apply_rolls_back_changed_interfaces():
+    backend = FakeBackend(interfaces=['eth0', 'eth1'])
+    manager = make_manager(backend)
+    bridge = create_bridge(manager)
+    assert bridge.apply_tc_rules({'interfaces': ['eth0'], 'bandwidth': 10})[0]
+    before = {interface: read_tree(backend, interface) for interface in ('eth0', 'eth1')}
+
+    success, message, results = bridge.apply_tc_bulk(
+        {'eth0': {'bandwidth': 20}, 'eth1': {'delay': 5}, 'nope': {'bandwidth': 5}}, manager.tc_pool)
+
+    assert not success
+    assert message == "Error applying TC rules to nope; 2 changed interfaces rolled back"
+    assert results['eth0']['rolled_back'] and results['eth1']['rolled_back']
+    assert not results['nope']['changed'] and not results['nope']['rolled_back']
+    assert {interface: read_tree(backend, interface) for interface in ('eth0', 'eth1')} == before
+    assert list(bridge.tc_state) == ['eth0']
+
+
+def test_bulk_apply_commits_when_every_interface_succeeds():
+    backend = FakeBackend(interfaces=['eth0', 'eth1'])
+    manager = make_manager(backend)
+    bridge = create_bridge(manager)
+
+    success, message, results = bridge.apply_tc_bulk(
+        {'eth0': {'bandwidth': 20}, 'eth1': {'delay': 5}}, manager.tc_pool)
+
+    assert (success, message) == (True, "TC rules applied to 2 interfaces")
+    assert all(result['success'] for result in results.values())
+    assert sorted(bridge.tc_state) == ['eth0', 'eth1']
+
+
+def test_restore_reapplies_stored_state(tmp_path):
+    path = str(tmp_path / 'state.db')
+    manager = make_manager(FakeBackend(interfaces=['eth0', 'eth1']), StateStore(path))
+    bridge = create_bridge(manager)
+    assert bridge.apply_tc_rules({'interfaces': ['eth0'], 'bandwidth': 10, 'direction': 'ingress'})[0]
+    assert bridge.apply_tc_rules({'interfaces': ['eth1'], 'delay': 5})[0]
+    trees = dict(bridge.tc_state)
+
+    # Restart against a kernel that lost everything
+    backend = FakeBackend(interfaces=['eth0', 'eth1'])
+    manager = make_manager(backend, StateStore(path))
+    assert manager.restore() == {'br0': (True, "bridge recreated; TC rules re-applied on 2 of 2 interfaces; "
+                                               "ingress redirects restored on eth0")}
+    bridge = manager.get('br0')
+    assert bridge.is_active and sorted(bridge.interfaces) == ['eth0', 'eth1']
+    assert bridge.tc_state == trees
+    assert read_tree(backend, 'eth1') == trees['eth1']
+
+    # Nothing left to do the second time
+    executed = len(backend.executed)
+    assert manager.restore()['br0'] == (True, "TC rules re-applied on 0 of 2 interfaces")
+    assert len(backend.executed) == executed
+
+
+def test_ingress_shaping_sets_up_and_tears_down_ifb():
+    backend = FakeBackend(interfaces=['eth0', 'eth1'])
+    manager = make_manager(backend)
+    bridge = create_bridge(manager)
+
+    assert bridge.apply_tc_rules({'interfaces': ['eth0'], 'bandwidth': 10, 'direction': 'ingress'})[0]
+    assert backend.links['ifb-eth0']['kind'] == 'ifb'
+    assert [qdisc['kind'] for qdisc in backend.qdiscs['eth0']] == ['ingress']
+    [redirect] = backend.filters['eth0']
+    assert (redirect['kind'], redirect['options']) == ('matchall', {'redirect': 'ifb-eth0'})
+    assert list(bridge.tc_state) == ['ifb-eth0']
+
+    assert bridge.apply_tc_rules({'interfaces': ['eth0'], 'direction': 'ingress'})[0]
+    assert not backend.qdiscs.get('eth0') and not backend.filters.get('eth0')
+    assert bridge.tc_state == {}
+
+    assert manager.wait(manager.destroy('br0'))[0]
+    assert sorted(backend.links) == ['eth0', 'eth1']
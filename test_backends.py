@@ -0,0 +1,16 @@
+"""
+Tests for rendering filter options as tc arguments
+"""
+
+from backends import filter_option_args
+
+
+def test_flower_ip_proto_names():
+    for protocol, name in ((6, 'tcp'), (17, 'udp'), (132, 'sctp')):
+        args = filter_option_args('flower', {'protocol': protocol, 'dport': 53, 'classid': '1:10'})
+        assert args == ['ip_proto', name, 'dst_port', '53', 'classid', '1:10']
+
+
+def test_flower_ip_proto_other_is_hex():
+    # tc parses a numeric ip_proto as hex: 47 (GRE) must be 0x2f
+    assert filter_option_args('flower', {'protocol': 47}) == ['ip_proto', '0x2f']
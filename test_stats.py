@@ -0,0 +1,22 @@
+"""
+Tests for counter deltas across 32-bit wraps and interface resets
+"""
+
+from stats import counter_delta
+
+
+def test_counter_delta_increase():
+    assert counter_delta(1500, 1000) == 500
+
+
+def test_counter_delta_32bit_wrap():
+    assert counter_delta(100, 2 ** 32 - 400) == 500
+
+
+def test_counter_delta_reset():
+    # A recreated interface starts again from zero, not a 32-bit wrap
+    assert counter_delta(100, 5_000_000) == 100
+
+
+def test_counter_delta_64bit_reset():
+    assert counter_delta(100, 2 ** 40) == 100
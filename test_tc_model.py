@@ -0,0 +1,42 @@
+"""
+Tests for incremental qdisc tree updates against the fake backend
+"""
+
+from backends import FakeBackend
+from tc_model import build_tree, plan_changes, read_tree
+
+
+def apply(backend, desired, applied=None):
+    """Plan and run the changes to `desired` on eth0, returns the planned operations"""
+    batch = backend.batch()
+    plan_changes(batch, 'eth0', read_tree(backend, 'eth0'), desired, applied)
+    assert batch.run() == []
+    return [(op['op'], op['action'], op['kind']) for op in batch.ops]
+
+
+def test_plan_changes_builds_tree_once():
+    backend = FakeBackend(interfaces=['eth0'])
+    ops = apply(backend, build_tree({'bandwidth': 10, 'delay': 5}))
+    assert ('qdisc', 'replace', 'htb') in ops
+    assert ('class', 'add', 'htb') in ops
+    assert ('qdisc', 'add', 'netem') in ops
+
+
+def test_plan_changes_only_changes_modified_nodes():
+    backend = FakeBackend(interfaces=['eth0'])
+    first = build_tree({'bandwidth': 10, 'delay': 5})
+    apply(backend, first)
+
+    assert apply(backend, build_tree({'bandwidth': 20, 'delay': 5}), first) == [('class', 'change', 'htb')]
+    assert apply(backend, build_tree({'bandwidth': 20, 'delay': 8}), first) == [('qdisc', 'change', 'netem')]
+    assert backend.executed[-1] == 'tc qdisc change dev eth0 parent 1:1 handle 10: netem delay 8ms'
+
+
+def test_plan_changes_nothing_for_unchanged_tree():
+    backend = FakeBackend(interfaces=['eth0'])
+    tree = build_tree({'bandwidth': 10, 'delay': 5})
+    apply(backend, tree)
+    executed = len(backend.executed)
+
+    assert apply(backend, tree, tree) == []
+    assert len(backend.executed) == executed
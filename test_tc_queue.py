@@ -0,0 +1,89 @@
+"""
+Tests for coalescing TC updates in the per-interface queue
+"""
+
+from concurrent.futures import Future
+
+from tc_queue import TCUpdateQueue
+
+
+class RecordingBridge:
+    """Stands in for NetworkBridge, records every apply_tc_rules call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_tc_rules(self, rules):
+        self.calls.append(rules)
+        return True, "ok"
+
+
+def make_queue():
+    bridge = RecordingBridge()
+
+    def submit(name, operation, *args):
+        future = Future()
+        future.set_result(operation(bridge, *args))
+        return future
+    return TCUpdateQueue(submit, window=0.05), bridge
+
+
+def test_updates_to_one_interface_coalesce():
+    queue, bridge = make_queue()
+    jobs = [queue.submit('br0', {'interfaces': ['eth0'], 'bandwidth': rate}) for rate in (10, 20, 30)]
+
+    assert jobs[-1].future.result(timeout=2) == (True, "TC rules applied successfully to 1 interfaces")
+    assert [job.state for job in jobs] == ['superseded', 'superseded', 'done']
+    assert jobs[0].superseded_by == jobs[1].id
+    assert bridge.calls == [{'bandwidth': 30, 'interfaces': ['eth0'], 'direction': 'egress'}]
+    stats = queue.stats()
+    assert (stats['submitted'], stats['superseded'], stats['flushes'], stats['applies']) == (3, 2, 1, 1)
+
+
+def test_identical_rules_share_one_call():
+    queue, bridge = make_queue()
+    first = queue.submit('br0', {'interfaces': ['eth0'], 'bandwidth': 10})
+    second = queue.submit('br0', {'interfaces': ['eth1'], 'bandwidth': 10})
+
+    assert first.future.result(timeout=2)[0] and second.future.result(timeout=2)[0]
+    assert len(bridge.calls) == 1
+    assert sorted(bridge.calls[0]['interfaces']) == ['eth0', 'eth1']
+
+
+def test_repeated_interfaces_dont_supersede_the_job():
+    queue, bridge = make_queue()
+    job = queue.submit('br0', {'interfaces': ['eth0', 'eth0', 'eth1'], 'bandwidth': 10})
+
+    assert job.interfaces == ['eth0', 'eth1']
+    assert job.future.result(timeout=2) == (True, "TC rules applied successfully to 2 interfaces")
+    assert job.state == 'done'
+    assert len(bridge.calls) == 1
+
+
+def test_partly_superseded_job_reports_its_interfaces():
+    queue, bridge = make_queue()
+    first = queue.submit('br0', {'interfaces': ['eth0', 'eth1'], 'bandwidth': 10})
+    second = queue.submit('br0', {'interfaces': ['eth1'], 'bandwidth': 20})
+
+    assert first.future.result(timeout=2) == (True, "TC rules applied successfully to 1 interfaces")
+    assert second.future.result(timeout=2) == (True, "TC rules applied successfully to 1 interfaces")
+    assert len(bridge.calls) == 2
+
+
+def test_supersede_drops_waiting_updates():
+    queue, bridge = make_queue()
+    job = queue.submit('br0', {'interfaces': ['eth0'], 'bandwidth': 10})
+    queue.supersede('br0', by='a bulk apply')
+
+    assert job.future.result(timeout=2) == (True, "Superseded by a bulk apply")
+    assert bridge.calls == []
+
+
+def test_invalid_update_fails_without_superseding():
+    queue, bridge = make_queue()
+    valid = queue.submit('br0', {'interfaces': ['eth0'], 'bandwidth': 10})
+    invalid = queue.submit('br0', {'interfaces': ['eth0'], 'bandwidth': 'fast'})
+
+    assert invalid.future.result(timeout=2)[0] is False
+    assert valid.future.result(timeout=2)[0] is True
+    assert len(bridge.calls) == 1
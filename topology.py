@@ -0,0 +1,171 @@
+"""
+Cached link/bridge/address topology - loaded once from the backend and kept
+current by rtnetlink multicast events, so status queries never touch the kernel
+"""
+
+import errno
+import socket
+import threading
+
+import netlink
+
+
+class TopologyCache:
+    """Links (operstate, kind, master) and IPv4 addresses of every interface
+
+    With a live backend a thread listens on RTNLGRP_LINK and
+    RTNLGRP_IPV4_IFADDR and applies each event as it arrives. Without one
+    (fake backend, or netlink unavailable) the cache only changes through
+    refresh(), which the controller calls after its own changes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._links = {}
+        self._addresses = {}
+        self._names = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._socket = None
+        self._thread = None
+
+    def add_listener(self, callback):
+        """Call `callback()` whenever the topology changed"""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Subscribe to link/address events and load the initial state"""
+        if self._thread is not None:
+            return
+        if self.backend.live:
+            try:
+                self._socket = netlink.NetlinkSocket(groups=netlink.RTMGRP_LINK | netlink.RTMGRP_IPV4_IFADDR)
+                # Wake up periodically so stop() is noticed
+                self._socket.sock.settimeout(1.0)
+            except OSError as e:
+                print(f"Error subscribing to netlink events: {e}")
+                self._socket = None
+
+        # Subscribed before the dump, so no change can fall in between
+        self.refresh()
+        if self._socket is not None:
+            self._thread = threading.Thread(target=self._run, args=(self._socket,),
+                                            name='topology-events', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop listening for events"""
+        self._socket = None
+
+    def refresh(self):
+        """Reload everything from the backend (startup, own changes, lost events)"""
+        try:
+            links = self.backend.list_links()
+            addresses = self.backend.list_addresses()
+        except Exception as e:
+            print(f"Error loading topology: {e}")
+            return
+
+        with self._lock:
+            self._links = {link['name']: dict(link) for link in links}
+            self._addresses = {name: list(addrs) for name, addrs in addresses.items()}
+            self._names = {link['index']: link['name'] for link in links}
+            self._loaded = True
+        self._notify()
+
+    def _run(self, sock):
+        while self._socket is sock:
+            try:
+                messages = sock.receive()
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # The kernel dropped events: start over from a full dump
+                    self.refresh()
+                    continue
+                print(f"Error reading netlink events: {e}")
+                break
+
+            with self._lock:
+                changed = [self._apply(msg_type, payload) for msg_type, payload in messages]
+            if any(changed):
+                self._notify()
+        sock.close()
+
+    def _apply(self, msg_type, payload):
+        """Apply one event to the cache, returns True if anything changed"""
+        if msg_type in (netlink.RTM_NEWLINK, netlink.RTM_DELLINK):
+            link = netlink.decode_link(payload)
+            old_name = self._names.get(link['index'])
+            if msg_type == netlink.RTM_DELLINK:
+                name = old_name or link['name']
+                self._links.pop(name, None)
+                self._addresses.pop(name, None)
+                self._names.pop(link['index'], None)
+                for other in self._links.values():
+                    if other['master'] == name:
+                        other['master'] = None
+                return True
+
+            link['master'] = self._names.get(link['master'])
+            if old_name is not None and old_name != link['name']:
+                # Renamed: carry the addresses over to the new name
+                self._links.pop(old_name, None)
+                self._addresses[link['name']] = self._addresses.pop(old_name, [])
+            if self._links.get(link['name']) == link:
+                return False
+            self._links[link['name']] = link
+            self._names[link['index']] = link['name']
+            return True
+
+        if msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+            index, address = netlink.decode_address(payload)
+            name = self._names.get(index)
+            if name is None or address is None:
+                return False
+            addresses = self._addresses.setdefault(name, [])
+            if msg_type == netlink.RTM_NEWADDR and address not in addresses:
+                addresses.append(address)
+                return True
+            if msg_type == netlink.RTM_DELADDR and address in addresses:
+                addresses.remove(address)
+                return True
+        return False
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in topology listener: {e}")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def links(self):
+        """All links as [{'name', 'index', 'operstate', 'master', 'kind'}]"""
+        self._ensure_loaded()
+        with self._lock:
+            return [dict(self._links[name]) for name in sorted(self._links)]
+
+    def get_link(self, name):
+        """A single link dict, or None if it does not exist"""
+        self._ensure_loaded()
+        with self._lock:
+            link = self._links.get(name)
+            return dict(link) if link is not None else None
+
+    def get_addresses(self, name):
+        """IPv4 addresses of a link in CIDR notation"""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._addresses.get(name, []))
+
+    def bridge_ports(self, bridge):
+        """Names of the links enslaved to a bridge"""
+        self._ensure_loaded()
+        with self._lock:
+            return sorted(name for name, link in self._links.items() if link['master'] == bridge)